@@ -30,7 +30,7 @@ class BasicParticipant(Participant):
     def __init__(self, pid, eventfile, datafile, fixfile, saccfile, segfile,
                  log_time_offset=None, aoifile=None, prune_length=None,
                  require_valid_segs=True, auto_partition_low_quality_segments=False,
-                 rpsdata=None, export_pupilinfo=False):
+                 rpsdata=None, export_pupilinfo=False, feature_families=None, raw_data_folder=None):
         """Inits BasicParticipant class
         Args:
             pid: Participant id
@@ -70,6 +70,12 @@ class BasicParticipant(Participant):
 
             rpsdata: rest pupil sizes for all scenes if available
 
+            feature_families: If not None, a set of feature families as returned by plan_features.
+                Only the features of these families are calculated.
+
+            raw_data_folder: If not None, a string containing the name of the folder to which the data
+                of the recording is exported (see Participant.write_raw_data)
+
         Yields:
             a BasicParticipant object
         """
@@ -136,7 +142,8 @@ class BasicParticipant(Participant):
                                                      prune_length=prune_length,
                                                      require_valid_segs=require_valid_segs,
                                                      auto_partition_low_quality_segments=auto_partition_low_quality_segments,
-                                                     rpsdata=rpsdata, export_pupilinfo=export_pupilinfo)
+                                                     rpsdata=rpsdata, export_pupilinfo=export_pupilinfo,
+                                                     feature_families=feature_families)
         # Sort segments by their starting timestamp
         all_segs = sorted(self.segments, key=lambda x: x.start)
 
@@ -144,9 +151,13 @@ class BasicParticipant(Participant):
         self.whole_scene = Scene(str(pid)+'_allsc', [], rec.all_data, rec.fix_data,
                                  saccade_data=rec.sac_data, event_data=rec.event_data,
                                  Segments=all_segs, aoilist=aois, prune_length=prune_length,
-                                 require_valid=require_valid_segs, export_pupilinfo=export_pupilinfo)
+                                 require_valid=require_valid_segs, export_pupilinfo=export_pupilinfo,
+                                 feature_families=feature_families, Scenes=self.scenes)
         self.scenes.insert(0, self.whole_scene)
 
+        if raw_data_folder is not None:
+            self.write_raw_data(raw_data_folder, rec)
+
         #Clean memory
         for sc in self.scenes:
             sc.clean_memory()
@@ -159,7 +170,8 @@ class BasicParticipant(Participant):
 
 def read_participants_Basic(datadir, user_list, pids, prune_length=None, aoifile=None,
                             log_time_offsets=None, require_valid_segs=True,
-                            auto_partition_low_quality_segments=False, rpsfile=None):
+                            auto_partition_low_quality_segments=False, rpsfile=None, feature_families=None,
+                            writers=None, raw_data_folder=None):
     """Generates list of Participant objects. Relevant information is read from input files
 
     Args:
@@ -194,8 +206,18 @@ def read_participants_Basic(datadir, user_list, pids, prune_length=None, aoifile
         rpsfile: If not None, a string containing the name of the '.tsv' file
             with rest pupil sizes for all scenes and for each user.
 
+        feature_families: If not None, a set of feature families as returned by plan_features.
+            Only the features of these families are calculated.
+
+        writers: If not None, a list of FeatureTSVWriter objects to which the features of each Participant are
+            written as soon as it is read. The "Participant"s are then not kept, so that memory does not
+            grow with the number of "Participant"s.
+
+        raw_data_folder: If not None, a string containing the name of the folder to which the data of each
+            recording is exported, in a sub-folder named after the user recording (e.g., "P16")
+
     Returns:
-        a list Participant objects
+        a list Participant objects (empty if writers is not None)
     """
     participants = []
     if log_time_offsets == None:    #setting the default offset which is 1 sec
@@ -230,12 +252,20 @@ def read_participants_Basic(datadir, user_list, pids, prune_length=None, aoifile
             sacfile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
             evefile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
             segfile = "{dir}/SMI_Sample_{rec}.seg".format(dir=datadir, rec=rec)
+        # the files may also be compressed (e.g. "P1_Data_Export.tsv.gz")
+        allfile, fixfile, sacfile, evefile, segfile = map(find_data_file, [allfile, fixfile, sacfile, evefile, segfile])
 
         if os.path.exists(allfile):
             p = BasicParticipant(rec, evefile, allfile, fixfile, sacfile, segfile, log_time_offset=offset,
                                  aoifile=aoifile, prune_length=prune_length, require_valid_segs=require_valid_segs,
-                                 auto_partition_low_quality_segments=auto_partition_low_quality_segments, rpsdata=currpsdata)
-            participants.append(p)
+                                 auto_partition_low_quality_segments=auto_partition_low_quality_segments, rpsdata=currpsdata,
+                                 feature_families=feature_families,
+                                 raw_data_folder=os.path.join(raw_data_folder, 'P'+str(rec)) if raw_data_folder is not None else None)
+            if writers:
+                for writer in writers:
+                    writer.write_participant(p)
+            else:
+                participants.append(p)
         else:
             warn("Error reading participant files for: "+str(pid))
     return participants
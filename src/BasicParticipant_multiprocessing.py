@@ -9,8 +9,9 @@ Institution: The University of British Columbia.
 """
 
 from math import ceil, floor
-from multiprocessing import Process, Queue
+from multiprocessing import Pool
 import os.path
+import sys, time, traceback
 
 params = __import__('params')
 from EMDAT_core.data_structures import *
@@ -31,7 +32,8 @@ class BasicParticipant(Participant):
     placeholder methods in the Participant class for a basic project
     """
     def __init__(self, pid, eventfile, datafile, fixfile, saccfile, segfile, log_time_offset = None, aoifile = None, prune_length= None,
-                 require_valid_segs = True, auto_partition_low_quality_segments = False, rpsdata = None, export_pupilinfo = False):
+                 require_valid_segs = True, auto_partition_low_quality_segments = False, rpsdata = None, export_pupilinfo = False,
+                 feature_families = None):
         """Inits BasicParticipant class
         Args:
             pid: Participant id
@@ -64,6 +66,9 @@ class BasicParticipant(Participant):
 
             rpsdata: rest pupil sizes for all scenes if available
 
+            feature_families: If not None, a set of feature families as returned by plan_features.
+                Only the features of these families are calculated.
+
         Yields:
             a BasicParticipant object
         """
@@ -111,10 +116,12 @@ class BasicParticipant(Participant):
             print "Generating features..."
 
         self.segments, self.scenes = rec.process_rec(scenelist = scenelist,aoilist = aois,prune_length = prune_length, require_valid_segs = require_valid_segs,
-                                                     auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = rpsdata, export_pupilinfo=export_pupilinfo)
+                                                     auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = rpsdata, export_pupilinfo=export_pupilinfo,
+                                                     feature_families = feature_families)
 
         all_segs = sorted(self.segments, key=lambda x: x.start)
-        self.whole_scene = Scene(str(pid)+'_allsc',[],rec.all_data,rec.fix_data, saccade_data = rec.sac_data, event_data = rec.event_data, Segments = all_segs, aoilist = aois,prune_length = prune_length, require_valid = require_valid_segs, export_pupilinfo=export_pupilinfo )
+        self.whole_scene = Scene(str(pid)+'_allsc',[],rec.all_data,rec.fix_data, saccade_data = rec.sac_data, event_data = rec.event_data, Segments = all_segs, aoilist = aois,prune_length = prune_length, require_valid = require_valid_segs, export_pupilinfo=export_pupilinfo,
+                                 feature_families = feature_families, Scenes = self.scenes)
         self.scenes.insert(0,self.whole_scene)
 
         #Clean memory
@@ -126,12 +133,13 @@ class BasicParticipant(Participant):
             print "Done!"
 
 
-def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, aoifile = None, log_time_offsets=None,
-                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False):
-    """Generates list of Participant objects. Relevant information is read from input files
+def read_participants_Basic_multiprocessing(nbprocesses, datadir, user_list, pids, prune_length = None, aoifile = None, log_time_offsets = None,
+                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False,
+                          feature_families = None, exports = None, writers = None):
+    """Generates list of Participant objects in parallel computing. Relevant information is read from input files
 
     Args:
-        q: Queue to which all processes must add return values.
+        nbprocesses: number of processes to run in parallel (number of CPU cores is a good option).
 
         datadir: directory with user data (including "All-Data.tsv", "Fixation-Data.tsv", "Event-Data.tsv" files)
         for all participants
@@ -164,161 +172,179 @@ def read_participants_Basic(q, datadir, user_list, pids, prune_length = None, ao
         rpsfile: If not None, a string containing the name of the '.tsv' file
             with rest pupil sizes for all scenes and for each user.
 
+        feature_families: If not None, a set of feature families as returned by plan_features.
+            Only the features of these families are calculated.
+
+        exports: If not None, a list of dictionaries with the arguments of the calls to export_features
+            (or write_features_tsv) that will be made on the participants, e.g.
+            [{'featurelist': params.featurelist, 'aoifeaturelist': params.aoigeneralfeat, 'id_prefix': False}].
+            The features are then exported by the worker processes, which send back a small
+            ParticipantFeatures object per participant instead of the whole Participant.
+
+        writers: If not None, a list of FeatureTSVWriter objects to which the features of each Participant are
+            written as soon as it is read
+            (in the order of user_list). The written "Participant"s are then not kept, so that memory does not
+            grow with the number of "Participant"s.
+
     Returns:
-        a list Participant objects (in queue)
+        a list Participant objects (ParticipantFeatures objects if exports is not None), without those
+        written to writers
     """
-    participants = []
-    if log_time_offsets == None:    #setting the default offset which is 1 sec
+
+    if nbprocesses < 1:
+        nbprocesses = 1
+    if nbprocesses > len(user_list):
+        nbprocesses = len(user_list)
+    if log_time_offsets == None:    #setting the default offset
         log_time_offsets = [0]*len(pids)
 
     # read rest pupil sizes (rpsvalues) from rpsfile
     rpsdata = read_rest_pupil_sizes(rpsfile)
 
-    for rec,pid,offset in zip(user_list,pids,log_time_offsets):
-        #extract pupil sizes for the current user. Set to None if not available
-        if rpsdata != None:
-            currpsdata = rpsdata[pid]
-        else:
-            currpsdata = None
-
-        if params.EYETRACKERTYPE == "TobiiV2":
-            allfile = datadir+'/P'+str(rec)+'-All-Data.tsv'
-            fixfile = datadir+'/P'+str(rec)+'-Fixation-Data.tsv'
-            evefile = datadir+'/P'+str(rec)+'-Event-Data.tsv'
-            sacfile = None
-            segfile = datadir+'/P'+str(rec)+'.seg'
-        elif params.EYETRACKERTYPE == "TobiiV3":
-            allfile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
-            fixfile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
-            sacfile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
-            evefile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
-            segfile = "{dir}/TobiiV3_sample_{rec}.seg".format(dir=datadir, rec=rec)
-        elif params.EYETRACKERTYPE == "SMI":
-            allfile = "{dir}/SMI_Sample_{rec}_Samples.txt".format(dir=datadir, rec=rec)
-            fixfile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
-            sacfile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
-            evefile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
-            segfile = "{dir}/SMI_Sample_{rec}.seg".format(dir=datadir, rec=rec)
-
-        if os.path.exists(allfile):
-            p = BasicParticipant(rec, evefile, allfile, fixfile, sacfile, segfile, log_time_offset = offset,
-                                aoifile=aoifile, prune_length = prune_length, require_valid_segs = require_valid_segs,
-                                auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = currpsdata)
-            participants.append(p)
-        else:
-            print "Error reading participant files for: "+pid
-    q.put(participants)
-    return
-
-def read_participants_Basic_multiprocessing(nbprocesses, datadir, user_list, pids, prune_length = None, aoifile = None, log_time_offsets = None,
-                          require_valid_segs = True, auto_partition_low_quality_segments = False, rpsfile = None, export_pupilinfo = False):
-    """Generates list of Participant objects in parallel computing. Relevant information is read from input files
+    # one task per participant, the longest participants (largest input files) first so that
+    # they do not end up running alone at the end
+    tasks = []
+    for i, (rec, pid, offset) in enumerate(zip(user_list, pids, log_time_offsets)):
+        currpsdata = rpsdata[pid] if rpsdata != None else None
+        tasks.append((i, exports, datadir, rec, pid, offset, prune_length, aoifile, require_valid_segs,
+                      auto_partition_low_quality_segments, currpsdata, export_pupilinfo, feature_families))
+    tasks.sort(key=lambda task: get_participant_input_size(datadir, task[3]), reverse=True)
+
+    results = {}
+    nextwrite = 0
+    numread = 0
+    start = time.time()
+    pool = Pool(processes=nbprocesses)
+    try:
+        # the workers take the next task as soon as they are done with one, results are gathered as they complete
+        for i, p, duration, error in pool.imap_unordered(_read_participant_task, tasks, chunksize=1):
+            if error is not None:
+                print "Error reading participant "+str(pids[i])+":\n"+error
+            results[i] = p
+            if p is not None:
+                numread += 1
+            if params.VERBOSE != "QUIET":
+                print "Participant %s done in %.2fs" % (str(pids[i]), duration)
+            # write the participants that are done, in order
+            while nextwrite in results:
+                if writers:
+                    p = results.pop(nextwrite)
+                    if p is not None:
+                        for writer in writers:
+                            writer.write_participant(p)
+                nextwrite += 1
+        pool.close()
+    except  Exception as e:
+        pool.terminate()
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        print "Exception", sys.exc_info()
+        print "Line ", exc_tb.tb_lineno
+    pool.join()
 
-    Args:
-        nbprocesses: number of processes to run in parallel (number of CPU cores is a good option).
+    participants = filter(lambda p: p is not None, map(lambda i: results[i], sorted(results.keys())))
+    if params.VERBOSE != "QUIET":
+        print "%d participants read in %.2fs with %d processes" % (numread, time.time() - start, nbprocesses)
 
-        datadir: directory with user data (including "All-Data.tsv", "Fixation-Data.tsv", "Event-Data.tsv" files)
-        for all participants
-
-        user_list: list of user recordings (files extracted for one participant from Tobii studio)
+    return participants
 
-        pids: User ID that is used in the external logs (can be different from above but there should be a 1-1 mapping)
+def read_participant_Basic(datadir, rec, pid, offset, prune_length = None, aoifile = None, require_valid_segs = True,
+                           auto_partition_low_quality_segments = False, rpsdata = None, export_pupilinfo = False,
+                           feature_families = None):
+    """Generates the Participant object of one user recording. Relevant information is read from input files
 
-        prune_length: If not None, an integer that specifies the time
-            interval (in ms) from the beginning of each Segment in which
-            samples are considered in calculations.  This can be used if,
-            for example, you only wish to consider data in the first
-            1000 ms of each Segment. In this case (prune_length = 1000),
-            all data beyond the first 1000ms of the start of the "Segment"s
-            will be disregarded.
+    Args:
+        datadir: directory with user data
 
-        aoifile: If not None, a string containing the name of the '.aoi' file
-            with definitions of the "AOI"s.
+        rec: the user recording (files extracted for one participant from Tobii studio)
 
-        log_time_offset: If not None, an integer indicating the time offset between the
-            external log file and eye tracking logs
+        pid: User ID that is used in the external logs
 
-        require_valid_segs: a boolean determining whether invalid "Segment"s
-            will be ignored when calculating the features or not. default = True
+        offset: the time offset between the external log file and eye tracking logs
 
-        auto_partition_low_quality_segments: a boolean indicating whether EMDAT should
-            split the "Segment"s which have low sample quality, into two new
-            sub "Segment"s discarding the largest gap of invalid samples.
+        rpsdata: rest pupil sizes for all scenes for this participant if available
 
-        rpsfile: If not None, a string containing the name of the '.tsv' file
-            with rest pupil sizes for all scenes and for each user.
+        See read_participants_Basic_multiprocessing for the other arguments.
 
     Returns:
-        a list Participant objects
+        a Participant object, None if the participant files do not exist
     """
+    allfile, fixfile, sacfile, evefile, segfile = get_participant_files(datadir, rec)
 
-    q = Queue()
-    listprocess = []
-    participants = []
+    if os.path.exists(allfile):
+        return BasicParticipant(rec, evefile, allfile, fixfile, sacfile, segfile, log_time_offset = offset,
+                                aoifile=aoifile, prune_length = prune_length, require_valid_segs = require_valid_segs,
+                                auto_partition_low_quality_segments = auto_partition_low_quality_segments, rpsdata = rpsdata,
+                                feature_families = feature_families)
+    else:
+        print "Error reading participant files for: "+str(pid)
+        return None
 
-    if nbprocesses < 1:
-        nbprocesses = 1
-    if nbprocesses > len(user_list):
-        nbprocesses = len(user_list)
+def _read_participant_task(task):
+    """Reads one participant in a worker of read_participants_Basic_multiprocessing
 
-    for i in range(0, nbprocesses): #create a sublist of participants for each process
-        user_listsplit = chunks(user_list, nbprocesses)
-        pidssplit = chunks(pids, nbprocesses)
-        log_time_offsets_list = chunks(log_time_offsets, nbprocesses) if log_time_offsets is not None else None
+    Args:
+        task: a tuple (task index, exports, arguments of read_participant_Basic)
 
-    print user_listsplit
+    Returns:
+        a tuple (task index, Participant object (ParticipantFeatures object if exports is not None) or None,
+        duration in seconds, traceback of the error or None)
+    """
+    start = time.time()
+    exports = task[1]
     try:
-        for i in range(0, nbprocesses):
-            if log_time_offsets is None:
-			    p = Process(target=read_participants_Basic, args=(q, datadir, user_listsplit[i], pidssplit[i], prune_length, aoifile, log_time_offsets,
-                          require_valid_segs, auto_partition_low_quality_segments, rpsfile, export_pupilinfo))
-            else:
-			    p = Process(target=read_participants_Basic, args=(q, datadir, user_listsplit[i], pidssplit[i], prune_length, aoifile, log_time_offsets_list[i],
-                          require_valid_segs, auto_partition_low_quality_segments, rpsfile, export_pupilinfo))
+        p = read_participant_Basic(*task[2:])
+        if p is not None and exports is not None:
+            p = ParticipantFeatures(p, exports)
+        return task[0], p, time.time() - start, None
+    except Exception as e:
+        return task[0], None, time.time() - start, traceback.format_exc()
 
-            listprocess.append(p)
-            p.start() # start the process
+def get_participant_files(datadir, rec):
+    """Returns the names of the input files of a user recording for the eye tracker set in params.py
 
-        for i in range(0, nbprocesses):
-            participants = participants + q.get(True) # wait for the results of all processes
+    Args:
+        datadir: directory with user data
 
-        for pr in listprocess:
-            pr.terminate()
-            pr.join() #kill the process
+        rec: the user recording
 
-    except  Exception as e:
-        exc_type, exc_obj, exc_tb = sys.exc_info()
-        print "Exception", sys.exc_info()
-        print "Line ", exc_tb.tb_lineno
-
-    return participants
+    Returns:
+        a tuple (samples file, fixations file, saccades file or None, events file, '.seg' file), the names
+        of the compressed files being returned for the files that exist only compressed
+    """
+    if params.EYETRACKERTYPE == "TobiiV2":
+        allfile = datadir+'/P'+str(rec)+'-All-Data.tsv'
+        fixfile = datadir+'/P'+str(rec)+'-Fixation-Data.tsv'
+        evefile = datadir+'/P'+str(rec)+'-Event-Data.tsv'
+        sacfile = None
+        segfile = datadir+'/P'+str(rec)+'.seg'
+    elif params.EYETRACKERTYPE == "TobiiV3":
+        allfile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
+        fixfile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
+        sacfile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
+        evefile = "{dir}/P{rec}_Data_Export.tsv".format(dir=datadir, rec=rec)
+        segfile = "{dir}/TobiiV3_sample_{rec}.seg".format(dir=datadir, rec=rec)
+    elif params.EYETRACKERTYPE == "SMI":
+        allfile = "{dir}/SMI_Sample_{rec}_Samples.txt".format(dir=datadir, rec=rec)
+        fixfile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
+        sacfile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
+        evefile = "{dir}/SMI_Sample_{rec}_Events.txt".format(dir=datadir, rec=rec)
+        segfile = "{dir}/SMI_Sample_{rec}.seg".format(dir=datadir, rec=rec)
+    else:
+        raise Exception("Unknown eye tracker type.")
+    # the files may also be compressed (e.g. "P1_Data_Export.tsv.gz")
+    return tuple(map(find_data_file, [allfile, fixfile, sacfile, evefile, segfile]))
 
-def chunks(l, n):
-    """Split a list in balanced sub-lists. If equal sublits are not possible, remaining elements are distribute evenly among sublists.
+def get_participant_input_size(datadir, rec):
+    """Returns the total size in bytes of the input files of a user recording (0 for missing files)
 
     Args:
-        l: the list to split.
-
-        n: the number of sublists to generate.
+        datadir: directory with user data
 
-    Returns:
-        a list of n sublists
+        rec: the user recording
     """
-    if n < 1:
-        n = 1
-    if len(l) < n:
-        n = len(l)
-
-    nsize = len(l)/n #number of elements in the sublists
-    if len(l)%n == 0:
-        return [l[i:i + nsize] for i in range(0, len(l), nsize)]
-    else:
-        l2 = [l[i:i + nsize] for i in range(0, len(l[0:nsize*n]), nsize)]
-        i=0
-        for j in l[nsize*n:len(l)]: #distribute remaining elements
-            l2[i].append(j)
-            i = (i+1) % n
-        return l2
+    allfile, fixfile, sacfile, evefile, _ = get_participant_files(datadir, rec)
+    files = set(filter(lambda f: f is not None and os.path.exists(f), [allfile, fixfile, sacfile, evefile]))
+    return sum(map(os.path.getsize, files))
 
 def partition_Basic(segfile):
     """Generates the scenelist based on a .seg file
@@ -349,7 +375,7 @@ def read_events(evfile):
     Returns:
         a list of Event objects
     """
-    with open(evfile, 'r') as f:
+    with open_data_file(evfile) as f:
         lines = f.readlines()
 
     return map(Event, lines[(params.EVENTSHEADERLINES+params.NUMBEROFEXTRAHEADERLINES):])
@@ -370,7 +396,7 @@ def read_rest_pupil_sizes(rpsfile):
 
     """
     if rpsfile != None:
-        with open(rpsfile, 'r') as f:
+        with open_data_file(rpsfile) as f:
             lines = f.readlines()
         rpsdic = {}
         import re
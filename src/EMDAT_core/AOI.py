@@ -16,7 +16,24 @@ Institution: The University of British Columbia.
 """
 
 from EMDAT_core.utils import *
+from EMDAT_core.data_structures import concatenate_datapoint_arrays, LEFT_MOUSE_CLICK, RIGHT_MOUSE_CLICK
 from warnings import warn
+import numpy as np
+
+# AOI features computed by each of the AOI_Stat calculators, by feature family.
+# 'numtransfrom' and 'proptransfrom' stand for all the transition features of an AOI.
+AOI_FEATURE_FAMILIES = {
+    'aoifixation': ['numfixations', 'longestfixation', 'meanfixationduration', 'stddevfixationduration',
+                    'timetofirstfixation', 'timetolastfixation', 'proportionnum', 'proportiontime',
+                    'fixationrate', 'totaltimespent'],
+    'aoievent': ['numevents', 'numleftclic', 'numrightclic', 'numdoubleclic', 'leftclicrate', 'rightclicrate',
+                 'doubleclicrate', 'timetofirstleftclic', 'timetofirstrightclic', 'timetofirstdoubleclic',
+                 'timetolastleftclic', 'timetolastrightclic', 'timetolastdoubleclic'],
+    'aoipupil': ['meanpupilsize', 'stddevpupilsize', 'maxpupilsize', 'minpupilsize', 'startpupilsize', 'endpupilsize',
+                 'meanpupilvelocity', 'stddevpupilvelocity', 'maxpupilvelocity', 'minpupilvelocity'],
+    'aoidistance': ['meandistance', 'stddevdistance', 'maxdistance', 'mindistance', 'startdistance', 'enddistance'],
+    'aoitransition': ['numtransfrom', 'proptransfrom']
+}
 
 
 class AOI():
@@ -143,16 +160,21 @@ class AOI_Stat():
     """Methods of AOI_Stat calculate and store all features related to the given AOI object
     """
 
-    def __init__(self,aoi, seg_all_data, seg_fixation_data, starttime, endtime, sum_discarded, active_aois, seg_event_data=None, rest_pupil_size = 0, export_pupilinfo = False):
+    def __init__(self,aoi, seg_all_data, seg_fixation_data, starttime, endtime, sum_discarded, active_aois, seg_event_data=None, rest_pupil_size = 0, export_pupilinfo = False,
+                 seg_fixation_labels = None, feature_families = None):
         """Inits AOI_Stat class
 
         Args:
             aoi: the aoi object for which the statistics are calculated
-            seg_all_data: datapoints for this segment
+            seg_all_data: DatapointArray holding the samples of this segment
             seg_fixation_data: fixations for current segment
             starttime:
             endtime:
             active_aois:list of the AOI objects that will be used for calculating the transitions between this AOI and other AOIs
+            seg_fixation_labels: If not None, the FixationAOILabels of seg_fixation_data for aoi and active_aois,
+                shared by all the "AOI_Stat"s of the segment. If None, the labels are computed here.
+            feature_families: If not None, the set of feature families to compute (see plan_features).
+                The features of the other families keep their default values.
 
         Yields:
             an AOI_Stat object
@@ -212,9 +234,14 @@ class AOI_Stat():
         self.features['enddistance'] = -1
 
         self.numdistancedata = 0
+        self.numpupilsizes = 0
+        self.numpupilvelocity = 0
 
         self.total_trans_from = 0
         self.variance = 0
+        # the "RunningStats" of the values behind the features, merged by the "Scene"s
+        self.stats = {'fixationduration': RunningStats(), 'pupilsize': RunningStats(), 'pupilvelocity': RunningStats(),
+                      'distance': RunningStats()}
         for aoi in active_aois:
             aid = aoi.aid
             self.features['numtransfrom_%s'%(aid)] = 0
@@ -226,18 +253,26 @@ class AOI_Stat():
         fixation_data = []
         event_data = []
 
+        if seg_fixation_labels is None:
+            seg_fixation_labels = FixationAOILabels(seg_fixation_data, active_aois if aoi in active_aois else active_aois + [aoi])
+
         if partition:
+            all_data_chunks = []
+            fixation_positions = []
             if params.DEBUG or params.VERBOSE == "VERBOSE":
                 print("partition",partition)
             for intr in partition:
                 if starttime <= intr[1] and endtime >= intr[0]:
                     _,st,en = get_chunk(seg_all_data, 0, intr[0], intr[1])
-                    all_data += seg_all_data[st:en]
+                    all_data_chunks.append(seg_all_data[st:en])
                     _,st,en = get_chunk(seg_fixation_data, 0, intr[0],intr[1])
                     fixation_data += seg_fixation_data[st:en]
+                    fixation_positions += range(st, en)
                     if seg_event_data != None:
                         _,st,en = get_chunk(seg_event_data, 0, intr[0],intr[1])
                         event_data += seg_event_data[st:en]
+            all_data = concatenate_datapoint_arrays(all_data_chunks)
+            fixation_labels = seg_fixation_labels.subset(fixation_positions)
             if params.DEBUG or params.VERBOSE == "VERBOSE":
                 print("len(seg_all_data)",seg_all_data)
                 print("len(seg_fixation_data)",seg_fixation_data)
@@ -245,84 +280,96 @@ class AOI_Stat():
         else:  #global AOI (always active)
             all_data = seg_all_data
             fixation_data = seg_fixation_data
+            fixation_labels = seg_fixation_labels
             if seg_event_data != None:
                 event_data = seg_event_data
 
-        ## Remove datapoints with invalid gaze coordinates
-        datapoints = filter(lambda datapoint: datapoint.gazepointx != -1 and datapoint.gazepointy != -1, all_data)
-        # Only keep samples inside AOI
-        datapoints = filter(lambda datapoint: _datapoint_inside_aoi(datapoint, self.aoi.polyin, self.aoi.polyout), datapoints)
+        datapoints = None
+        if needs_feature_family(feature_families, 'aoipupil') or needs_feature_family(feature_families, 'aoidistance'):
+            ## Remove datapoints with invalid gaze coordinates
+            valid_gaze = (all_data.gazepointx != -1) & (all_data.gazepointy != -1)
+            # Only keep samples inside AOI
+            inside = points_inside_aoi(all_data.gazepointx, all_data.gazepointy, self.aoi.polyin, self.aoi.polyout)
+            datapoints = all_data[valid_gaze & inside]
 
-        self.generate_pupil_features(datapoints, rest_pupil_size, export_pupilinfo)
+        if needs_feature_family(feature_families, 'aoipupil'):
+            self.generate_pupil_features(datapoints, rest_pupil_size, export_pupilinfo)
 
-        self.generate_distance_features(datapoints)
+        if needs_feature_family(feature_families, 'aoidistance'):
+            self.generate_distance_features(datapoints)
 
-        fixation_indices = self.generate_fixation_features(datapoints, fixation_data, sum_discarded)
+        if needs_feature_family(feature_families, 'aoifixation'):
+            fixation_indices = self.generate_fixation_features(datapoints, fixation_data, sum_discarded, fixation_labels)
 
-        self.generate_event_features(seg_event_data, event_data, sum_discarded)
+        if needs_feature_family(feature_families, 'aoievent'):
+            self.generate_event_features(seg_event_data, event_data, sum_discarded)
 
-        self.generate_transition_features(active_aois, fixation_data, fixation_indices)
+        if needs_feature_family(feature_families, 'aoitransition'):
+            self.generate_transition_features(active_aois, fixation_labels)
 
 
     def generate_pupil_features(self, datapoints, rest_pupil_size, export_pupilinfo):
         #get all datapoints where pupil size is available
-        valid_pupil_data = filter(lambda x: x.pupilsize > 0, datapoints)
-        valid_pupil_velocity = filter(lambda x: x.pupilvelocity != -1, datapoints)
+        valid_pupil = datapoints.pupilsize > 0
+        validpupilsizes = datapoints.pupilsize[valid_pupil].tolist()
+        valid_pupil_velocity = datapoints.pupilvelocity[datapoints.pupilvelocity != -1].tolist()
         #number of valid pupil sizes
-        self.numpupilsizes = len(valid_pupil_data)
+        self.numpupilsizes = len(validpupilsizes)
         self.numpupilvelocity = len(valid_pupil_velocity)
 
         if self.numpupilsizes > 0: #check if the current segment has pupil data available
             if params.PUPIL_ADJUSTMENT == "rpscenter":
-                adjvalidpupilsizes = map(lambda x: x.pupilsize - rest_pupil_size, valid_pupil_data)
+                adjvalidpupilsizes = map(lambda x: x - rest_pupil_size, validpupilsizes)
             elif params.PUPIL_ADJUSTMENT == "PCPS":
-                adjvalidpupilsizes = map(lambda x: (x.pupilsize - rest_pupil_size) / (1.0 * rest_pupil_size), valid_pupil_data)
+                adjvalidpupilsizes = map(lambda x: (x - rest_pupil_size) / (1.0 * rest_pupil_size), validpupilsizes)
             else:
-                adjvalidpupilsizes = map(lambda x: x.pupilsize, valid_pupil_data)#valid_pupil_data
-
-            valid_pupil_velocity = map(lambda x: x.pupilvelocity, valid_pupil_velocity)#valid_pupil_data
+                adjvalidpupilsizes = validpupilsizes
 
             if export_pupilinfo:
-                self.pupilinfo_for_export = map(lambda x: [x.timestamp, x.pupilsize, rest_pupil_size], valid_pupil_data)
-
-            self.features['meanpupilsize'] = mean(adjvalidpupilsizes)
-            self.features['stddevpupilsize'] = stddev(adjvalidpupilsizes)
-            self.features['maxpupilsize'] = max(adjvalidpupilsizes)
-            self.features['minpupilsize'] = min(adjvalidpupilsizes)
-            self.features['startpupilsize'] = adjvalidpupilsizes[0]
-            self.features['endpupilsize'] = adjvalidpupilsizes[-1]
-
-            if len(valid_pupil_velocity) > 0:
-                self.features['meanpupilvelocity'] = mean(valid_pupil_velocity)
-                self.features['stddevpupilvelocity'] = stddev(valid_pupil_velocity)
-                self.features['maxpupilvelocity'] = max(valid_pupil_velocity)
-                self.features['minpupilvelocity'] = min(valid_pupil_velocity)
+                self.pupilinfo_for_export = map(lambda t, x: [t, x, rest_pupil_size], datapoints.timestamp[valid_pupil].tolist(), validpupilsizes)
+
+            sizes = RunningStats(adjvalidpupilsizes)
+            self.stats['pupilsize'] = sizes
+            self.features['meanpupilsize'] = sizes.mean
+            self.features['stddevpupilsize'] = sizes.stddev()
+            self.features['maxpupilsize'] = sizes.max
+            self.features['minpupilsize'] = sizes.min
+            self.features['startpupilsize'] = sizes.first
+            self.features['endpupilsize'] = sizes.last
+
+            velocities = RunningStats(valid_pupil_velocity)
+            self.stats['pupilvelocity'] = velocities
+            if velocities.count > 0:
+                self.features['meanpupilvelocity'] = velocities.mean
+                self.features['stddevpupilvelocity'] = velocities.stddev()
+                self.features['maxpupilvelocity'] = velocities.max
+                self.features['minpupilvelocity'] = velocities.min
 
 
     def generate_distance_features(self, datapoints):
         # check if pupil sizes are available for all missing points
-        invalid_distance_data = filter(lambda x: x.distance <= 0 and x.gazepointx >= 0, datapoints)
-#        if len(invalid_distance_data) > 0:
-#            warn("Distance from screen is unavailable for a valid data sample. Number of missing points: " + str(len(invalid_distance_data)))
+#        num_invalid_distance = np.count_nonzero((datapoints.distance <= 0) & (datapoints.gazepointx >= 0))
+#        if num_invalid_distance > 0:
+#            warn("Distance from screen is unavailable for a valid data sample. Number of missing points: " + str(num_invalid_distance))
 
-        #get all datapoints where distance is available
-        valid_distance_data = filter(lambda x: x.distance > 0, datapoints)
+        #get all distances where distance is available
+        distances_from_screen = datapoints.distance[datapoints.distance > 0].tolist()
         #number of valid pupil sizes
-        self.numdistancedata = len(valid_distance_data)
+        self.numdistancedata = len(distances_from_screen)
+        distances = RunningStats(distances_from_screen)
+        self.stats['distance'] = distances
         if self.numdistancedata > 0: #check if the current segment has pupil data available
-            distances_from_screen = map(lambda x: x.distance, valid_distance_data)
-            self.features['meandistance'] = mean(distances_from_screen)
-            self.features['stddevdistance'] = stddev(distances_from_screen)
-            self.features['maxdistance'] = max(distances_from_screen)
-            self.features['mindistance'] = min(distances_from_screen)
-            self.features['startdistance'] = distances_from_screen[0]
-            self.features['enddistance'] = distances_from_screen[-1]
+            self.features['meandistance'] = distances.mean
+            self.features['stddevdistance'] = distances.stddev()
+            self.features['maxdistance'] = distances.max
+            self.features['mindistance'] = distances.min
+            self.features['startdistance'] = distances.first
+            self.features['enddistance'] = distances.last
 
 
-    def generate_fixation_features(self, datapoints, fixation_data, sum_discarded):
+    def generate_fixation_features(self, datapoints, fixation_data, sum_discarded, fixation_labels):
 
-        fixation_indices = []
-        fixation_indices = filter(lambda i: _fixation_inside_aoi(fixation_data[i], self.aoi.polyin, self.aoi.polyout), range(len(fixation_data)))
+        fixation_indices = np.flatnonzero(fixation_labels.get_inside(self.aoi)).tolist()
         fixations = map(lambda i: fixation_data[i], fixation_indices)
         numfixations = len(fixations)
         self.features['numfixations'] = numfixations
@@ -334,10 +381,12 @@ class AOI_Stat():
         self.features['totaltimespent'] = totaltimespent
 
         self.features['proportiontime'] = float(totaltimespent)/(self.length - sum_discarded)
+        durations = RunningStats(map(lambda x: x.fixationduration, fixations))
+        self.stats['fixationduration'] = durations
         if numfixations > 0:
-            self.features['longestfixation'] = max(map(lambda x: x.fixationduration, fixations))
-            self.features['meanfixationduration'] = mean(map(lambda x: float(x.fixationduration), fixations))
-            self.features['stddevfixationduration'] = stddev(map(lambda x: float(x.fixationduration), fixations))
+            self.features['longestfixation'] = durations.max
+            self.features['meanfixationduration'] = durations.mean
+            self.features['stddevfixationduration'] = durations.stddev()
             self.features['timetofirstfixation'] = fixations[0].timestamp - self.starttime
             self.features['timetolastfixation'] = fixations[-1].timestamp - self.starttime
             self.features['proportionnum'] = float(numfixations)/len(fixation_data)
@@ -366,24 +415,14 @@ class AOI_Stat():
             self.features['timetolastdoubleclic'] = doublec[-1].timestamp - self.starttime if len(doublec) > 0 else -1
 
 
-    def generate_transition_features(self, active_aois, fixation_data, fixation_indices):
+    def generate_transition_features(self, active_aois, fixation_labels):
         #calculating the transitions to and from this AOI and other active AOIs at the moment
+        transitions = fixation_labels.get_transitions(self.aoi)
+        sumtransfrom = 0
         for aoi in active_aois:
             aid = aoi.aid
-            self.features['numtransfrom_%s'%(aid)] = 0
-
-        sumtransfrom = 0
-        for i in fixation_indices:
-            if i > 0:
-                for aoi in active_aois:
-                    aid = aoi.aid
-                    polyin = aoi.polyin
-                    polyout = aoi.polyout
-                    key = 'numtransfrom_%s'%(aid)
-
-                    if _fixation_inside_aoi(fixation_data[i-1], polyin, polyout):
-                        self.features[key] += 1
-                        sumtransfrom += 1
+            self.features['numtransfrom_%s'%(aid)] = transitions[aid]
+            sumtransfrom += transitions[aid]
         for aoi in active_aois:
             aid = aoi.aid
 
@@ -442,55 +481,92 @@ class AOI_Stat():
             print(fn[i],':',fv[i])
         print
 
-def _datapoint_inside_aoi(datapoint, polyin, polyout):
-    """Helper function that checks if a datapoint object is inside the AOI described by extrernal polygon polyin and the internal polygon polyout.
+def points_inside_aoi(x, y, polyin, polyout):
+    """Checks which points of a batch are inside the AOI described by external polygons polyin and the internal polygons polyout.
 
-    Datapoint object is inside AOI if it is inside polyin but outside polyout
+    A point is inside AOI if it is inside one of the polygons of polyin but outside the corresponding polygon of polyout
 
     Args:
-        datapoint: A Datapoint object
-        polyin: the external polygon in form of a list of (x,y) tuples
-        polyout: the internal polygon in form of a list of (x,y) tuples
+        x: an array with the x coordinates of the points (e.g. gaze samples)
+        y: an array with the y coordinates of the points
+        polyin: a list of external polygons, each in form of a list of (x,y) tuples
+        polyout: a list of internal polygons (one per polygon in polyin), each in form of a list of (x,y) tuples
 
     Returns:
-        A boolean for whether the Datapoint is inside the AOI or not
+        An array of booleans for whether each point is inside the AOI or not
     """
-    inside = False
-    i = 0
-    for polyin_i in polyin:
-        if point_inside_polygon(datapoint.gazepointx,
-                    datapoint.gazepointy, polyin_i) and not point_inside_polygon(datapoint.gazepointx,
-                    datapoint.gazepointy, polyout[i]):
-                inside = True
-                break
-        i += 1
+    inside = np.zeros(np.shape(x), dtype=bool)
+    for i, polyin_i in enumerate(polyin):
+        inside |= points_inside_polygon(x, y, polyin_i) & ~points_inside_polygon(x, y, polyout[i])
     return inside
 
 
-def _fixation_inside_aoi(fixation, polyin, polyout):
-    """Helper function that checks if a fixation object is inside the AOI described by external polygon polyin and the internal polygon polyout.
+class FixationAOILabels():
+    """The AOI membership of a list of "Fixation"s, computed once and shared by all the consumers of a Segment
 
-    Fixation object is inside AOI if it is inside polyin but outside polyout
+    Attributes:
+        aois: the list of "AOI"s, in the same order as the columns of inside
+        inside: an array of booleans of shape (number of fixations, number of AOIs),
+            inside[i, j] is True if the i-th fixation is inside the AOI aids[j]
+    """
 
-    Args:
-        fixation: A Fixation object
-        polyin: the external polygon in form of a list of (x,y) tuples
-        polyout: the internal polygon in form of a list of (x,y) tuples
+    def __init__(self, fixation_data, aois, inside = None):
+        """Inits FixationAOILabels class
 
-    Returns:
-        A boolean for whether the Fixation is inside the AOI or not
-    """
-    inside = False
-    i = 0
-    for polyin_i in polyin:
-        if point_inside_polygon(fixation.mappedfixationpointx,
-                 fixation.mappedfixationpointy, polyin_i) and not point_inside_polygon(fixation.mappedfixationpointx,
-                 fixation.mappedfixationpointy, polyout[i]):
-            inside = True
-            break
-        i += 1
+        Args:
+            fixation_data: a list of "Fixation"s
+            aois: a list of "AOI"s
+            inside: If not None, the already computed membership array (see subset)
+        """
+        self.aois = aois
+        self.columns = dict((aoi.aid, j) for j, aoi in enumerate(aois))
+        self.transitions = None
+        if inside is not None:
+            self.inside = inside
+            return
+        # a fixation with no coordinates (None) is never inside an AOI
+        x = np.array(map(lambda fix: fix.mappedfixationpointx, fixation_data), dtype=np.float64)
+        y = np.array(map(lambda fix: fix.mappedfixationpointy, fixation_data), dtype=np.float64)
+        self.inside = np.zeros((len(fixation_data), len(aois)), dtype=bool)
+        for j, aoi in enumerate(aois):
+            self.inside[:, j] = points_inside_aoi(x, y, aoi.polyin, aoi.polyout)
+
+    def subset(self, positions):
+        """Returns the FixationAOILabels of some of the fixations
+
+        Args:
+            positions: a list with the indices of the fixations to keep
+
+        Returns:
+            a FixationAOILabels
+        """
+        return FixationAOILabels(None, self.aois, self.inside[np.asarray(positions, dtype=int)])
+
+    def get_inside(self, aoi):
+        """Returns an array of booleans, True for the fixations inside aoi
+        """
+        return self.inside[:, self.columns[aoi.aid]]
+
+    def get_transitions(self, aoi):
+        """Returns the number of transitions to aoi from each AOI
+
+        The transition matrix between all the AOIs is computed in one pass over the fixations
+        the first time this method is called.
+
+        Args:
+            aoi: an AOI
+
+        Returns:
+            a dictionary with the id of each AOI as keys and the number of fixations inside aoi
+            whose preceding fixation is inside that AOI as values
+        """
+        if self.transitions is None:
+            # transitions[a, b]: number of fixations inside a preceded by a fixation inside b
+            inside = self.inside.astype(int)
+            self.transitions = np.dot(inside[1:].T, inside[:-1])
+        row = self.transitions[self.columns[aoi.aid]].tolist()
+        return dict(zip(map(lambda aoi: aoi.aid, self.aois), row))
 
-    return inside
 
 def _event_inside_aoi(event, polyin, polyout):
     """Helper function that checks if an event (mouse clic) object is inside the AOI described by external polygon polyin and the internal polygon polyout.
@@ -506,7 +582,7 @@ def _event_inside_aoi(event, polyin, polyout):
         A boolean for whether the Fixation is inside the AOI or not
     """
     inside = False
-    if event.event == "LeftMouseClick" or event.event == "RightMouseClick": #keep only mouse clics
+    if event.eventtype == LEFT_MOUSE_CLICK or event.eventtype == RIGHT_MOUSE_CLICK: #keep only mouse clics
         i = 0
         for polyin_i in polyin:
             if point_inside_polygon(event.data1, event.data2, polyin_i) and not point_inside_polygon(event.data1, event.data2, polyout[i]):
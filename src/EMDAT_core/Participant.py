@@ -12,8 +12,10 @@ Institution: The University of British Columbia.
 import string
 import params
 import EMDAT_core
+import EMDAT_core.RecordingExport
 from EMDAT_core.data_structures import *
 from EMDAT_core.Scene import Scene
+from EMDAT_core.Segment import SegmentValidity
 from EMDAT_core.Recording import *
 
 
@@ -183,10 +185,7 @@ class Participant():
         featnames, data  = self.export_features(featurelist, aoifeaturelist = aoifeaturelist,
                                                 id_prefix = id_prefix, require_valid = require_valid)
 
-        ret = string.join(featnames, '\t') + '\n'
-        for t in data:
-            ret += (string.join(map(str, t), '\t') + '\n')
-        return ret
+        return string.join(map(_format_tsv_line, [featnames] + data), '')
 
     def print_(self):
         """Outputs all feature names and their values for this Participant to the console
@@ -241,37 +240,75 @@ class Participant():
             print(format_list(sc_feats,l))
 
 
-    def write_raw_data(self, filename_all, filename_fix, filename_sac, filename_ev):
-        f_all = open(filename_all, 'wb')
-        f_fix = open(filename_fix, 'wb')
-        f_sac = open(filename_sac, 'wb')
-        f_ev = open(filename_ev, 'wb')
-        sep='\t'
-        f_all.write("scene"+sep+"timestamp"+sep+"rawpupilsize"+sep+"pupilvelocity"+sep+"headdistance"+sep+"is_valid"+sep+"stimuliname"+sep+
-		"fixationindex"+"\n")
+    def write_raw_data(self, folder, recording):
+        """Exports the samples, fixations, saccades and events of the recording of this Participant to a folder,
+        in binary columns with the index ranges of the "Segment"s of each Scene (see EMDAT_core.RecordingExport)
 
-        f_fix.write("scene"+sep+"fixationindex"+sep+"timestamp"+sep+"fixationduration"+sep+"mappedfixationpointx"+sep+"mappedfixationpointy"+"\n")
+        The "Segment"s do not keep their data, so this is called with the Recording of the Participant before
+        its memory is cleaned.
+
+        Args:
+            folder: path to the folder
+            recording: the Recording from which the "Scene"s of this Participant were processed
+        """
+        scenes = filter(lambda sc: sc is not getattr(self, 'whole_scene', None), self.scenes)
+        EMDAT_core.RecordingExport.write_recording(folder, recording, scenes)
 
-        f_sac.write("scene"+sep+"saccadeindex"+sep+"timestamp"+sep+"saccadeduration"+sep+"saccadedistance"+sep+"saccadespeed"+sep+"saccadeacceleration"+sep+
-		"saccadestartpointx"+sep+"saccadestartpointy"+sep+"saccadeendpointx"+sep+"saccadeendpointy"+sep+"saccadequality"+"\n")
 
-        f_ev.write("scene"+sep+"timestamp"+sep+"event"+sep+"event_key"+sep+"x_coord"+sep+"y_coord"+sep+"key_code"+sep+"key_name"+sep+"description"+sep+"\n")
+class ParticipantFeatures(Participant):
+    """
+    The exported features and the validity information of a Participant, without its "Scene"s and "Segment"s
 
+    A ParticipantFeatures holds the tables returned by export_features for a few given sets of arguments,
+    and a SegmentValidity for each Segment and for the whole recording. It is a small object used to send the
+    results of a Participant across processes: it can be given to export_features_all and write_features_tsv
+    with the same arguments as the ones used to create it, and to the functions of ValidityProcessing.
+    """
 
-        for sc in self.scenes:
-            for sg in sc.segments:
+    def __init__(self, participant, exports):
+        """Inits ParticipantFeatures class
+
+        Args:
+            participant: a Participant object
+
+            exports: a list of dictionaries with the keyword arguments of the calls to export_features
+                that will be made on this object, e.g. [{'featurelist': ['length', 'numfixations'], 'id_prefix': False}]
+
+        Yields:
+            a ParticipantFeatures object
+        """
+        self.pid = participant.pid
+        self.require_valid_segments = participant.require_valid_segments
+        self.features = getattr(participant, 'features', {})
+        self.numofsegments = getattr(participant, 'numofsegments', len(participant.segments))
+        self.segments = map(SegmentValidity, participant.segments)
+        self.whole_scene = SegmentValidity(participant.whole_scene)
+        self.tables = {}
+        for kwargs in exports:
+            self.tables[_get_export_key(**kwargs)] = participant.export_features(**kwargs)
+
+    def export_features(self, featurelist=None, aoifeaturelist=None, aoifeaturelabels = None,
+                        id_prefix = True, require_valid = True):
+        """Returns feature names and their values for this Participant, as exported when this object was created
 
-                for ad in sg.all_data:
-                    f_all.write(str(sc.scid)+str(sg.segid)+sep+ad.get_string()+'\n')
-                for af in sg.fixation_data:
-                    f_fix.write(str(sc.scid)+str(sg.segid)+sep+af.get_string()+'\n')
-                for asa in sg.saccade_data:
-                    f_sac.write(str(sc.scid)+str(sg.segid)+sep+asa.get_string()+'\n')
-                for ae in sg.event_data:
-                    f_ev.write(str(sc.scid)+str(sg.segid)+sep+ae.get_string()+'\n')
+        See Participant.export_features
 
-        f_all.close()
-        f_fix.close()
+        Raises:
+            Exception: if the features were not exported with these arguments when this object was created
+        """
+        key = _get_export_key(featurelist, aoifeaturelist, aoifeaturelabels, id_prefix, require_valid)
+        if key not in self.tables:
+            raise Exception("The features of participant %s were not exported with these arguments" % (self.pid))
+        featnames, data = self.tables[key]
+        return list(featnames), map(list, data)
+
+
+def _get_export_key(featurelist=None, aoifeaturelist=None, aoifeaturelabels = None, id_prefix = True, require_valid = True):
+    """Returns a hashable key identifying the arguments of a call to export_features
+    """
+    def as_tuple(names):
+        return tuple(names) if names is not None else None
+    return (as_tuple(featurelist), as_tuple(aoifeaturelist), as_tuple(aoifeaturelabels), id_prefix, require_valid)
 
 
 def read_participants(segsdir, datadir, prune_length = None, aoifile = None):
@@ -315,13 +352,10 @@ def export_features_all(participants, featurelist = None, aoifeaturelist = None,
     featnames = []
     if participants:
         for p in participants:
-            if not(p.is_valid()) and require_valid:
-                warn( "User " + str(p.pid) + " was not valid." )
+            exported = _export_participant(p, featurelist, aoifeaturelist, aoifeaturelabels, id_prefix, require_valid)
+            if exported is None:
                 continue
-            fnames, fvals = p.export_features(featurelist=featurelist, aoifeaturelist=aoifeaturelist,
-                                              aoifeaturelabels = aoifeaturelabels,
-                                              id_prefix=id_prefix, require_valid = require_valid)
-            featnames = fnames
+            featnames, fvals = exported
             data += fvals
     else:
         raise NameError('No participants were passed to the function')
@@ -329,6 +363,94 @@ def export_features_all(participants, featurelist = None, aoifeaturelist = None,
     return featnames, data
 
 
+def _export_participant(p, featurelist, aoifeaturelist, aoifeaturelabels, id_prefix, require_valid):
+    """Returns the result of export_features for a Participant, or None if the Participant is not valid
+    and require_valid is True
+    """
+    if not(p.is_valid()) and require_valid:
+        warn( "User " + str(p.pid) + " was not valid." )
+        return None
+    return p.export_features(featurelist=featurelist, aoifeaturelist=aoifeaturelist,
+                             aoifeaturelabels = aoifeaturelabels,
+                             id_prefix=id_prefix, require_valid = require_valid)
+
+
+def _format_tsv_line(values):
+    return string.join(map(str, values), '\t') + '\n'
+
+
+class FeatureTSVWriter():
+    """Writes the features of "Participant"s to a tsv-format file as the "Participant"s are read
+
+    The file has the same format as the one written by write_features_tsv. The line with the feature names is
+    written with the features of the first Participant that has a valid Scene, and the features of each Participant are flushed to
+    the file as soon as they are written, so that a long run only keeps one Participant in memory at a time,
+    and the features of the "Participant"s already processed are in the file if the run stops before the end.
+
+    e.g.
+    with FeatureTSVWriter('./outputfolder/features.tsv', featurelist = params.featurelist) as writer:
+        for p in participants:
+            writer.write_participant(p)
+    """
+
+    def __init__(self, outfile, featurelist = None, aoifeaturelist = None, aoifeaturelabels = None,
+                 id_prefix = True, require_valid = True):
+        """Inits FeatureTSVWriter class and creates the output file
+
+        Args:
+            outfile: a string containing the name of the output file
+            featurelist, aoifeaturelist, aoifeaturelabels, id_prefix, require_valid: see export_features_all
+
+        Yields:
+            a FeatureTSVWriter object
+        """
+        self.outfile = outfile
+        self.featurelist = featurelist
+        self.aoifeaturelist = aoifeaturelist
+        self.aoifeaturelabels = aoifeaturelabels
+        self.id_prefix = id_prefix
+        self.require_valid = require_valid
+        self.featnames = None
+        self.numrows = 0
+        self.f = open(outfile, 'w')
+
+    def write_participant(self, participant):
+        """Exports the features of a Participant and appends them to the file
+
+        Args:
+            participant: a Participant object
+        """
+        exported = _export_participant(participant, self.featurelist, self.aoifeaturelist, self.aoifeaturelabels,
+                                       self.id_prefix, self.require_valid)
+        if exported is None:
+            return
+        featnames, data = exported
+        if not data:
+            # no valid Scene, featnames only has the ids
+            self.featnames = self.featnames or featnames
+            return
+        if not self.numrows:
+            self.f.write(_format_tsv_line(featnames))
+        self.featnames = featnames
+        self.f.writelines(map(_format_tsv_line, data))
+        self.f.flush()
+        self.numrows += len(data)
+
+    def close(self):
+        """Closes the output file
+        """
+        if not self.f.closed:
+            if not self.numrows:
+                self.f.write(_format_tsv_line(self.featnames or []))
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def write_features_tsv(participants, outfile, featurelist = None, aoifeaturelist =  None,
                        aoifeaturelabels=None, id_prefix = True):
     """Returns feature names and their values for a list of "Participant"s in a tsv-format file
@@ -355,14 +477,13 @@ def write_features_tsv(participants, outfile, featurelist = None, aoifeaturelist
         require_valid: a boolean determining if only valid segments should be used when
         calculating the features. default = True
     """
-    fnames, fvals = export_features_all(participants, featurelist =  featurelist,
-                                        aoifeaturelabels = aoifeaturelabels,
-                                        aoifeaturelist = aoifeaturelist, id_prefix=id_prefix)
+    if not participants:
+        raise NameError('No participants were passed to the function')
 
-    with open(outfile, 'w') as f:
-        f.write(string.join(fnames, '\t') + '\n')
-        for l in fvals:
-            f.write(string.join(map(str, l), '\t') + '\n')
+    with FeatureTSVWriter(outfile, featurelist = featurelist, aoifeaturelist = aoifeaturelist,
+                          aoifeaturelabels = aoifeaturelabels, id_prefix = id_prefix) as writer:
+        for p in participants:
+            writer.write_participant(p)
 
 
 def partition(segfile):
@@ -400,7 +521,7 @@ def read_events(evfile):
     Returns:
         a list of Event objects
     """
-    with open(evfile, 'r') as f:
+    with open_data_file(evfile) as f:
         lines = f.readlines()
 
     return map(Event, lines[(params.EVENTSHEADERLINES+params.NUMBEROFEXTRAHEADERLINES):])
@@ -10,7 +10,11 @@ Institution: The University of British Columbia.
 """
 
 from abc import ABCMeta, abstractmethod
+import itertools
+import numpy as np
+import params
 from EMDAT_core.data_structures import *
+from EMDAT_core import RecordingCache
 from EMDAT_core.Scene import *
 from EMDAT_core.AOI import *
 from EMDAT_core.utils import *
@@ -19,6 +23,9 @@ from EMDAT_core.utils import *
 class Recording:
     __metaclass__ = ABCMeta
 
+    # False if the data read by the subclass is not stored in the cache (see params.RECORDING_CACHE_FOLDER)
+    use_cache = True
+
     def __init__(self, all_file, fixation_file, saccade_file=None, event_file=None, media_offset=(0, 0)):
         """
         :param all_file: path to file that contains all gaze points
@@ -28,37 +35,73 @@ class Recording:
         (0,0) if the interface was in full screen (default value).
         """
         self.media_offset = media_offset
+        self.all_file = all_file
+
+        cache_key = None
+        cached_data = None
+        if params.RECORDING_CACHE_FOLDER is not None and self.use_cache and not params.STREAM_SAMPLES:
+            # the files are parsed only if they changed since they were cached
+            cache_key = RecordingCache.get_cache_key(self, all_file, fixation_file, saccade_file, event_file)
+            cached_data = RecordingCache.load_recording(cache_key)
+
+        if cached_data is not None:
+            self.all_data, self.fix_data, self.sac_data, self.event_data = cached_data
+        elif params.STREAM_SAMPLES:
+            # the samples are not kept: they are read block by block when the segments are created (see process_rec)
+            self.read_data(None, fixation_file, saccade_file, event_file)
+        else:
+            self.read_data(all_file, fixation_file, saccade_file, event_file)
+            if cache_key is not None:
+                RecordingCache.save_recording(cache_key, self.all_data, self.fix_data, self.sac_data, self.event_data)
 
-        self.all_data = self.read_all_data(all_file)
-        if len(self.all_data) == 0:
+        if self.all_data is not None and len(self.all_data) == 0:
             raise Exception("The file '" + all_file + "' has no samples!")
 
-        self.fix_data = self.read_fixation_data(fixation_file)
         if len(self.fix_data) == 0:
             raise Exception("The file '" + fixation_file + "' has no fixations!")
 
         if saccade_file is not None:
-            self.sac_data = self.read_saccade_data(saccade_file)
             if len(self.sac_data) == 0:
                 raise Exception("The file '" + saccade_file + "' has no saccades!")
 
-        else:
-            self.sac_data = None
-
         if event_file is not None:
-            self.event_data = self.read_event_data(event_file)
             if len(self.event_data) == 0:
                 raise Exception("The file '" + event_file + "' has no events!")
+
+    def read_data(self, all_file, fixation_file, saccade_file=None, event_file=None):
+        """ Read the samples, fixations, saccades and events from the files exported from the eye tracker
+        into all_data, fix_data, sac_data and event_data.
+
+        :param all_file: path to file that contains all gaze points (None to leave all_data to None)
+        :param fixation_file :path to file that contains all fixations
+        :param saccade_file :path to file that contains all saccades (None if no saccades)
+        :param event_file :path to file that contains all events (None if no events)
+        """
+        combined_data = None
+        if fixation_file == all_file and saccade_file in (None, all_file) and event_file in (None, all_file):
+            # all the data is exported in the same file: read it only once if the eye tracker supports it
+            combined_data = self.read_combined_data(all_file, read_saccades=saccade_file is not None,
+                                                    read_events=event_file is not None)
+
+        if combined_data is not None:
+            self.all_data, self.fix_data, self.sac_data, self.event_data = combined_data
         else:
-            self.event_data = None
+            self.all_data = self.read_all_data(all_file) if all_file is not None else None
+            self.fix_data = self.read_fixation_data(fixation_file)
+            self.sac_data = self.read_saccade_data(saccade_file) if saccade_file is not None else None
+            self.event_data = self.read_event_data(event_file) if event_file is not None else None
+
+        if self.all_data is not None and not isinstance(self.all_data, DatapointArray):
+            # the samples are always stored in columns, whatever the eye tracker
+            self.all_data = datapoints_to_array(self.all_data)
 
     @abstractmethod
     def read_all_data(self, all_file):
         """ Read the data file that contains all gaze points.
 
         :param all_file: path to file that contains all gaze points
-        :return: a list of Datapoints
-        :rtype: list[Datapoint]
+        :return: a DatapointArray, or a list of Datapoints (converted to a DatapointArray by the constructor)
+        :rtype: DatapointArray | list[Datapoint]
         """
         pass
 
@@ -92,11 +135,65 @@ class Recording:
         """
         pass
 
+    def iter_samples(self, all_file):
+        """ Read the gaze points of a data file one by one.
+
+        Eye trackers should override this method with a generator reading the file row by row: by default,
+        all the samples are read with read_all_data first.
+
+        :param all_file: path to file that contains all gaze points
+        :return: an iterator over the samples, each sample being a dictionary of attributes as given to Datapoint
+        :rtype: iterator[dict]
+        """
+        for datapoint in self.read_all_data(all_file):
+            yield dict((name, getattr(datapoint, name)) for name in Datapoint.__slots__)
+
+    def read_sample_blocks(self, all_file, block_size=None):
+        """ Read the gaze points of a data file block by block, so that only one block of samples
+        is held in memory at a time by the reader.
+
+        The blocks are in the order of the file (i.e., in timestamp order), see split_sample_blocks to get
+        the samples of each Segment from the blocks.
+
+        :param all_file: path to file that contains all gaze points
+        :param block_size: the maximum number of samples in a block, params.SAMPLE_BLOCK_SIZE if None
+        :return: an iterator over the blocks of samples
+        :rtype: iterator[DatapointArray]
+        """
+        if block_size is None:
+            block_size = params.SAMPLE_BLOCK_SIZE
+        samples = DatapointArrayBuilder()
+        for sample in self.iter_samples(all_file):
+            samples.add(sample)
+            if len(samples) >= block_size:
+                yield samples.pop_data()
+        if len(samples) > 0:
+            yield samples.pop_data()
+
+    def read_combined_data(self, data_file, read_saccades=True, read_events=True):
+        """ Read the samples, fixations, saccades and events from a data file that contains all of them,
+        in a single pass over the file.
+
+        Eye trackers that export all their data in the same file should override this method,
+        it is used by the constructor when all_file, fixation_file, saccade_file and event_file are the same.
+
+        :param data_file: path to file that contains all gaze points, fixations, saccades and events
+        :param read_saccades: True if the saccades should be read
+        :param read_events: True if the events should be read
+        :return: a tuple (DatapointArray or list of Datapoints, list of Fixations, list of Saccades or None, list of Events or None),
+        or None if the eye tracker does not support reading all the data at once (default)
+        """
+        return None
+
     def process_rec(self, segfile=None, scenelist=None, aoifile=None,
                     aoilist=None, prune_length=None, require_valid_segs=True,
-                    auto_partition_low_quality_segments=False, rpsdata=None, export_pupilinfo=False):
+                    auto_partition_low_quality_segments=False, rpsdata=None, export_pupilinfo=False,
+                    feature_families=None):
         """Processes the data for one recording (i.e, one complete experiment session)
 
+        If the samples are not kept by the Recording (see params.STREAM_SAMPLES), the "Segment"s are created from
+        the blocks of samples of the data file (see create_streamed_segments).
+
         Args:
             segfile: If not None, a string containing the name of the segfile
                 with segment definitions in following format:
@@ -130,6 +227,9 @@ class Recording:
                 the "Segment". default = False
 
             rpsdata: a dictionary with rest pupil sizes: (scene name is a key, rest pupil size is a value)
+
+            feature_families: If not None, a set of feature families as returned by plan_features, restricting
+                the calculations to the features of these families.
         Returns:
             a list of Scene objects for this Recording
             a list of Segment objects for this recording. This is an aggregated list
@@ -151,32 +251,44 @@ class Recording:
             aoilist = []
             print("Warning: No AOIs defined!")
 
+        if self.all_data is None:
+            # the samples are not kept (see params.STREAM_SAMPLES): the segments of all the scenes are created
+            # from the blocks of samples of the data file
+            streamed_segments = self.create_streamed_segments(scenelist, aoilist, prune_length,
+                                                              auto_partition_low_quality_segments, rpsdata,
+                                                              export_pupilinfo, feature_families)
+        else:
+            streamed_segments = None
+            # the timestamps are indexed once for all the scenes
+            timestamp_indices = build_timestamp_indices(self.all_data, self.fix_data, self.sac_data, self.event_data)
+            # the blinks of all the segments are found at once (the segments prune their samples themselves if prune_length is set)
+            if needs_feature_family(feature_families, 'blink') and prune_length is None:
+                segment_blinks = self.get_segment_blinks(scenelist, timestamp_indices[0])
+            else:
+                segment_blinks = None
         scenes = []
         for scid, sc in scenelist.items():
             if params.VERBOSE != "QUIET":
                 print("Preparing scene:" + str(scid))
-            if params.DEBUG or params.VERBOSE == "VERBOSE":
+            if streamed_segments is not None and scid not in streamed_segments:
+                # the segments of this scene could not be created
+                continue
+            if (params.DEBUG or params.VERBOSE == "VERBOSE") and self.all_data is not None:
                 print("len(all_data)", len(self.all_data))
             try:
-                # get rest pupil size data
-                if rpsdata is not None:
-                    if scid in rpsdata.keys():
-                        scrpsdata = rpsdata[scid]
-                    else:
-                        scrpsdata = 0
-                        if params.DEBUG:
-                            print(rpsdata.keys())
-                            raise Exception("Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
-                        else:
-                            print("Warning: Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
-                            pass
+                if streamed_segments is not None:
+                    new_scene = Scene(scid, sc, None, self.fix_data, saccade_data = self.sac_data, event_data=self.event_data,
+                                      Segments=streamed_segments[scid], aoilist=aoilist, prune_length=prune_length,
+                                      require_valid=require_valid_segs, export_pupilinfo=export_pupilinfo,
+                                      feature_families=feature_families)
                 else:
-                    scrpsdata = 0
-                new_scene = Scene(scid, sc, self.all_data, self.fix_data, saccade_data = self.sac_data, event_data=self.event_data, aoilist=aoilist,
-                                  prune_length=prune_length,
-                                  require_valid=require_valid_segs,
-                                  auto_partition=auto_partition_low_quality_segments, rest_pupil_size=scrpsdata,
-                                  export_pupilinfo=export_pupilinfo)
+                    new_scene = Scene(scid, sc, self.all_data, self.fix_data, saccade_data = self.sac_data, event_data=self.event_data, aoilist=aoilist,
+                                      prune_length=prune_length,
+                                      require_valid=require_valid_segs,
+                                      auto_partition=auto_partition_low_quality_segments,
+                                      rest_pupil_size=get_rest_pupil_size(rpsdata, scid),
+                                      export_pupilinfo=export_pupilinfo, timestamp_indices=timestamp_indices,
+                                      feature_families=feature_families, segment_blinks=segment_blinks)
             except Exception as e:
                 warn(str(e))
                 new_scene = None
@@ -191,6 +303,81 @@ class Recording:
             segs.extend(sc.segments)
         return segs, scenes
 
+    def get_segment_blinks(self, scenelist, all_index):
+        """Returns the blinks of the samples of all the segments of a list of scenes, found with a single run-length
+        encoding of the samples of this Recording (see get_segment_blinks)
+
+        Args:
+            scenelist: a dict with the scene ids as keys and lists of (segid, start, end) tuples as values
+            all_index: the TimestampIndex of all_data
+
+        Returns:
+            a dict with the blinks of each segment (see get_blinks), the key being the (start, end) indices of its
+            samples in all_data
+        """
+        ranges = []
+        for seglist in scenelist.values():
+            for (segid, start, end) in seglist:
+                _, all_start, all_end = all_index.get_chunk(0, start, end)
+                ranges.append((all_start, all_end))
+        return dict(zip(ranges, get_segment_blinks(self.all_data, ranges, get_blink_threshold())))
+
+    def create_streamed_segments(self, scenelist, aoilist, prune_length, auto_partition, rpsdata, export_pupilinfo,
+                                 feature_families):
+        """Returns the "Segment"s of all the scenes of a list, created from the blocks of samples read from the data
+        file (see read_sample_blocks) instead of all_data
+
+        The segments are created in timestamp order, whatever their scene, so only the blocks holding the samples of
+        the current segment are kept in memory (see split_sample_blocks).
+
+        Args:
+            scenelist: a dict with the scene ids as keys and lists of (segid, start, end) tuples as values
+            aoilist, prune_length, auto_partition, rpsdata, export_pupilinfo, feature_families: see process_rec
+
+        Returns:
+            a dict with the scene ids as keys and the lists of "Segment"s of the scenes as values (see create_segments),
+            without the scenes whose segments could not be created
+        """
+        fix_index = TimestampIndex(self.fix_data)
+        sac_index = TimestampIndex(self.sac_data) if self.sac_data is not None else None
+        event_index = TimestampIndex(self.event_data) if self.event_data is not None else None
+        rest_pupil_sizes = dict(map(lambda scid: (scid, get_rest_pupil_size(rpsdata, scid)), scenelist.keys()))
+
+        # the interval of the samples of each segment (start, end, scene id, index of the segment in the scene)
+        intervals = []
+        for scid, seglist in scenelist.items():
+            for (i, (segid, start, end)) in enumerate(seglist):
+                if prune_length != None:
+                    end = min(end, start+prune_length)
+                intervals.append((start, end, scid, i))
+        intervals.sort(key=lambda interval: interval[0])
+
+        scene_segments = dict(map(lambda (scid, seglist): (scid, map(lambda seg: [], seglist)), scenelist.items()))
+        failed_scenes = set()
+        sample_blocks = self.read_sample_blocks(self.all_file)
+        for (start, end, scid, i), (sample_start, samples) in itertools.izip(intervals,
+                                                                              split_sample_blocks(sample_blocks, intervals)):
+            if scid in failed_scenes:
+                continue
+            timestamp_indices = (TimestampIndex(samples), fix_index, sac_index, event_index)
+            try:
+                segments = create_segments([scenelist[scid][i]], samples, self.fix_data, self.sac_data, self.event_data,
+                                           aoilist, prune_length, auto_partition, rest_pupil_sizes[scid], export_pupilinfo,
+                                           timestamp_indices, feature_families)
+            except Exception as e:
+                warn(str(e))
+                failed_scenes.add(scid)
+                if params.DEBUG:
+                    raise
+                else:
+                    continue
+            for seg in segments:
+                # the indices of the samples in the data file, instead of the samples of the segment
+                indices = list(seg.get_indices())
+                seg.set_indices(indices[0] + sample_start, indices[1] + sample_start, *indices[2:])
+            scene_segments[scid][i] = segments
+        return dict(map(lambda scid: (scid, sum(scene_segments[scid], [])),
+                        filter(lambda scid: scid not in failed_scenes, scene_segments.keys())))
 
     def clean_memory(self):
         self.all_data = []
@@ -198,6 +385,79 @@ class Recording:
         self.sac_data = []
         self.event_data = []
 
+def get_rest_pupil_size(rpsdata, scid):
+    """Returns the rest pupil size of a scene
+
+    Args:
+        rpsdata: a dictionary with rest pupil sizes (scene name is a key, rest pupil size is a value), or None
+        scid: the id of the scene
+
+    Returns:
+        the rest pupil size of the scene, 0 if rpsdata is None or if the scene is not in rpsdata
+    """
+    if rpsdata is not None:
+        if scid in rpsdata.keys():
+            scrpsdata = rpsdata[scid]
+        else:
+            scrpsdata = 0
+            if params.DEBUG:
+                print(rpsdata.keys())
+                raise Exception("Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
+            else:
+                print("Warning: Scene ID " + scid + " is not in the dictionary with rest pupil sizes. rpsdata is set to 0")
+                pass
+    else:
+        scrpsdata = 0
+    return scrpsdata
+
+
+def split_sample_blocks(sample_blocks, intervals):
+    """Returns the samples that fall within each of a list of time intervals, from blocks of samples
+
+    The blocks are consumed in order and only the blocks that overlap the intervals not returned yet are
+    kept in memory, so the samples of a long recording can be split into "Segment"s without holding all of them.
+
+    Args:
+        sample_blocks: an iterator over "DatapointArray"s in timestamp order (e.g., Recording.read_sample_blocks)
+        intervals: a list of tuples starting with (start, end), sorted by start time, e.g. the start and end of each
+            Segment
+
+    Yields:
+        for each interval, a tuple (the index of its first sample in all the samples, a DatapointArray with the samples
+        whose timestamp is between start and end (included)), the same samples as found by get_chunk
+    """
+    sample_blocks = iter(sample_blocks)
+    # the blocks which may overlap the next intervals, with the index of their first sample
+    pending = []
+    numsamples = 0
+    last_timestamp = None
+    exhausted = False
+    for interval in intervals:
+        start, end = interval[0], interval[1]
+        # the blocks that end before this interval are not needed by the next ones either
+        pending = filter(lambda (_, block): block.timestamp[-1] >= start, pending)
+        while not exhausted and (not pending or pending[-1][1].timestamp[-1] <= end):
+            try:
+                block = next(sample_blocks)
+            except StopIteration:
+                exhausted = True
+                break
+            if len(block) == 0:
+                continue
+            if np.any(block.timestamp[1:] < block.timestamp[:-1]) or \
+                    (last_timestamp is not None and block.timestamp[0] < last_timestamp):
+                raise Exception("The samples are not in timestamp order, they cannot be split by blocks")
+            last_timestamp = block.timestamp[-1]
+            if block.timestamp[-1] >= start:
+                pending.append((numsamples, block))
+            numsamples += len(block)
+        bounds = map(lambda (_, block): (int(block.timestamp.searchsorted(start, 'left')),
+                                         int(block.timestamp.searchsorted(end, 'right'))), pending)
+        chunks = map(lambda ((_, block), (first, last)): block[first:last], zip(pending, bounds))
+        sample_start = pending[0][0] + bounds[0][0] if pending else numsamples
+        yield sample_start, concatenate_datapoint_arrays(filter(lambda chunk: len(chunk) > 0, chunks))
+
+
 def read_segs(segfile):
     """Returns a dict with scid as the key and segments as value from a '.seg' file.
 
@@ -215,7 +475,7 @@ def read_segs(segfile):
         a dict with scid as the key and segments as value
     """
     scenes = {}
-    with open(segfile, 'r') as f:
+    with open_data_file(segfile) as f:
         seglines = f.readlines()
 
     for l in seglines:
@@ -250,7 +510,7 @@ def read_aois(aoifile):
     Returns:
         a list of "AOI"s
     """
-    with open(aoifile, 'r') as f:
+    with open_data_file(aoifile) as f:
         aoilines = f.readlines()
 
     return read_aoilines(aoilines)
@@ -349,7 +609,7 @@ def read_rest_pupil_sizes(rpsfile):
 
     """
     if rpsfile != None:
-        with open(rpsfile, 'r') as f:
+        with open_data_file(rpsfile) as f:
             lines = f.readlines()
         rpsdic = {}
         import re
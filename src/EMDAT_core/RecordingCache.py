@@ -0,0 +1,250 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+On-disk cache of parsed recordings: the samples, fixations, saccades and events read from the files
+exported from an eye tracker are stored in NumPy files, so that the next runs load them instead
+of parsing the exported files again.
+
+The numeric columns of the samples (the codes for the stimuli names) are stored in one '.npy' file each and are memory-mapped when loaded
+(copy-on-write), so the processes working on the same recording share its samples through the page cache
+instead of each holding its own copy. The other data is stored in a '.npz' file.
+
+A cached recording is identified by the content of its source files (SHA-1), the reader class, the media
+offset and the parameters used by the readers. The content hash of a source file is itself remembered
+along with the size and modification time of the file, so an unchanged file is not read again to be hashed.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import params
+from EMDAT_core.data_structures import DatapointArray, CategoricalArray, Fixation, Saccade, Event
+
+# increment when the content of the cache files changes
+CACHE_VERSION = 4
+
+# parameters read by the readers while parsing the exported files (a reader using a new parameter must add it here)
+READER_PARAMS = ["RECORDING_MEDIA_NAME", "MONOCULAR_EYE", "VALID_SAMPLES_PROP_SACCADE"]
+
+# (key in the data dictionary given to the constructor, attribute name) of the cached objects
+FIXATION_FIELDS = [("fixationindex", "fixationindex"), ("timestamp", "timestamp"), ("fixationduration", "fixationduration"),
+                   ("fixationpointx", "mappedfixationpointx"), ("fixationpointy", "mappedfixationpointy")]
+
+SACCADE_FIELDS = map(lambda x: (x, x), ["saccadeindex", "timestamp", "saccadeduration", "saccadedistance", "saccadespeed",
+                                        "saccadeacceleration", "saccadestartpointx", "saccadestartpointy",
+                                        "saccadeendpointx", "saccadeendpointy", "saccadequality"])
+
+EVENT_FIELDS = [("timestamp", "timestamp"), ("event", "event"), ("event_key", "eventKey"), ("x_coord", "x_coord"),
+                ("y_coord", "y_coord"), ("key_code", "key_code"), ("key_name", "key_name"), ("description", "description")]
+
+
+def get_cache_key(recording, all_file, fixation_file, saccade_file=None, event_file=None):
+    """Returns the key identifying the parsed data of a recording in the cache
+
+    Args:
+        recording: the Recording object reading the files
+        all_file, fixation_file, saccade_file, event_file: the files given to the Recording (None if not used)
+
+    Returns:
+        a string
+    """
+    key = hashlib.sha1()
+    key.update("emdat-recording-cache %d\n" % CACHE_VERSION)
+    key.update("%s.%s\n" % (recording.__class__.__module__, recording.__class__.__name__))
+    key.update("%r\n" % (recording.media_offset,))
+    for name in READER_PARAMS:
+        key.update("%s=%r\n" % (name, getattr(params, name, None)))
+    for source in [all_file, fixation_file, saccade_file, event_file]:
+        key.update("%s\n" % (get_file_digest(source) if source is not None else None))
+    return key.hexdigest()
+
+
+def get_file_digest(filename):
+    """Returns the SHA-1 of the content of a file
+
+    The digest is stored in the cache folder with the size and modification time of the file, and is
+    computed again only if they change.
+
+    Args:
+        filename: path to the file
+
+    Returns:
+        a string
+    """
+    stat = os.stat(filename)
+    signature = "%d %r" % (stat.st_size, stat.st_mtime)
+    digest_file = os.path.join(params.RECORDING_CACHE_FOLDER,
+                               hashlib.sha1(os.path.abspath(filename)).hexdigest() + ".digest")
+    if os.path.exists(digest_file):
+        with open(digest_file, "r") as f:
+            line = f.read().strip()
+        if line.startswith(signature + " "):
+            return line[len(signature) + 1:]
+
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), ""):
+            digest.update(block)
+    digest = digest.hexdigest()
+    _write_atomic(digest_file, lambda f: f.write("%s %s\n" % (signature, digest)))
+    return digest
+
+
+def load_recording(key):
+    """Returns the parsed data of a recording from the cache
+
+    Args:
+        key: the key of the recording as returned by get_cache_key
+
+    Returns:
+        a tuple (DatapointArray, list of Fixations, list of Saccades or None, list of Events or None),
+        or None if the recording is not in the cache
+    """
+    filename = _get_cache_file(key)
+    if not os.path.exists(filename):
+        return None
+    with np.load(filename, allow_pickle=True) as cached:
+        columns = load_sample_columns(_get_samples_folder(key))
+        columns["stimuliname"] = CategoricalArray(columns["stimuliname"], cached["sample_stimuliname"].tolist())
+        all_data = DatapointArray(columns)
+        fix_data = _decode_objects(cached, "fixation", Fixation, FIXATION_FIELDS)
+        sac_data = _decode_objects(cached, "saccade", Saccade, SACCADE_FIELDS)
+        event_data = _decode_objects(cached, "event", Event, EVENT_FIELDS)
+    return all_data, fix_data, sac_data, event_data
+
+
+def save_recording(key, all_data, fix_data, sac_data=None, event_data=None):
+    """Stores the parsed data of a recording in the cache
+
+    Args:
+        key: the key of the recording as returned by get_cache_key
+        all_data: a DatapointArray
+        fix_data: a list of "Fixation"s
+        sac_data: a list of "Saccade"s or None
+        event_data: a list of "Event"s or None
+    """
+    # the samples first: the recording is in the cache once the '.npz' file exists
+    save_sample_columns(_get_samples_folder(key), all_data)
+    arrays = {}
+    arrays["sample_stimuliname"] = _encode_column(all_data.stimuliname.categories)
+    _encode_objects(arrays, "fixation", fix_data, FIXATION_FIELDS)
+    _encode_objects(arrays, "saccade", sac_data, SACCADE_FIELDS)
+    _encode_objects(arrays, "event", event_data, EVENT_FIELDS)
+    _write_atomic(_get_cache_file(key), lambda f: np.savez(f, **arrays))
+
+
+def save_sample_columns(folder, all_data):
+    """Stores the columns of samples in a folder, one '.npy' file per column (see load_sample_columns)
+
+    Only the codes of the CategoricalArray columns are stored.
+
+    The folder is written under a temporary name and renamed once complete. It is left unchanged if it
+    already exists (e.g. written meanwhile by another process).
+
+    Args:
+        folder: path to the folder
+        all_data: a DatapointArray
+    """
+    parent = os.path.dirname(folder)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):   # not created by another process meanwhile
+                raise
+    tmpfolder = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+    try:
+        for (name, dtype) in DatapointArray.fields:
+            column = getattr(all_data, name)
+            np.save(os.path.join(tmpfolder, name + ".npy"), column.codes if dtype is CategoricalArray else column)
+        os.chmod(tmpfolder, 0755)
+        os.rename(tmpfolder, folder)
+    except:
+        shutil.rmtree(tmpfolder, ignore_errors=True)
+        if not os.path.isdir(folder):   # not written by another process meanwhile
+            raise
+
+
+def load_sample_columns(folder):
+    """Returns the columns of samples stored by save_sample_columns, without reading them
+
+    The files are memory-mapped in copy-on-write mode: the data is read from the disk (or the page cache,
+    shared by all the processes mapping the same files) when it is accessed, and changing it does not change
+    the files.
+
+    Args:
+        folder: path to the folder
+
+    Returns:
+        a dictionary mapping the name of each column to an array (the codes for CategoricalArray columns)
+    """
+    columns = {}
+    for (name, _) in DatapointArray.fields:
+        columns[name] = np.load(os.path.join(folder, name + ".npy"), mmap_mode="c")
+    return columns
+
+
+def _get_cache_file(key):
+    return os.path.join(params.RECORDING_CACHE_FOLDER, key + ".npz")
+
+
+def _get_samples_folder(key):
+    return os.path.join(params.RECORDING_CACHE_FOLDER, key + ".samples")
+
+
+def _write_atomic(filename, write):
+    """Writes a file through a temporary file, so that concurrent readers never see a partial file
+    """
+    folder = os.path.dirname(filename)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):   # not created by another process meanwhile
+                raise
+    fd, tmpname = tempfile.mkstemp(dir=folder, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.chmod(tmpname, 0644)
+        os.rename(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+
+
+def _encode_objects(arrays, prefix, objects, fields):
+    """Adds one array per attribute of a list of objects to arrays (nothing if objects is None)
+    """
+    if objects is None:
+        return
+    arrays[prefix + "_count"] = np.array(len(objects))
+    for (key, attribute) in fields:
+        arrays[prefix + "_" + key] = _encode_column(map(lambda x: getattr(x, attribute), objects))
+
+
+def _decode_objects(arrays, prefix, cls, fields):
+    """Returns the list of objects stored by _encode_objects (None if no list was stored)
+    """
+    if prefix + "_count" not in arrays:
+        return None
+    columns = dict(map(lambda (key, _): (key, arrays[prefix + "_" + key].tolist()), fields))
+    # the coordinates were already adjusted to the media offset when the objects were first created
+    return cls.from_columns(columns)
+
+
+def _encode_column(values):
+    """Returns a typed array for a list of values of the same type, an array of objects otherwise
+    """
+    types = set(map(type, values))
+    if types == set([int]):
+        return np.array(values, dtype=np.int64)
+    if types == set([float]):
+        return np.array(values, dtype=np.float64)
+    if types == set([str]):
+        return np.array(values, dtype=np.str_)
+    column = np.empty(len(values), dtype=np.object_)
+    column[:] = values
+    return column
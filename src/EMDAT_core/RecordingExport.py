@@ -0,0 +1,241 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Binary export of the data of a recording: the samples, fixations, saccades and events of a Recording are
+written column by column in NumPy '.npy' files, with a JSON manifest describing the columns and the "Segment"s
+of each Scene, so that other tools can load the processed data without parsing the files exported from the
+eye tracker again (see read_recording).
+
+The manifest ('manifest.json') has the following fields:
+    format, version: "emdat-recording" and EXPORT_VERSION
+    media_offset: the media offset of the recording
+    tables: for "samples", "fixations", "saccades" and "events", null if the recording has no such data,
+        otherwise {"count": number of rows, "columns": {column name: column}}, each column being
+        {"file": path of the '.npy' file relative to the folder}, plus "categories" (a list of values) if the
+        file holds the index of the value of each row in categories instead of the values themselves
+    segments: a list of {"scene": scene id, "segment": segment id, "start": timestamp of the first sample,
+        "end": timestamp of the last sample, "samples": [start, end], "fixations": [start, end],
+        "saccades": [start, end] or null, "events": [start, end] or null}, the (start, end) being the indices
+        of the first and after the last row of the segment in each table
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from EMDAT_core.Recording import Recording
+from EMDAT_core.RecordingCache import FIXATION_FIELDS, SACCADE_FIELDS, EVENT_FIELDS
+from EMDAT_core.data_structures import DatapointArray, CategoricalArray, Fixation, Saccade, Event
+
+# increment when the content of the exported folders changes
+EXPORT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+
+# (table name, class, (key in the data dictionary given to the constructor, attribute name) of each column)
+OBJECT_TABLES = [("fixations", Fixation, FIXATION_FIELDS), ("saccades", Saccade, SACCADE_FIELDS),
+                 ("events", Event, EVENT_FIELDS)]
+
+
+def write_recording(folder, recording, scenes=None):
+    """Exports the data of a recording to a folder (see read_recording)
+
+    The folder is written under a temporary name and renamed once complete, an existing folder is replaced.
+
+    Args:
+        folder: path to the folder
+        recording: a Recording whose data is not cleaned yet (see Recording.clean_memory)
+        scenes: a list of "Scene"s of the recording (see Recording.process_rec), or None
+    """
+    if recording.all_data is None:
+        raise Exception("The samples of the recording are not kept (see params.STREAM_SAMPLES), it cannot be exported")
+    folder = os.path.abspath(folder)
+    parent = os.path.dirname(folder)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmpfolder = tempfile.mkdtemp(dir=parent, suffix=".tmp")
+    try:
+        tables = {"samples": _write_samples(tmpfolder, recording.all_data)}
+        for (name, _, fields), objects in zip(OBJECT_TABLES, [recording.fix_data, recording.sac_data, recording.event_data]):
+            tables[name] = _write_objects(tmpfolder, name, objects, fields) if objects is not None else None
+
+        segments = []
+        for scene in scenes or []:
+            for segment in scene.segments:
+                sample_st, sample_end, fix_st, fix_end, sac_st, sac_end, event_st, event_end = \
+                    map(lambda index: int(index) if index is not None else None, segment.get_indices())
+                segments.append({"scene": scene.scid, "segment": segment.segid, "start": segment.start, "end": segment.end,
+                                 "samples": [sample_st, sample_end], "fixations": [fix_st, fix_end],
+                                 "saccades": [sac_st, sac_end] if sac_st is not None else None,
+                                 "events": [event_st, event_end] if event_st is not None else None})
+
+        manifest = {"format": "emdat-recording", "version": EXPORT_VERSION,
+                    "media_offset": list(recording.media_offset), "tables": tables, "segments": segments}
+        with open(os.path.join(tmpfolder, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.chmod(tmpfolder, 0755)
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        os.rename(tmpfolder, folder)
+    except:
+        shutil.rmtree(tmpfolder, ignore_errors=True)
+        raise
+
+
+def read_recording(folder):
+    """Returns the recording exported to a folder by write_recording
+
+    Args:
+        folder: path to the folder
+
+    Returns:
+        an ExportedRecording
+    """
+    return ExportedRecording(folder)
+
+
+def read_manifest(folder):
+    """Returns the manifest of a folder written by write_recording
+
+    Args:
+        folder: path to the folder
+
+    Returns:
+        a dictionary (see the fields above), the strings being str objects
+    """
+    with open(os.path.join(folder, MANIFEST_FILE), "r") as f:
+        manifest = _to_str(json.load(f))
+    if manifest.get("format") != "emdat-recording":
+        raise Exception("Not an EMDAT recording export: " + folder)
+    if manifest.get("version") != EXPORT_VERSION:
+        raise Exception("Unsupported version %r of the EMDAT recording export: %s" % (manifest.get("version"), folder))
+    return manifest
+
+
+class ExportedRecording(Recording):
+    """A Recording read from a folder written by write_recording instead of the files exported from an eye tracker
+
+    The sample columns are memory-mapped (copy-on-write), so reading a recording only reads its fixations,
+    saccades and events.
+
+    Attributes:
+        scenelist: a dictionary with the id of each exported Scene as key and a list of (segment id, start, end)
+            as value, which can be given to process_rec (same as read_segs, the start and end of each Segment
+            being the timestamps of its first and last sample)
+        segment_indices: a list of the exported segments as in the manifest
+    """
+
+    # the exported data is not cached again
+    use_cache = False
+
+    def __init__(self, folder):
+        """
+        :param folder: path to the folder written by write_recording
+        """
+        manifest = read_manifest(folder)
+        tables = manifest["tables"]
+        Recording.__init__(self, folder, folder, folder if tables["saccades"] is not None else None,
+                           folder if tables["events"] is not None else None, tuple(manifest["media_offset"]))
+        self.segment_indices = manifest["segments"]
+        self.scenelist = {}
+        for segment in self.segment_indices:
+            self.scenelist.setdefault(segment["scene"], []).append((segment["segment"], segment["start"], segment["end"]))
+
+    def read_all_data(self, all_file):
+        return _read_samples(all_file, read_manifest(all_file)["tables"]["samples"])
+
+    def read_fixation_data(self, fixation_file):
+        return _read_objects(fixation_file, read_manifest(fixation_file)["tables"]["fixations"], Fixation, FIXATION_FIELDS)
+
+    def read_saccade_data(self, saccade_file):
+        return _read_objects(saccade_file, read_manifest(saccade_file)["tables"]["saccades"], Saccade, SACCADE_FIELDS)
+
+    def read_event_data(self, event_file):
+        return _read_objects(event_file, read_manifest(event_file)["tables"]["events"], Event, EVENT_FIELDS)
+
+    def read_combined_data(self, data_file, read_saccades=True, read_events=True):
+        tables = read_manifest(data_file)["tables"]
+        all_data = _read_samples(data_file, tables["samples"])
+        objects = map(lambda (name, cls, fields): _read_objects(data_file, tables[name], cls, fields), OBJECT_TABLES)
+        return all_data, objects[0], objects[1] if read_saccades else None, objects[2] if read_events else None
+
+
+def _write_samples(folder, all_data):
+    """Writes the columns of a DatapointArray, returns the description of the table
+    """
+    columns = {}
+    for (name, dtype) in DatapointArray.fields:
+        column = getattr(all_data, name)
+        if dtype is CategoricalArray:
+            columns[name] = _write_column(folder, "samples", name, column.codes, column.categories)
+        else:
+            columns[name] = _write_column(folder, "samples", name, np.asarray(column))
+    return {"count": len(all_data), "columns": columns}
+
+
+def _read_samples(folder, table):
+    columns = {}
+    for (name, dtype) in DatapointArray.fields:
+        column = table["columns"][name]
+        values = np.load(os.path.join(folder, column["file"]), mmap_mode="c")
+        columns[name] = CategoricalArray(values, column["categories"]) if dtype is CategoricalArray else values
+    return DatapointArray(columns)
+
+
+def _write_objects(folder, table_name, objects, fields):
+    """Writes one column per attribute of a list of objects, returns the description of the table
+
+    The columns whose values are not all integers or all floats (e.g. strings, or None for the missing values)
+    are written as the indices of their values in a list of categories.
+    """
+    columns = {}
+    for (key, attribute) in fields:
+        values = map(lambda x: getattr(x, attribute), objects)
+        types = set(map(type, values))
+        if types == set([int]) or types == set([bool]) or types == set([float]):
+            columns[key] = _write_column(folder, table_name, key, np.array(values))
+        else:
+            column = CategoricalArray.from_values(values)
+            columns[key] = _write_column(folder, table_name, key, column.codes, column.categories)
+    return {"count": len(objects), "columns": columns}
+
+
+def _read_objects(folder, table, cls, fields):
+    if table is None:
+        return None
+    columns = {}
+    for (key, _) in fields:
+        column = table["columns"][key]
+        values = np.load(os.path.join(folder, column["file"])).tolist()
+        if "categories" in column:
+            values = map(column["categories"].__getitem__, values)
+        columns[key] = values
+    # the coordinates were already adjusted to the media offset when the objects were first created
+    return cls.from_columns(columns)
+
+
+def _write_column(folder, table_name, name, values, categories=None):
+    """Writes the values of a column in a '.npy' file, returns the description of the column
+    """
+    if not os.path.isdir(os.path.join(folder, table_name)):
+        os.mkdir(os.path.join(folder, table_name))
+    filename = table_name + "/" + name + ".npy"
+    np.save(os.path.join(folder, filename), values)
+    column = {"file": filename}
+    if categories is not None:
+        column["categories"] = list(categories)
+    return column
+
+
+def _to_str(value):
+    """Returns a value read by json with the unicode strings encoded in UTF-8, as the strings read from
+    the files exported from the eye trackers
+    """
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    if isinstance(value, list):
+        return map(_to_str, value)
+    if isinstance(value, dict):
+        return dict((_to_str(k), _to_str(v)) for (k, v) in value.iteritems())
+    return value
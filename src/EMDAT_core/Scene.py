@@ -59,7 +59,8 @@ class Scene(Segment):
 
 
     def __init__(self, scid, seglist, all_data, fixation_data, saccade_data = None, event_data = None, Segments = None, aoilist = None,
-                  prune_length= None, require_valid = True, auto_partition = False, rest_pupil_size = 0, export_pupilinfo = False):
+                  prune_length= None, require_valid = True, auto_partition = False, rest_pupil_size = 0, export_pupilinfo = False,
+                  timestamp_indices = None, feature_families = None, Scenes = None, segment_blinks = None):
         """
         Args:
             scid: A string containing the id of the Scene.
@@ -68,7 +69,8 @@ class Scene(Segment):
             *Note: this method of defining segments is implemented to make batch processing of
             files defining segments easier
 
-            all_data: a list of "Datapoint"s which make up this Scene.
+            all_data: a DatapointArray holding the samples which make up this Scene. None if Segments is given
+                and the samples are not kept by the Recording (see params.STREAM_SAMPLES)
 
             fixation_data: a list of "Fixation"s which make up this Scene.
 
@@ -98,206 +100,31 @@ class Scene(Segment):
 
             rest_pupil_size: rest pupil size for the current scene
 
-        Yields:
-            a Scene object
-        """
+            timestamp_indices: If not None, the "TimestampIndex"s of all_data, fixation_data, saccade_data and event_data
+                as returned by build_timestamp_indices, used to find the data of each Segment. If None, the
+                indices are built by the Scene. This allows several "Scene"s of a Recording to share the same indices.
 
-        ########################################
-        def partition_segment(new_seg, seg_start, seg_end, rest_pupil_size, export_pupilinfo):
-            """ A helper method for splitting a Segment object into new Segments and removing gaps of invalid samples
+            feature_families: If not None, a set of feature families as returned by plan_features. Only the features
+                of these families are calculated for the Scene and its "Segment"s.
 
-            One way to deal with a low quality Segment is to find the gaps of invalid samples within its "Datapoint"s and
-            splitting the Segment into two Segments one from the beginnning of the Segment to the gap and another from after
-            the gap to the end of the Segment. This can be done multiple times resulting multiple "Segment"s with higher
-            quality. For example if a Segment S1 started at s1 and ended at e1 and had two invalid gaps between gs1-ge1 and
-            gs2-ge2 milliseconds, this method will generate the following three segments
-                SS1: starting at s1 and ending at gs1
-                SS2: starting at ge1 and ending at gs2
-                SS3: starting at ge2 and ending at e1
-
-            Args:
-                new_seg: The Segment that is being split
-
-                seg_start: An integer showing the start time of the segment in milliseconds
-
-                seg_end: An integer showing the end time of the segment in milliseconds
-
-                rest_pupil_size: rest pupil size for the current scene
-
-            Returns:
-                subsegments: a list of newly generated "Segment"s
-
-                samp_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's all_data field
-
-                fix_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's fixation_data field
-
-                sac_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's saccade_data field
-
-                event_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
-                    new Segment in the old Segment's event_data field
-            """
-            timegaps = new_seg.getgaps()
-            subsegments = []
-            sub_segid = 0
-            samp_inds = []
-            fix_inds = []
-            saccade_inds = []
-            event_inds = []
-            last_samp_idx = 0
-            last_fix_idx = 0
-            last_sac_idx = 0
-            last_event_idx = 0
-            sub_seg_time_start = seg_start
-            for timebounds in timegaps:
-                sub_seg_time_end = timebounds[0] #end of this sub_seg is start of this gap
-                last_samp_idx, all_start,all_end = get_chunk(all_data, last_samp_idx, sub_seg_time_start, sub_seg_time_end)
-                last_fix_idx, fix_start, fix_end = get_chunk(fixation_data, last_fix_idx, sub_seg_time_start, sub_seg_time_end)
-                if saccade_data != None:
-                    last_sac_idx, sac_start, sac_end = get_chunk(saccade_data, last_sac_idx, sub_seg_time_start, sub_seg_time_end)
-                    saccade_data_in_part = saccade_data[sac_start:sac_end]
-                else:
-                    saccade_data_in_part = None
-                if event_data != None:
-                    last_event_idx, event_start, event_end = get_chunk(event_data, last_event_idx, sub_seg_time_start, sub_seg_time_end)
-                    event_data_in_part = event_data[event_start:event_end]
-                else:
-                    event_data_in_part = None
-
-                sub_seg_time_start = timebounds[1] #beginning of the next sub_seg is end of this gap
-                if fix_end - fix_start>0:
-                    try:
-                        new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data=saccade_data_in_part,
-                                      event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
-                    except  Exception as e:
-                        warn(str(e))
-                        if params.DEBUG:
-                            raise
-                        else:
-                            continue
-                else:
-                    continue
-                subsegments.append(new_sub_seg)
-                samp_inds.append((all_start,all_end))
-                fix_inds.append((fix_start, fix_end))
-                if saccade_data != None:
-                    saccade_inds.append((sac_start, sac_end))
-                if event_data != None:
-                    event_inds.append((event_start, event_end))
-                sub_segid +=1
-
-            # handling the last sub_seg
-            sub_seg_time_end = seg_end #end of last sub_seg is the end of seg
-            last_samp_idx, all_start,all_end = get_chunk(all_data, last_samp_idx, sub_seg_time_start, sub_seg_time_end)
-            last_fix_idx, fix_start, fix_end = get_chunk(fixation_data, last_fix_idx, sub_seg_time_start, sub_seg_time_end)
-            if saccade_data != None:
-                last_sac_idx, sac_start, sac_end = get_chunk(saccade_data, last_sac_idx, sub_seg_time_start, sub_seg_time_end)
-                saccade_data_in_part = saccade_data[sac_start:sac_end]
-            else:
-                saccade_data_in_part = None
-            if event_data != None:
-                last_event_idx, event_start, event_end = get_chunk(event_data, last_event_idx, sub_seg_time_start, sub_seg_time_end)
-                event_data_in_part = event_data[event_start:event_end]
-            else:
-                event_data_in_part = None
-            if fix_end - fix_start>0: #add the last sub_seg
-                try:
-                    new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data_in_part,
-                                      event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
-                except Exception as e:
-                    warn(str(e))
-                    if params.DEBUG:
-                        raise
-                    else:
-                        new_sub_seg = None
-
-                if new_sub_seg != None:
-                    subsegments.append(new_sub_seg)
-                    samp_inds.append((all_start,all_end))
-                    fix_inds.append((fix_start, fix_end))
-                    if saccade_data != None:
-                        saccade_inds.append((sac_start, sac_end))
-                    if event_data != None:
-                        event_inds.append((event_start, event_end))
-            #end of handling the last sub_seg
-
-            return subsegments, samp_inds, fix_inds, saccade_inds, event_inds
-        ######################################## end partition_segment()
+            Scenes: If not None, the "Scene"s which the Segments belong to (e.g. the "Scene"s of a participant for
+                its whole-participant Scene). The features already merged by these "Scene"s are merged instead of those
+                of each Segment when this gives the same result (see get_merge_parts).
 
+            segment_blinks: If not None, a dict with the blinks (as returned by get_blinks) of the samples of
+                "Segment"s, the key being the (start, end) indices of the samples in all_data (see get_segment_blinks).
+                The blinks of a Segment which is not in the dict are found by the Segment.
 
+        Yields:
+            a Scene object
+        """
 
-        if len(all_data)<=0:
+        if all_data is not None and len(all_data)<=0:
             raise Exception('A scene with no sample data!')
         if Segments == None:
-            self.segments = []
-#            print "seglist",seglist
-            for (segid, start, end) in seglist:
-                if params.VERBOSE != "QUIET":
-                    print("segid, start, end:", segid, start, end)
-                # Selecting subsets of points belonging only to the current segment
-                if prune_length != None:
-                    end = min(end, start+prune_length)
-                _, all_start, all_end = get_chunk(all_data, 0, start, end)
-                _, fix_start, fix_end = get_chunk(fixation_data, 0, start, end)
-                if saccade_data != None:
-                    _, sac_start, sac_end = get_chunk(saccade_data, 0, start, end)
-                    saccade_data_in_seg = saccade_data[sac_start:sac_end]
-                else:
-                    sac_start = None
-                    sac_end = None
-                    saccade_data_in_seg = None
-                if event_data != None:
-                    _, event_start, event_end = get_chunk(event_data, 0, start, end)
-                    event_data_in_seg = event_data[event_start:event_end]
-                else:
-                    event_start = None
-                    event_end = None
-                    event_data_in_seg = None
-
-                if fix_end - fix_start>0:
-                    try:
-                        new_seg = Segment(segid, all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data = saccade_data_in_seg,
-							        event_data=event_data_in_seg, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo)
-                    except  Exception as e:
-                        warn(str(e))
-                        if params.DEBUG:
-                            raise
-                        else:
-                            continue
-                else:
-                    continue
-
-                if (new_seg.largest_data_gap > params.MAX_SEG_TIMEGAP) and auto_partition: #low quality segment that needs to be partitioned!
-                    try:
-                        new_segs, samp_inds, fix_inds, sac_inds, event_inds = partition_segment(new_seg, start, end, rest_pupil_size, export_pupilinfo=export_pupilinfo)
-                        if saccade_data != None and event_data != None:
-                            for nseg,samp,fix,sac,eve in zip(new_segs, samp_inds, fix_inds, sac_inds, event_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1],eve[0],eve[1])
-                                    self.segments.append(nseg)
-                        elif saccade_data != None and event_data == None:
-                            for nseg,samp,fix,sac in zip(new_segs, samp_inds, fix_inds, sac_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1])
-                                    self.segments.append(nseg)
-                        elif saccade_data == None and event_data != None:
-                            for nseg,samp,fix,eve in zip(new_segs, samp_inds, fix_inds, event_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1],event_st=eve[0],event_end=eve[1])
-                                    self.segments.append(nseg)
-                        else:
-                            for nseg,samp,fix in zip(new_segs, samp_inds, fix_inds):
-                                if nseg.length > params.MINSEGSIZE:
-                                    nseg.set_indices(samp[0],samp[1],fix[0],fix[1])
-                                    self.segments.append(nseg)
-                    except Exception as e:
-                        raise Exception("Error while partitioning scene. "+str(e))
-
-                else:   #good quality segment OR no auto_partition
-                    new_seg.set_indices(all_start,all_end,fix_start,fix_end,sac_start,sac_end,event_start,event_end)
-                    self.segments.append(new_seg)
+            self.segments = create_segments(seglist, all_data, fixation_data, saccade_data, event_data, aoilist, prune_length,
+                                            auto_partition, rest_pupil_size, export_pupilinfo, timestamp_indices,
+                                            feature_families, segment_blinks)
         else:
             self.segments = Segments #segments are already generated
 
@@ -334,15 +161,21 @@ class Scene(Segment):
         self.endseg = endseg
         self.scid = scid
         self.features = {}
-        self.largest_data_gap = maxfeat(self.segments,'largest_data_gap')   #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
-        self.proportion_valid = weightedmeanfeat(self.segments,'numsamples','proportion_valid') #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
-        self.proportion_valid_fix = weightedmeanfeat(self.segments,'numsamples','proportion_valid_fix') #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
+        self.stats = {}
+        self.feature_families = feature_families
+        parts = self.get_merge_parts(segments, Scenes)
+        self.merged_scenes = parts is not segments
+        #self.segments is used to calculate validity of the scenes instead of segments which is only valid segments
+        self.largest_data_gap = max(map(lambda seg: seg.largest_data_gap, self.segments))
+        segment_numsamples = map(lambda seg: seg.numsamples, self.segments)
+        self.proportion_valid = weightedmean(segment_numsamples, map(lambda seg: seg.proportion_valid, self.segments))
+        self.proportion_valid_fix = weightedmean(segment_numsamples, map(lambda seg: seg.proportion_valid_fix, self.segments))
         self.validity1 = self.calc_validity1()
         self.validity2 = self.calc_validity2()
         self.validity3 = self.calc_validity3()
         self.is_valid = self.get_validity()
 
-        self.length = sumfeat(segments,"features['length']")
+        self.length = sum(map(lambda seg: seg.features['length'], segments))
         if self.length == 0:
             raise Exception('Zero length segments!')
 
@@ -350,10 +183,10 @@ class Scene(Segment):
 
         self.features['numsegments'] = len(segments)
         self.features['length'] = self.length
-        self.start = minfeat(segments,'start')
-        self.numfixations = sumfeat(segments,'numfixations')
-        self.end = maxfeat(segments,'end')
-        self.numsamples = sumfeat(segments, 'numsamples')
+        self.start = min(map(lambda seg: seg.start, segments))
+        self.numfixations = sum(map(lambda seg: seg.numfixations, segments))
+        self.end = max(map(lambda seg: seg.end, segments))
+        self.numsamples = sum(map(lambda seg: seg.numsamples, segments))
         self.features['numsamples'] = self.numsamples
 
         if prune_length == None:
@@ -363,26 +196,66 @@ class Scene(Segment):
                 else:
                     warn('Error in fixation count for scene: '+self.scid)
 
-        self.merge_fixation_features(segments)
+        self.features['numfixations'] = self.numfixations
 
-        self.merge_path_angle_features(segments)
+        if self.needs_features('fixation'):
+            self.merge_fixation_features(parts)
 
-        self.merge_blink_features(segments)
+            self.merge_path_angle_features(parts)
 
-        self.merge_pupil_features(export_pupilinfo, segments)
+        if self.needs_features('blink'):
+            self.merge_blink_features(parts)
 
-        self.merge_distance_data(segments)
+        if self.needs_features('pupil'):
+            self.merge_pupil_features(export_pupilinfo, parts)
 
-        self.merge_saccade_data(saccade_data, segments)
+        if self.needs_features('distance'):
+            self.merge_distance_data(parts)
 
-        self.merge_event_data(event_data, segments)
+        if self.needs_features('saccade'):
+            self.merge_saccade_data(saccade_data, parts)
+
+        if self.needs_features('event'):
+            self.merge_event_data(event_data, parts)
 
         self.has_aois = False
 
-        if aoilist:
-            self.set_aois(segments, aoilist)
+        if aoilist and self.needs_aoi_features():
+            self.set_aois(parts, aoilist)
+
+        self.features['aoisequence'] = self.merge_aoisequences(parts)
 
-        self.features['aoisequence'] = self.merge_aoisequences(segments)
+    def get_merge_parts(self, segments, scenes):
+        """Returns the "Scene"s whose merged features are merged into this Scene, or its "Segment"s
+
+        Merging the features of the "Scene"s gives the same result as merging those of their "Segment"s (up to
+        the rounding of the means and standard deviations) if the "Scene"s hold the "Segment"s in the same order,
+        this order being chronological and the "Scene"s following each other, and computed the same features.
+
+        Args:
+            segments: the list of "Segment"s of this Scene whose features are merged
+            scenes: a list of "Scene"s holding these "Segment"s, or None
+
+        Returns:
+            the "Scene"s sorted by start time, or segments
+        """
+        if not scenes:
+            return segments
+        scenes = sorted(scenes, key=lambda sc: sc.start)
+        scene_segments = []
+        for sc in scenes:
+            if sc.require_valid_Segments != self.require_valid_Segments or sc.feature_families != self.feature_families:
+                return segments
+            if self.require_valid_Segments:
+                scene_segments.extend(filter(lambda x: x.is_valid, sc.segments))
+            else:
+                scene_segments.extend(sc.segments)
+        if map(id, scene_segments) != map(id, segments):
+            return segments
+        for i in range(1, len(segments)):
+            if segments[i].start <= segments[i-1].start:
+                return segments
+        return scenes
 
     def getid(self):
         """Returns the scid for this Scene
@@ -395,7 +268,7 @@ class Scene(Segment):
         """Sets the "AOI"s relevant to this Scene
 
         Args:
-            segments: a list of "Segment"s which belong to this Scene.
+            segments: a list of "Segment"s which belong to this Scene, or the "Scene"s holding them (see get_merge_parts).
 
             aois: a list of "AOI"s relevant to this Scene
         """
@@ -408,6 +281,8 @@ class Scene(Segment):
                     if aid in self.aoi_data:
                         if seg.aoi_data[aid].isActive:
                             self.aoi_data[aid] = merge_aoistats(self.aoi_data[aid],seg.aoi_data[aid], self.features['length'], self.numfixations, self.start)
+                            # the merged AOI_Stat holds active data, and is merged in turn if this Scene is merged
+                            self.aoi_data[aid].isActive = True
                     else:
                         self.aoi_data[aid] = deepcopy(seg.aoi_data[aid])
                         if seg.aoi_data[aid].isActive:
@@ -427,16 +302,25 @@ class Scene(Segment):
                                 self.aoi_data[aid].features['timetolastrightclic'] += self.aoi_data[aid].starttime - self.start
                             if self.firstseg.aoi_data[aid].features['timetolastdoubleclic'] != -1:
                                 self.aoi_data[aid].features['timetolastdoubleclic'] += self.aoi_data[aid].starttime - self.start
+        if self.merged_scenes:
+            # the rates of an AOI are those of its first Segment unless fixations or events of the other
+            # Segments were merged, in which case they are relative to the whole Scene
+            for aid in self.aoi_data.keys():
+                first = self.firstseg.aoi_data[aid]
+                if self.aoi_data[aid].features['numfixations'] > first.features['numfixations']:
+                    set_aoi_fixation_rates(self.aoi_data[aid], self.features['length'], self.numfixations)
+                if self.aoi_data[aid].features['numevents'] > first.features['numevents']:
+                    set_aoi_event_rates(self.aoi_data[aid], self.features['length'])
         #Merge stdev
-        #For each seg, compute: T = [(numfix-1) * Variance + numfix * power( meanfixduration_in_seg - meanfixduration_in_scene, 2)]
-        #At the Scene level: [ SQRT( SUM(T_seg1...Tsegn) / (numfix-1) ]
+        #the standard deviation of the fixation durations is computed around the merged mean, and is nan if the AOI
+        #has a single fixation in one of the "Segment"s (whose variance is then nan)
         for aid in self.aoi_data.keys():
-            temp = 0
-            numdata = 0
-            for seg in segments:
-                    temp += (seg.aoi_data[aid].features['numfixations']-1) * seg.aoi_data[aid].variance + seg.aoi_data[aid].features['numfixations'] * math.pow(seg.aoi_data[aid].features['meanfixationduration'] - self.aoi_data[aid].features['meanfixationduration'], 2)
-                    numdata += seg.aoi_data[aid].features['numfixations']
-            self.aoi_data[aid].features['stddevfixationduration'] = math.sqrt(temp / (numdata-1) ) if numdata > 1 else 0
+            durations = self.aoi_data[aid].stats['fixationduration']
+            single = filter(lambda seg: seg.aoi_data[aid].features['numfixations'] == 1 or math.isnan(seg.aoi_data[aid].features['stddevfixationduration']), segments)
+            if durations.count > 1 and single:
+                self.aoi_data[aid].features['stddevfixationduration'] = float('nan')
+            else:
+                self.aoi_data[aid].features['stddevfixationduration'] = aggregatestddev([durations.count], [durations.stddev(0)], [durations.mean], self.aoi_data[aid].features['meanfixationduration'])
         """
         firstsegaois = self.firstseg.aoi_data.keys()
         for aid in self.aoi_data.keys():
@@ -465,14 +349,15 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.numfixations = sumfeat(segments, 'numfixations')
+        self.numfixations = sum(map(lambda seg: seg.numfixations, segments))
         self.features['numfixations'] = self.numfixations
         self.features['fixationrate'] = float(self.numfixations) / (self.length - self.length_invalid)
+        durations = self.merge_segment_stats(segments, 'fixationduration')
 
         if self.numfixations > 0:
-            self.features['meanfixationduration'] = weightedmeanfeat(segments,'numfixations',"features['meanfixationduration']")
-            self.features['stddevfixationduration'] = aggregatestddevfeat(segments, 'numfixations', "features['stddevfixationduration']", "features['meanfixationduration']", self.features['meanfixationduration'])
-            self.features['sumfixationduration'] = sumfeat(segments, "features['sumfixationduration']")
+            self.features['meanfixationduration'] = durations.mean
+            self.features['stddevfixationduration'] = durations.stddev(0)
+            self.features['sumfixationduration'] = durations.total
             self.features['fixationrate'] = float(self.numfixations)/(self.length - self.length_invalid)
         else:
             self.features['meanfixationduration'] = -1
@@ -495,23 +380,26 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.numfixdistances = sumfeat(segments, "numfixdistances")
-        self.numabsangles = sumfeat(segments, "numabsangles")
-        self.numrelangles = sumfeat(segments, "numrelangles")
+        distances = self.merge_segment_stats(segments, 'pathdistance')
+        abs_angles = self.merge_segment_stats(segments, 'abspathangles')
+        rel_angles = self.merge_segment_stats(segments, 'relpathangles')
+        self.numfixdistances = distances.count
+        self.numabsangles = abs_angles.count
+        self.numrelangles = rel_angles.count
 
         if self.numfixations > 1:
-            self.features['meanpathdistance'] = weightedmeanfeat(segments,'numfixdistances',"features['meanpathdistance']")
-            self.features['sumpathdistance'] = sumfeat(segments, "features['sumpathdistance']")
-            self.features['stddevpathdistance'] = aggregatestddevfeat(segments, 'numfixdistances', "features['stddevpathdistance']", "features['meanpathdistance']", self.features['meanpathdistance'])
+            self.features['meanpathdistance'] = distances.mean
+            self.features['sumpathdistance'] = sum(map(lambda seg: seg.features['sumpathdistance'], segments))
+            self.features['stddevpathdistance'] = distances.stddev(0)
             self.features['eyemovementvelocity'] = self.features['sumpathdistance']/(self.length - self.length_invalid)
-            self.features['sumabspathangles'] = sumfeat(segments, "features['sumabspathangles']")
-            self.features['meanabspathangles'] = weightedmeanfeat(segments,'numabsangles',"features['meanabspathangles']")
+            self.features['sumabspathangles'] = sum(map(lambda seg: seg.features['sumabspathangles'], segments))
+            self.features['meanabspathangles'] = abs_angles.mean
             self.features['abspathanglesrate'] = self.features['sumabspathangles']/(self.length - self.length_invalid)
-            self.features['stddevabspathangles'] = aggregatestddevfeat(segments, 'numabsangles', "features['stddevabspathangles']", "features['meanabspathangles']", self.features['meanabspathangles'])
-            self.features['sumrelpathangles'] = sumfeat(segments, "features['sumrelpathangles']")
-            self.features['meanrelpathangles'] = weightedmeanfeat(segments,'numrelangles',"features['meanrelpathangles']")
+            self.features['stddevabspathangles'] = abs_angles.stddev(0)
+            self.features['sumrelpathangles'] = sum(map(lambda seg: seg.features['sumrelpathangles'], segments))
+            self.features['meanrelpathangles'] = rel_angles.mean
             self.features['relpathanglesrate'] = self.features['sumrelpathangles']/(self.length - self.length_invalid)
-            self.features['stddevrelpathangles'] = aggregatestddevfeat(segments, 'numrelangles', "features['stddevrelpathangles']", "features['meanrelpathangles']", self.features['meanrelpathangles'])
+            self.features['stddevrelpathangles'] = rel_angles.stddev(0)
         else:
             self.features['meanpathdistance'] = -1
             self.features['sumpathdistance'] = -1
@@ -543,22 +431,24 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.features['blinknum'] = sumfeat(segments, "features['blinknum']")
+        durations = self.merge_segment_stats(segments, 'blinkduration')
+        intervals = self.merge_segment_stats(segments, 'blinktimedistance')
+        self.features['blinknum'] = durations.count
         if self.features['blinknum'] > 0:
-            self.features['blinkdurationtotal']     = sumfeat(segments, "features['blinkdurationtotal']")
-            self.features['blinkdurationmean']      = weightedmeanfeat(segments, "features['blinknum']", "features['blinkdurationmean']")
-            self.features['blinkdurationstd']       = aggregatestddevfeat(segments, "features['blinknum']", "features['blinkdurationstd']",
-                                                      "features['blinkdurationmean']", self.features['blinkdurationmean'])
-            self.features['blinkdurationmin']       = minfeat(segments, "features['blinkdurationmin']", -1)
-            self.features['blinkdurationmax']       = maxfeat(segments, "features['blinkdurationmax']")
+            self.features['blinkdurationtotal']     = durations.total
+            self.features['blinkdurationmean']      = durations.mean
+            self.features['blinkdurationstd']       = durations.stddev(0)
+            self.features['blinkdurationmin']       = durations.min
+            self.features['blinkdurationmax']       = durations.max
             self.features['blinkrate']              = float(self.features['blinknum']) / (self.length - self.length_invalid)
-            self.features['blinktimedistancemean']  = weightedmeanfeat(segments,
-                                                      "features['blinknum']", "features['blinktimedistancemean']")
-            self.features['blinktimedistancestd']   = aggregatestddevfeat(segments, "features['blinknum']",
-                                                      "features['blinktimedistancestd']", "features['blinktimedistancemean']",
-                                                      self.features['blinktimedistancemean'])
-            self.features['blinktimedistancemin']   = minfeat(segments, "features['blinktimedistancemin']", -1)
-            self.features['blinktimedistancemax']   = maxfeat(segments, "features['blinktimedistancemax']")
+            # the time distances of the "Segment"s are weighted by their number of blinks
+            blinknums = map(lambda seg: seg.features['blinknum'], segments)
+            means = map(lambda seg: seg.features['blinktimedistancemean'], segments)
+            self.features['blinktimedistancemean']  = weightedmean(blinknums, means)
+            self.features['blinktimedistancestd']   = aggregatestddev(blinknums, map(lambda seg: seg.features['blinktimedistancestd'], segments),
+                                                      means, self.features['blinktimedistancemean'])
+            self.features['blinktimedistancemin']   = intervals.min if intervals.count > 0 else float('inf')
+            self.features['blinktimedistancemax']   = intervals.max if intervals.count > 0 else -1
         else:
             self.features['blinkdurationtotal']     = -1
             self.features['blinkdurationmean']      = -1
@@ -586,16 +476,20 @@ class Scene(Segment):
                 segments: The list of Segments for this Scene with pre-calculated features
                 export_pupilinfo: True to export raw pupil data in EMDAT output (False by default).
         """
-        self.numpupilsizes    = sumfeat(segments,'numpupilsizes')
-        self.numpupilvelocity = sumfeat(segments,'numpupilvelocity')
+        sizes = self.merge_segment_stats(segments, 'pupilsize')
+        velocities = self.merge_segment_stats(segments, 'pupilvelocity')
+        self.numpupilsizes    = sum(map(lambda seg: seg.numpupilsizes, segments))
+        self.numpupilvelocity = sum(map(lambda seg: seg.numpupilvelocity, segments))
 
         if self.numpupilsizes > 0: # check if scene has any pupil data
             if export_pupilinfo:
-                self.pupilinfo_for_export = mergevalues(segments, 'pupilinfo_for_export')
-            self.features['meanpupilsize'] = weightedmeanfeat(segments, 'numpupilsizes', "features['meanpupilsize']")
-            self.features['stddevpupilsize'] = aggregatestddevfeat(segments, 'numpupilsizes', "features['stddevpupilsize']", "features['meanpupilsize']", self.features['meanpupilsize']) #stddev(self.adjvalidpupilsizes)
-            self.features['maxpupilsize'] = maxfeat(segments, "features['maxpupilsize']")
-            self.features['minpupilsize'] = minfeat(segments, "features['minpupilsize']", -1)
+                self.pupilinfo_for_export = []
+                for seg in segments:
+                    self.pupilinfo_for_export.extend(seg.pupilinfo_for_export)
+            self.features['meanpupilsize'] = sizes.mean
+            self.features['stddevpupilsize'] = sizes.stddev(0)
+            self.features['maxpupilsize'] = sizes.max
+            self.features['minpupilsize'] = sizes.min
             self.features['startpupilsize'] = self.firstseg.features['startpupilsize']
             self.features['endpupilsize'] = self.endseg.features['endpupilsize']
         else:
@@ -607,11 +501,11 @@ class Scene(Segment):
             self.features['startpupilsize'] = -1
             self.features['endpupilsize'] = -1
 
-        if self.numpupilvelocity > 0: # check if scene has any pupil velocity data
-            self.features['meanpupilvelocity'] = weightedmeanfeat(segments, 'numpupilvelocity', "features['meanpupilvelocity']")
-            self.features['stddevpupilvelocity'] = aggregatestddevfeat(segments, 'numpupilvelocity', "features['stddevpupilvelocity']", "features['meanpupilvelocity']", self.features['meanpupilvelocity']) #stddev(self.valid_pupil_velocity)
-            self.features['maxpupilvelocity'] = maxfeat(segments, "features['maxpupilvelocity']")
-            self.features['minpupilvelocity'] = minfeat(segments, "features['minpupilvelocity']", -1)
+        if velocities.count > 0: # check if scene has any pupil velocity data
+            self.features['meanpupilvelocity'] = velocities.mean
+            self.features['stddevpupilvelocity'] = velocities.stddev(0)
+            self.features['maxpupilvelocity'] = velocities.max
+            self.features['minpupilvelocity'] = velocities.min
         else:
             self.features['meanpupilvelocity'] = -1
             self.features['stddevpupilvelocity'] = -1
@@ -631,12 +525,13 @@ class Scene(Segment):
             Args:
                 segments: The list of Segments for this Scene with pre-calculated features
         """
-        self.numdistancedata = sumfeat(segments,'numdistancedata') #Distance
+        distances = self.merge_segment_stats(segments, 'distance')
+        self.numdistancedata = distances.count #Distance
         if self.numdistancedata > 0: # check if scene has any pupil data
-            self.features['meandistance'] = weightedmeanfeat(segments, 'numdistancedata', "features['meandistance']")
-            self.features['stddevdistance'] = aggregatestddevfeat(segments, 'numdistancedata', "features['stddevdistance']", "features['meandistance']", self.features['meandistance'])
-            self.features['maxdistance'] = maxfeat(segments, "features['maxdistance']")
-            self.features['mindistance'] = minfeat(segments, "features['mindistance']", -1)
+            self.features['meandistance'] = distances.mean
+            self.features['stddevdistance'] = distances.stddev(0)
+            self.features['maxdistance'] = distances.max
+            self.features['mindistance'] = distances.min
             self.features['startdistance'] = self.firstseg.features['startdistance']
             self.features['enddistance'] = self.endseg.features['enddistance']
         else:
@@ -668,21 +563,28 @@ class Scene(Segment):
                 saccade_data: The list of saccade datapoints for this Scene
                 segments: The list of Segments for this Scene with pre-calculated features
         """
+        distances = self.merge_segment_stats(segments, 'saccadedistance')
+        durations = self.merge_segment_stats(segments, 'saccadeduration')
+        speeds = self.merge_segment_stats(segments, 'saccadespeed')
+        # the mean of the ratios of the "Segment"s
+        ratios = self.merge_segment_stats(segments, 'fixationsaccadetimeratio')
         if saccade_data != None:
-            self.features['numsaccades'] = sumfeat(segments,'numsaccades')
-            self.features['sumsaccadedistance'] = sumfeat(segments, "features['sumsaccadedistance']")
-            self.features['meansaccadedistance'] = weightedmeanfeat(self.segments,'numsaccades',"features['meansaccadedistance']")
-            self.features['stddevsaccadedistance'] = aggregatestddevfeat(segments, 'numsaccades', "features['stddevsaccadedistance']", "features['meansaccadedistance']", self.features['meansaccadedistance'])
-            self.features['longestsaccadedistance'] = maxfeat(segments, "features['longestsaccadedistance']")
-            self.features['sumsaccadeduration'] = sumfeat(segments,"features['sumsaccadeduration']")
-            self.features['meansaccadeduration'] = weightedmeanfeat(self.segments,'numsaccades',"features['meansaccadeduration']")
-            self.features['stddevsaccadeduration'] = aggregatestddevfeat(segments, 'numsaccades', "features['stddevsaccadeduration']", "features['meansaccadeduration']", self.features['meansaccadeduration'])
-            self.features['longestsaccadeduration'] = maxfeat(segments, "features['longestsaccadeduration']")
-            self.features['meansaccadespeed'] = weightedmeanfeat(self.segments,'numsaccades',"features['meansaccadespeed']")
-            self.features['stddevsaccadespeed'] = aggregatestddevfeat(segments, 'numsaccades', "features['stddevsaccadespeed']", "features['meansaccadespeed']", self.features['meansaccadespeed'])
-            self.features['maxsaccadespeed'] = maxfeat(segments, "features['maxsaccadespeed']")
-            self.features['minsaccadespeed'] = minfeat(segments, "features['minsaccadespeed']", -1)
-            self.features['fixationsaccadetimeratio'] = sumfeat(segments, "features['fixationsaccadetimeratio']") / float(len(segments))
+            # the means are weighted over all the "Segment"s of this Scene
+            numsaccades = map(lambda seg: seg.numsaccades, self.segments)
+            self.features['numsaccades'] = distances.count
+            self.features['sumsaccadedistance'] = sum(map(lambda seg: seg.features['sumsaccadedistance'], segments))
+            self.features['meansaccadedistance'] = weightedmean(numsaccades, map(lambda seg: seg.features['meansaccadedistance'], self.segments))
+            self.features['stddevsaccadedistance'] = aggregatestddev([distances.count], [distances.stddev(0)], [distances.mean], self.features['meansaccadedistance'])
+            self.features['longestsaccadedistance'] = distances.max if distances.count > 0 else -1
+            self.features['sumsaccadeduration'] = sum(map(lambda seg: seg.features['sumsaccadeduration'], segments))
+            self.features['meansaccadeduration'] = weightedmean(numsaccades, map(lambda seg: seg.features['meansaccadeduration'], self.segments))
+            self.features['stddevsaccadeduration'] = aggregatestddev([durations.count], [durations.stddev(0)], [durations.mean], self.features['meansaccadeduration'])
+            self.features['longestsaccadeduration'] = durations.max if durations.count > 0 else -1
+            self.features['meansaccadespeed'] = weightedmean(numsaccades, map(lambda seg: seg.features['meansaccadespeed'], self.segments))
+            self.features['stddevsaccadespeed'] = aggregatestddev([speeds.count], [speeds.stddev(0)], [speeds.mean], self.features['meansaccadespeed'])
+            self.features['maxsaccadespeed'] = speeds.max if speeds.count > 0 else -1
+            self.features['minsaccadespeed'] = speeds.min if speeds.count > 0 else float('inf')
+            self.features['fixationsaccadetimeratio'] = ratios.total / float(ratios.count)
         else:
             self.features['numsaccades'] = 0
             self.features['sumsaccadedistance'] = -1
@@ -720,11 +622,11 @@ class Scene(Segment):
                 segments: The list of Segments for this Scene with pre-calculated features
         """
         if event_data != None:
-            self.features['numevents'] = sumfeat(segments,'numevents')
-            self.features['numleftclic'] = sumfeat(segments,"features['numleftclic']")
-            self.features['numrightclic'] = sumfeat(segments, "features['numrightclic']")
-            self.features['numdoubleclic'] = sumfeat(segments, "features['numdoubleclic']")
-            self.features['numkeypressed'] = sumfeat(segments, "features['numkeypressed']")
+            self.features['numevents'] = sum(map(lambda seg: seg.features['numevents'], segments))
+            self.features['numleftclic'] = sum(map(lambda seg: seg.features['numleftclic'], segments))
+            self.features['numrightclic'] = sum(map(lambda seg: seg.features['numrightclic'], segments))
+            self.features['numdoubleclic'] = sum(map(lambda seg: seg.features['numdoubleclic'], segments))
+            self.features['numkeypressed'] = sum(map(lambda seg: seg.features['numkeypressed'], segments))
             self.features['leftclicrate'] = float(self.features['numleftclic'])/(self.length - self.length_invalid)
             self.features['rightclicrate'] = float(self.features['numrightclic'])/(self.length - self.length_invalid)
             self.features['doubleclicrate'] = float(self.features['numdoubleclic'])/(self.length - self.length_invalid)
@@ -748,6 +650,21 @@ class Scene(Segment):
             self.features['timetofirstdoubleclic'] = -1
             self.features['timetofirstkeypressed'] = -1
 
+    def merge_segment_stats(self, segments, name):
+        """Returns the "RunningStats" of a feature family merged from the "Segment"s, and stores them in self.stats
+
+        The "Segment"s are merged in chronological order, so that the first and last values are those of the Scene.
+
+        Args:
+            segments: a list of "Segment"s which belong to this Scene.
+            name: the key of the "RunningStats" in the stats of the "Segment"s (see Segment)
+
+        Returns:
+            a RunningStats
+        """
+        self.stats[name] = merge_stats(map(lambda seg: seg.stats[name], sorted(segments, key=lambda seg: seg.start)))
+        return self.stats[name]
+
     def merge_aoisequences(self, segments):
         """returns the AOI sequence merged from the AOI sequences in the "Segment"s
         Args:
@@ -774,6 +691,232 @@ class Scene(Segment):
         #self.adjvalidpupilsizes = []
         #self.distances_from_screen = []
 
+def create_segments(seglist, all_data, fixation_data, saccade_data = None, event_data = None, aoilist = None,
+                    prune_length = None, auto_partition = False, rest_pupil_size = 0, export_pupilinfo = False,
+                    timestamp_indices = None, feature_families = None, segment_blinks = None):
+    """Returns the "Segment"s of a Scene, created from the data of a Recording
+
+    Args:
+        seglist: a list of tuples of the form (segid, start, end) defining the segments
+
+        all_data: a DatapointArray holding the samples of the segments.
+
+        fixation_data, saccade_data, event_data: the "Fixation"s, "Saccade"s (None if no saccades) and "Event"s
+            (None if no events) of the Recording.
+
+        aoilist, prune_length, auto_partition, rest_pupil_size, export_pupilinfo, timestamp_indices, feature_families,
+        segment_blinks: see Scene
+
+    Returns:
+        a list of "Segment"s, with the indices of their data in all_data, fixation_data, saccade_data and event_data
+        (see Segment.set_indices). A low quality segment is replaced by its sub "Segment"s if auto_partition is True.
+    """
+
+    ########################################
+    def partition_segment(new_seg, seg_start, seg_end, rest_pupil_size, export_pupilinfo):
+        """ A helper method for splitting a Segment object into new Segments and removing gaps of invalid samples
+
+        One way to deal with a low quality Segment is to find the gaps of invalid samples within its "Datapoint"s and
+        splitting the Segment into two Segments one from the beginnning of the Segment to the gap and another from after
+        the gap to the end of the Segment. This can be done multiple times resulting multiple "Segment"s with higher
+        quality. For example if a Segment S1 started at s1 and ended at e1 and had two invalid gaps between gs1-ge1 and
+        gs2-ge2 milliseconds, this method will generate the following three segments
+            SS1: starting at s1 and ending at gs1
+            SS2: starting at ge1 and ending at gs2
+            SS3: starting at ge2 and ending at e1
+
+        Args:
+            new_seg: The Segment that is being split
+
+            seg_start: An integer showing the start time of the segment in milliseconds
+
+            seg_end: An integer showing the end time of the segment in milliseconds
+
+            rest_pupil_size: rest pupil size for the current scene
+
+        Returns:
+            subsegments: a list of newly generated "Segment"s
+
+            samp_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+                new Segment in the old Segment's all_data field
+
+            fix_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+                new Segment in the old Segment's fixation_data field
+
+            sac_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+                new Segment in the old Segment's saccade_data field
+
+            event_inds: a list of tuples of the form (start, end) that detrmines the index of the start and end of each
+                new Segment in the old Segment's event_data field
+        """
+        timegaps = new_seg.getgaps()
+        subsegments = []
+        sub_segid = 0
+        samp_inds = []
+        fix_inds = []
+        saccade_inds = []
+        event_inds = []
+        last_samp_idx = 0
+        last_fix_idx = 0
+        last_sac_idx = 0
+        last_event_idx = 0
+        sub_seg_time_start = seg_start
+        for timebounds in timegaps:
+            sub_seg_time_end = timebounds[0] #end of this sub_seg is start of this gap
+            last_samp_idx, all_start,all_end = all_index.get_chunk(last_samp_idx, sub_seg_time_start, sub_seg_time_end)
+            last_fix_idx, fix_start, fix_end = fix_index.get_chunk(last_fix_idx, sub_seg_time_start, sub_seg_time_end)
+            if saccade_data != None:
+                last_sac_idx, sac_start, sac_end = sac_index.get_chunk(last_sac_idx, sub_seg_time_start, sub_seg_time_end)
+                saccade_data_in_part = saccade_data[sac_start:sac_end]
+            else:
+                saccade_data_in_part = None
+            if event_data != None:
+                last_event_idx, event_start, event_end = event_index.get_chunk(last_event_idx, sub_seg_time_start, sub_seg_time_end)
+                event_data_in_part = event_data[event_start:event_end]
+            else:
+                event_data_in_part = None
+
+            sub_seg_time_start = timebounds[1] #beginning of the next sub_seg is end of this gap
+            if fix_end - fix_start>0:
+                try:
+                    new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data=saccade_data_in_part,
+                                  event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo,
+                                  feature_families = feature_families)
+                except  Exception as e:
+                    warn(str(e))
+                    if params.DEBUG:
+                        raise
+                    else:
+                        continue
+            else:
+                continue
+            subsegments.append(new_sub_seg)
+            samp_inds.append((all_start,all_end))
+            fix_inds.append((fix_start, fix_end))
+            if saccade_data != None:
+                saccade_inds.append((sac_start, sac_end))
+            if event_data != None:
+                event_inds.append((event_start, event_end))
+            sub_segid +=1
+
+        # handling the last sub_seg
+        sub_seg_time_end = seg_end #end of last sub_seg is the end of seg
+        last_samp_idx, all_start,all_end = all_index.get_chunk(last_samp_idx, sub_seg_time_start, sub_seg_time_end)
+        last_fix_idx, fix_start, fix_end = fix_index.get_chunk(last_fix_idx, sub_seg_time_start, sub_seg_time_end)
+        if saccade_data != None:
+            last_sac_idx, sac_start, sac_end = sac_index.get_chunk(last_sac_idx, sub_seg_time_start, sub_seg_time_end)
+            saccade_data_in_part = saccade_data[sac_start:sac_end]
+        else:
+            saccade_data_in_part = None
+        if event_data != None:
+            last_event_idx, event_start, event_end = event_index.get_chunk(last_event_idx, sub_seg_time_start, sub_seg_time_end)
+            event_data_in_part = event_data[event_start:event_end]
+        else:
+            event_data_in_part = None
+        if fix_end - fix_start>0: #add the last sub_seg
+            try:
+                new_sub_seg = Segment(segid+"_"+str(sub_segid), all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data_in_part,
+                                  event_data=event_data_in_part, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo,
+                                  feature_families = feature_families)
+            except Exception as e:
+                warn(str(e))
+                if params.DEBUG:
+                    raise
+                else:
+                    new_sub_seg = None
+
+            if new_sub_seg != None:
+                subsegments.append(new_sub_seg)
+                samp_inds.append((all_start,all_end))
+                fix_inds.append((fix_start, fix_end))
+                if saccade_data != None:
+                    saccade_inds.append((sac_start, sac_end))
+                if event_data != None:
+                    event_inds.append((event_start, event_end))
+        #end of handling the last sub_seg
+
+        return subsegments, samp_inds, fix_inds, saccade_inds, event_inds
+    ######################################## end partition_segment()
+
+
+    if timestamp_indices is None:
+        timestamp_indices = build_timestamp_indices(all_data, fixation_data, saccade_data, event_data)
+    all_index, fix_index, sac_index, event_index = timestamp_indices
+    segments = []
+    for (segid, start, end) in seglist:
+        if params.VERBOSE != "QUIET":
+            print("segid, start, end:", segid, start, end)
+        # Selecting subsets of points belonging only to the current segment
+        if prune_length != None:
+            end = min(end, start+prune_length)
+        _, all_start, all_end = all_index.get_chunk(0, start, end)
+        _, fix_start, fix_end = fix_index.get_chunk(0, start, end)
+        if saccade_data != None:
+            _, sac_start, sac_end = sac_index.get_chunk(0, start, end)
+            saccade_data_in_seg = saccade_data[sac_start:sac_end]
+        else:
+            sac_start = None
+            sac_end = None
+            saccade_data_in_seg = None
+        if event_data != None:
+            _, event_start, event_end = event_index.get_chunk(0, start, end)
+            event_data_in_seg = event_data[event_start:event_end]
+        else:
+            event_start = None
+            event_end = None
+            event_data_in_seg = None
+
+        if segment_blinks is not None:
+            blinks = segment_blinks.get((all_start, all_end))
+        else:
+            blinks = None
+
+        if fix_end - fix_start>0:
+            try:
+                new_seg = Segment(segid, all_data[all_start:all_end], fixation_data[fix_start:fix_end], saccade_data = saccade_data_in_seg,
+						        event_data=event_data_in_seg, aois=aoilist, prune_length=prune_length, rest_pupil_size = rest_pupil_size, export_pupilinfo = export_pupilinfo,
+                              feature_families = feature_families, blinks = blinks)
+            except  Exception as e:
+                warn(str(e))
+                if params.DEBUG:
+                    raise
+                else:
+                    continue
+        else:
+            continue
+
+        if (new_seg.largest_data_gap > params.MAX_SEG_TIMEGAP) and auto_partition: #low quality segment that needs to be partitioned!
+            try:
+                new_segs, samp_inds, fix_inds, sac_inds, event_inds = partition_segment(new_seg, start, end, rest_pupil_size, export_pupilinfo=export_pupilinfo)
+                if saccade_data != None and event_data != None:
+                    for nseg,samp,fix,sac,eve in zip(new_segs, samp_inds, fix_inds, sac_inds, event_inds):
+                        if nseg.length > params.MINSEGSIZE:
+                            nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1],eve[0],eve[1])
+                            segments.append(nseg)
+                elif saccade_data != None and event_data == None:
+                    for nseg,samp,fix,sac in zip(new_segs, samp_inds, fix_inds, sac_inds):
+                        if nseg.length > params.MINSEGSIZE:
+                            nseg.set_indices(samp[0],samp[1],fix[0],fix[1],sac[0],sac[1])
+                            segments.append(nseg)
+                elif saccade_data == None and event_data != None:
+                    for nseg,samp,fix,eve in zip(new_segs, samp_inds, fix_inds, event_inds):
+                        if nseg.length > params.MINSEGSIZE:
+                            nseg.set_indices(samp[0],samp[1],fix[0],fix[1],event_st=eve[0],event_end=eve[1])
+                            segments.append(nseg)
+                else:
+                    for nseg,samp,fix in zip(new_segs, samp_inds, fix_inds):
+                        if nseg.length > params.MINSEGSIZE:
+                            nseg.set_indices(samp[0],samp[1],fix[0],fix[1])
+                            segments.append(nseg)
+            except Exception as e:
+                raise Exception("Error while partitioning scene. "+str(e))
+
+        else:   #good quality segment OR no auto_partition
+            new_seg.set_indices(all_start,all_end,fix_start,fix_end,sac_start,sac_end,event_start,event_end)
+            segments.append(new_seg)
+    return segments
+
+
 def merge_aoistats(main_AOI_Stat,new_AOI_Stat,total_time,total_numfixations,sc_start=0):
         """a helper method that updates the AOI_Stat object of this Scene with a new AOI_Stat object
 
@@ -840,21 +983,13 @@ def merge_aoi_fixations(maois, new_AOI_Stat, total_time, total_numfixations, sc_
             sc_start: start time (timestamp) of the scene
     """
     if new_AOI_Stat.features['numfixations'] > 0:
-        aoi_list = [maois, new_AOI_Stat]
-        numfixations = sumfeat(aoi_list, "features['numfixations']")
-        maois.features['longestfixation'] = maxfeat(aoi_list, "features['longestfixation']")
+        durations = maois.stats['fixationduration'].merge(new_AOI_Stat.stats['fixationduration'])
+        maois.features['longestfixation'] = durations.max
         maois.features['totaltimespent'] += new_AOI_Stat.features['totaltimespent']
-        aggregate_meanfixationduration = maois.features['totaltimespent'] / numfixations
-        maois.features['stddevfixationduration'] = aggregatestddevfeat(aoi_list, "features['numfixations']", "features['stddevfixationduration']", "features['meanfixationduration']", aggregate_meanfixationduration)
+        maois.features['stddevfixationduration'] = durations.stddev(0)
         maois.features['numfixations'] +=  new_AOI_Stat.features['numfixations']
-        maois.features['meanfixationduration'] = aggregate_meanfixationduration
-        maois.features['proportiontime'] = float(maois.features['totaltimespent'])/total_time
-        maois.features['proportionnum'] = float(maois.features['numfixations'])/total_numfixations
-
-        if maois.features['totaltimespent'] > 0:
-            maois.features['fixationrate'] = float(maois.features['numfixations']) / maois.features['totaltimespent']
-        else:
-            maois.features['fixationrate'] = -1
+        maois.features['meanfixationduration'] = maois.features['totaltimespent'] / maois.features['numfixations']
+        set_aoi_fixation_rates(maois, total_time, total_numfixations)
 
         if new_AOI_Stat.features['timetofirstfixation'] != -1:
             maois.features['timetofirstfixation'] = min(maois.features['timetofirstfixation'], deepcopy(new_AOI_Stat.features['timetofirstfixation']) + new_AOI_Stat.starttime - sc_start)
@@ -862,6 +997,24 @@ def merge_aoi_fixations(maois, new_AOI_Stat, total_time, total_numfixations, sc_
             maois.features['timetolastfixation'] = max(maois.features['timetolastfixation'], deepcopy(new_AOI_Stat.features['timetolastfixation']) + new_AOI_Stat.starttime - sc_start)
 
 
+def set_aoi_fixation_rates(maois, total_time, total_numfixations):
+    """ Sets the proportion and rate features of the fixations of a merged AOI_Stat from its totals
+        Args:
+            maois: AOI_Stat object of this Scene
+
+            total_time: duration of the scene
+
+            total_numfixations: number of fixations in the scene
+    """
+    maois.features['proportiontime'] = float(maois.features['totaltimespent'])/total_time
+    maois.features['proportionnum'] = float(maois.features['numfixations'])/total_numfixations
+
+    if maois.features['totaltimespent'] > 0:
+        maois.features['fixationrate'] = float(maois.features['numfixations']) / maois.features['totaltimespent']
+    else:
+        maois.features['fixationrate'] = -1
+
+
 def merge_aoi_distance(maois, new_AOI_Stat):
     """ Merge distance features such as
             mean_distance:            mean of distances from the screen
@@ -875,15 +1028,13 @@ def merge_aoi_distance(maois, new_AOI_Stat):
             maois: AOI_Stat object of this Scene (must have been initialised)
             new_AOI_Stat: a new AOI_Stat object
     """
-    aoi_list = [maois, new_AOI_Stat]
     if new_AOI_Stat.numdistancedata > 0:
-        total_distances = sumfeat(aoi_list, 'numdistancedata')
-        aggregate_mean_distance = weightedmeanfeat(aoi_list, 'numdistancedata', "features['meandistance']")
-        maois.features['stddevdistance'] = aggregatestddevfeat(aoi_list, 'numdistancedata', "features['stddevdistance']",
-                                                                    "features['meandistance']", aggregate_mean_distance)
-        maois.features['maxdistance'] = maxfeat(aoi_list, "features['maxdistance']")
-        maois.features['mindistance'] = minfeat(aoi_list, "features['mindistance']")
-        maois.features['meandistance'] = aggregate_mean_distance
+        distances = maois.stats['distance'].merge(new_AOI_Stat.stats['distance'])
+        maois.features['stddevdistance'] = distances.stddev(0)
+        maois.features['maxdistance'] = distances.max
+        # -1 if this AOI_Stat had no data before
+        maois.features['mindistance'] = min(maois.features['mindistance'], distances.min)
+        maois.features['meandistance'] = distances.mean
         if maois.starttime > new_AOI_Stat.starttime:
             maois.features['startdistance'] = new_AOI_Stat.features['startdistance']
         if maois.endtime < new_AOI_Stat.endtime:
@@ -904,14 +1055,13 @@ def merge_aoi_pupil(maois, new_AOI_Stat):
             maois: AOI_Stat object of this Scene (must have been initialised)
             new_AOI_Stat: a new AOI_Stat object
     """
-    aoi_list = [maois, new_AOI_Stat]
     if (new_AOI_Stat.numpupilsizes > 0):
-        aggregate_mean_pupil = weightedmeanfeat(aoi_list, 'numpupilsizes', "features['meanpupilsize']")
-        maois.features['stddevpupilsize'] = aggregatestddevfeat(aoi_list, 'numpupilsizes', "features['stddevpupilsize']",
-                                                                        "features['meanpupilsize']", aggregate_mean_pupil)
-        maois.features['maxpupilsize'] = maxfeat(aoi_list, "features['maxpupilsize']")
-        maois.features['minpupilsize'] = minfeat(aoi_list, "features['minpupilsize']")
-        maois.features['meanpupilsize'] = aggregate_mean_pupil
+        sizes = maois.stats['pupilsize'].merge(new_AOI_Stat.stats['pupilsize'])
+        maois.features['stddevpupilsize'] = sizes.stddev(0)
+        maois.features['maxpupilsize'] = sizes.max
+        # -1 if this AOI_Stat had no data before
+        maois.features['minpupilsize'] = min(maois.features['minpupilsize'], sizes.min)
+        maois.features['meanpupilsize'] = sizes.mean
         if maois.starttime > new_AOI_Stat.starttime:
             maois.features['startpupilsize'] = new_AOI_Stat.features['startpupilsize']
         if maois.endtime < new_AOI_Stat.endtime:
@@ -919,12 +1069,12 @@ def merge_aoi_pupil(maois, new_AOI_Stat):
         maois.numpupilsizes += new_AOI_Stat.numpupilsizes
 
     if (new_AOI_Stat.numpupilvelocity > 0):
-        aggregate_mean_velocity =  weightedmeanfeat(aoi_list, 'numpupilvelocity', "features['meanpupilvelocity']")
-        maois.features['stddevpupilvelocity'] = aggregatestddevfeat(aoi_list, 'numpupilvelocity', "features['stddevpupilvelocity']",
-                                                                        "features['meanpupilvelocity']", aggregate_mean_velocity)
-        maois.features['maxpupilvelocity'] = maxfeat(aoi_list, "features['maxpupilvelocity']")
-        maois.features['minpupilvelocity'] = minfeat(aoi_list, "features['minpupilvelocity']")
-        maois.features['meanpupilvelocity'] = aggregate_mean_velocity
+        velocities = maois.stats['pupilvelocity'].merge(new_AOI_Stat.stats['pupilvelocity'])
+        maois.features['stddevpupilvelocity'] = velocities.stddev(0)
+        maois.features['maxpupilvelocity'] = velocities.max
+        # -1 if this AOI_Stat had no data before
+        maois.features['minpupilvelocity'] = min(maois.features['minpupilvelocity'], velocities.min)
+        maois.features['meanpupilvelocity'] = velocities.mean
         maois.numpupilvelocity += new_AOI_Stat.numpupilvelocity
 
 def merge_aoi_events(maois, new_AOI_Stat, total_time, sc_start):
@@ -953,9 +1103,7 @@ def merge_aoi_events(maois, new_AOI_Stat, total_time, sc_start):
         maois.features['numleftclic'] += new_AOI_Stat.features['numleftclic']
         maois.features['numrightclic'] += new_AOI_Stat.features['numrightclic']
         maois.features['numdoubleclic'] += new_AOI_Stat.features['numdoubleclic']
-        maois.features['leftclicrate'] = float(maois.features['numleftclic'])/total_time
-        maois.features['rightclicrate'] = float(maois.features['numrightclic'])/total_time
-        maois.features['doubleclicrate'] = float(maois.features['numdoubleclic'])/total_time
+        set_aoi_event_rates(maois, total_time)
 
         if new_AOI_Stat.features['timetofirstleftclic'] != -1:
             maois.features['timetofirstleftclic'] = min(maois.features['timetofirstleftclic'], deepcopy(new_AOI_Stat.features['timetofirstleftclic']) + new_AOI_Stat.starttime - sc_start)
@@ -972,130 +1120,56 @@ def merge_aoi_events(maois, new_AOI_Stat, total_time, sc_start):
             maois.features['timetolastdoubleclic'] = max(maois.features['timetolastdoubleclic'], deepcopy(new_AOI_Stat.features['timetolastdoubleclic']) + new_AOI_Stat.starttime - sc_start)
 
 
-def weightedmeanfeat(obj_list, totalfeat,ratefeat):
-    """a helper method that calculates the weighted average of a target feature over a list of Segments
+def set_aoi_event_rates(maois, total_time):
+    """ Sets the click rates of a merged AOI_Stat from its totals
+        Args:
+            maois: AOI_Stat object of this Scene
+            total_time: duration of the scene
+    """
+    maois.features['leftclicrate'] = float(maois.features['numleftclic'])/total_time
+    maois.features['rightclicrate'] = float(maois.features['numrightclic'])/total_time
+    maois.features['doubleclicrate'] = float(maois.features['numdoubleclic'])/total_time
+
+
+def weightedmean(weights, values):
+    """a helper method that calculates the weighted average of a list of values
 
     Args:
-        obj_list: a list of Segments which all have a numeric field for which the weighted average is calculated
-
-        totalfeat: a string containing the name of the feature that has the total value of the target feature
+        weights: a list of numbers, the weight of each value (e.g. the number of samples of each Segment)
 
-        ratefeat: a string containing the name of the feature that has the rate value of the target feature
+        values: a list of numbers
 
     Returns:
-        the weighted average of the ratefeat over the Segments
+        the weighted average of the values, 0 if the sum of the weights is 0
     """
-    num_valid = float(0)
-    num = 0
-
-    for obj in obj_list:
-        t = eval('obj.'+totalfeat)
-        num_valid += t * eval('obj.'+ratefeat)
-        num += t
-    if num != 0:
-        return num_valid / num
+    total = sum(weights)
+    if total != 0:
+        return sum(map(lambda w, v: w * v, weights, values)) / float(total)
     return 0
 
-def aggregatestddevfeat(obj_list, totalfeat, sdfeat, meanfeat, meanscene):
-    """a helper method that calculates the aggregated standard deviation of a target feature over a list of Segments
+
+def aggregatestddev(weights, stddevs, means, mean):
+    """a helper method that calculates the standard deviation of the values of several groups around a given mean
 
     Args:
-        obj_list: a list of Segments which all have a numeric field for which the stdev is calculated
+        weights: a list of numbers, the number of values in each group
+
+        stddevs: a list of numbers, the standard deviation of each group (nan is taken as 0)
 
-        totalfeat: a string containing the name of the feature that has the total value of the target feature
+        means: a list of numbers, the mean of each group
 
-        ratefeat: a string containing the name of the feature that has the rate value of the target feature
+        mean: the mean around which the standard deviation is calculated
 
     Returns:
-        the weighted average of the ratefeat over the Segments
+        the aggregated standard deviation, 0 if there are less than 2 values
     """
     num = float(0)
     den = float(0)
-
-    for obj in obj_list:
-        t = eval('obj.'+totalfeat)
+    for (t, sd, m) in zip(weights, stddevs, means):
         if t > 0:
-            sd = eval('obj.'+sdfeat)
             if math.isnan(sd): sd = 0
-            meanobj = eval('obj.'+meanfeat)
-
-            num += (t-1) * sd**2 + t * (meanobj-meanscene)**2
+            num += (t-1) * sd**2 + t * (m-mean)**2
             den += t
-
     if den > 1:
-        return math.sqrt(float(num)/(den-1))
+        return math.sqrt(num/(den-1))
     return 0
-
-def sumfeat(obj_list, feat):
-    """a helper method that calculates the sum of a target feature over a list of objects
-
-    Args:
-
-        obj_list: a list of objects
-
-        feat: a string containing the name of the target feature
-
-    Returns:
-        the sum of the target feature over the given list of objects
-    """
-    sum = 0
-    for obj in obj_list:
-        sum += eval('obj.'+feat)
-    return sum
-
-def minfeat(obj_list, feat, nonevalue = None):
-    """a helper method that calculates the min of a target feature over a list of objects
-
-    Args:
-
-        obj_list: a list of objects
-
-        feat: a string containing the name of the target feature
-
-        nonevalue: value to be ignored when computing the min (typically -1 in EMDAT)
-
-    Returns:
-        the min of the target feature over the given list of objects
-    """
-    min = float('+infinity')
-    for obj in obj_list:
-        val = eval('obj.'+feat)
-        if min > val and val != nonevalue:
-            min = val
-    return min
-
-def maxfeat(obj_list, feat):
-    """a helper method that calculates the max of a target feature over a list of objects
-
-    Args:
-
-        obj_list: a list of objects
-
-        feat: a string containing the name of the target feature
-
-    Returns:
-        the max of the target feature over the given list of objects
-    """
-    max = float('-infinity')
-    for obj in obj_list:
-        val = eval('obj.'+feat)
-        if max < val:
-            max = val
-    return max
-
-def mergevalues(obj_list, field):
-    """a helper method that merges lists of values stored in field
-
-    Args:
-
-        obj_list: a list of objects
-
-        field: name of a field that contains a list of values (string)
-
-    Returns:
-        a list formed by merging corresponding lists from collection of subjects
-    """
-    mergedlist = []
-    for obj in obj_list:
-        mergedlist.extend(eval('obj.'+ field))
-    return mergedlist
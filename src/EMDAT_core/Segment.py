@@ -14,9 +14,181 @@ from EMDAT_core import geometry
 from EMDAT_core.AOI import *
 from warnings import warn
 from math import isnan
-from EMDAT_core.AOI import _fixation_inside_aoi
+import numpy as np
+
+# Segment features computed by each of the Segment calculators, by feature family. The validity, length,
+# sample and fixation count features are always computed.
+FEATURE_FAMILIES = {
+    'blink': ['blinknum', 'blinkdurationtotal', 'blinkdurationmean', 'blinkdurationstd', 'blinkdurationmin',
+              'blinkdurationmax', 'blinkrate', 'blinktimedistancemean', 'blinktimedistancestd',
+              'blinktimedistancemin', 'blinktimedistancemax'],
+    'pupil': ['meanpupilsize', 'stddevpupilsize', 'maxpupilsize', 'minpupilsize', 'startpupilsize', 'endpupilsize',
+              'meanpupilvelocity', 'stddevpupilvelocity', 'maxpupilvelocity', 'minpupilvelocity'],
+    'distance': ['meandistance', 'stddevdistance', 'maxdistance', 'mindistance', 'startdistance', 'enddistance'],
+    'fixation': ['fixationrate', 'meanfixationduration', 'stddevfixationduration', 'sumfixationduration',
+                 'meanpathdistance', 'sumpathdistance', 'stddevpathdistance', 'eyemovementvelocity',
+                 'sumabspathangles', 'abspathanglesrate', 'meanabspathangles', 'stddevabspathangles',
+                 'sumrelpathangles', 'relpathanglesrate', 'meanrelpathangles', 'stddevrelpathangles'],
+    'saccade': ['numsaccades', 'sumsaccadedistance', 'meansaccadedistance', 'stddevsaccadedistance',
+                'longestsaccadedistance', 'sumsaccadeduration', 'meansaccadeduration', 'stddevsaccadeduration',
+                'longestsaccadeduration', 'meansaccadespeed', 'stddevsaccadespeed', 'maxsaccadespeed',
+                'minsaccadespeed', 'fixationsaccadetimeratio'],
+    'event': ['numevents', 'numleftclic', 'numrightclic', 'numdoubleclic', 'numkeypressed', 'leftclicrate',
+              'rightclicrate', 'doubleclicrate', 'keypressedrate', 'timetofirstleftclic', 'timetofirstrightclic',
+              'timetofirstdoubleclic', 'timetofirstkeypressed'],
+    'aoisequence': ['aoisequence']
+}
+
+# feature families which use the features of other families
+FEATURE_FAMILY_DEPENDENCIES = {
+    'saccade': ['fixation']     # fixationsaccadetimeratio uses sumfixationduration
+}
+
+
+def plan_features(featurelist = None, aoifeaturelist = None, aoifeaturelabels = None):
+    """Returns the feature families needed to export the given features
+
+    The arguments are the ones that will be given to get_features (or export_features, write_features_tsv)
+    once the "Participant"s are read. Passing the returned set as feature_families to the "Segment"s and
+    "Scene"s restricts the calculations to the features that will be exported. Use the union of the
+    feature lists when the features are exported several times.
+
+    Args:
+        featurelist: if not None, a list containing the name of features to be exported. If this is None all
+            features will be exported
+        aoifeaturelist: if not None, a list of features to be exported for each of the "AOI"s.
+        aoifeaturelabels: if not None, a list of AOI related features to be exported, of the form [AOI name]_[feature name]
+
+    Returns:
+        a set of names from FEATURE_FAMILIES and AOI_FEATURE_FAMILIES, or None if all the features are needed
+    """
+    if featurelist is None and aoifeaturelist is None and aoifeaturelabels is None:
+        return None
+
+    families = set()
+    if featurelist is None:
+        families.update(FEATURE_FAMILIES.keys())
+    else:
+        for family, names in FEATURE_FAMILIES.iteritems():
+            if any(map(lambda name: name in names, featurelist)):
+                families.add(family)
+
+    if aoifeaturelabels:    # an exact list of AOI features was given
+        for family, names in AOI_FEATURE_FAMILIES.iteritems():
+            if any(map(lambda label: any(map(lambda name: '_'+name in label, names)), aoifeaturelabels)):
+                families.add(family)
+    elif aoifeaturelist is None:    # all the AOI features
+        families.update(AOI_FEATURE_FAMILIES.keys())
+    else:
+        for family, names in AOI_FEATURE_FAMILIES.iteritems():
+            if any(map(lambda name: name in names, aoifeaturelist)):
+                families.add(family)
+
+    for family in list(families):
+        families.update(FEATURE_FAMILY_DEPENDENCIES.get(family, []))
+    return families
+
+
+class SegmentValidity():
+    """The validity information of a Segment (or a Scene), without its samples and features
+
+    A SegmentValidity is much smaller than the Segment it describes, it is used to send the validity of the
+    "Segment"s across processes and to explore validity thresholds (see ValidityProcessing) once the features
+    are exported. Segment inherits the validity methods of this class.
+
+    Attributes:
+        segid: A string containing the id of the Segment (or Scene)
+        see Segment for the other attributes
+    """
+
+    attributes = ["start", "end", "length", "length_invalid", "completion_time", "numsamples", "numfixations",
+                  "largest_data_gap", "proportion_valid", "proportion_valid_fix", "validity1", "validity2", "validity3",
+                  "is_valid", "time_gaps"]
+
+    def __init__(self, segment):
+        """Inits SegmentValidity class
+
+        Args:
+            segment: a Segment or Scene object
+
+        Yields:
+            a SegmentValidity object
+        """
+        self.segid = segment.getid()
+        for name in SegmentValidity.attributes:
+            setattr(self, name, getattr(segment, name, None))
+
+    def getid(self):
+        """Returns the segid for this Segment
+
+        Returns: a string conataining the segid for this Segment
+        """
+        return self.segid
+
+    def calc_validity1(self, threshold = params.VALID_PROP_THRESH):
+        """Returns a boolean indicating whether this Segment is valid using proportion of valid samples threshold
+
+        Args:
+            threshold: the minimum proportion of valid samples for a Segment or Scene to be
+                considered valid. By default set to value VALID_PROP_THRESH from module params.py
+        """
+        return self.proportion_valid > threshold
+
+    def calc_validity2(self, threshold = params.VALID_TIME_THRESH):
+        """Returns a boolean indicating whether this Segment is valid using largest acceptable gap threshold
+        """
+        return self.largest_data_gap <= threshold
+
+
+    def calc_validity3(self, threshold = params.VALID_PROP_THRESH):
+        """Returns a boolean indicating whether this Segment is valid using proportion of (valid + restored) samples threshold
+        """
+        return self.proportion_valid_fix > threshold
+
+    def get_validity(self):
+        """Determines if this Segment is valid with the given validity method set in params.VALIDITY_METHOD
+
+        Returns:
+            A boolean indicating whether this Segment is valid
+        """
+        if params.VALIDITY_METHOD == 1:
+            return self.validity1
+        elif params.VALIDITY_METHOD == 2:
+            return self.validity2
+        elif params.VALIDITY_METHOD == 3:
+            return self.validity3
+
+
+class SampleValidityScan:
+    """The counts of valid samples and the gaps of invalid samples of a Segment, computed once from the columns
+    of its samples for all the validity features
+
+    Attributes:
+        numsamples: An integer indicating the number of samples
+        numvalid: An integer indicating the number of valid samples
+        numvalid_fix: An integer indicating the number of valid or restored samples (see calc_validity_fixation)
+        invalid_gaps: a list of tuples (start, end) for the gaps of invalid samples (see get_validity_gaps)
+        blink_gap_starts, blink_gap_ends: arrays with the start and end of the gaps of samples invalid for blinks
+            (is_valid_blink)
+    """
+
+    def __init__(self, all_data):
+        """Inits SampleValidityScan class
+
+        Args:
+            all_data: The DatapointArray holding the samples which make up the Segment
+        """
+        #samples = all_data.stimuliname == 'ScreenRec'
+        samples = all_data.stimuliname != ''
+        valid = samples & all_data.is_valid
+        self.numsamples = np.count_nonzero(samples)
+        self.numvalid = np.count_nonzero(valid)
+        self.numvalid_fix = np.count_nonzero(valid | (samples & (all_data.fixationindex != -1)))
+        self.invalid_gaps = get_validity_gaps(all_data.is_valid, all_data.timestamp)
+        [(self.blink_gap_starts, self.blink_gap_ends)] = get_gap_bounds(all_data.is_valid_blink, all_data.timestamp)
 
-class Segment():
+
+class Segment(SegmentValidity):
     """A Segment is a class that represents the smallest unit of aggregated eye data samples with a conceptual meaning.
 
     A segment is the smallest unit of aggregated eye data samples that has conceptual meaning. This class is the equivalent
@@ -24,8 +196,12 @@ class Segment():
 
     Attributes:
         segid: A string containing the id of the Segment.
-        alldata: A list of "Datapoint"s for this Segment
+        alldata: A DatapointArray holding the samples of this Segment
         features: A dict with feature names as its keys and feature values as its values
+        stats: A dict with the "RunningStats" of the values behind the features of the computed families, used to merge
+            the features of several "Segment"s: 'fixationduration', 'pathdistance', 'abspathangles', 'relpathangles',
+            'blinkduration', 'blinktimedistance', 'pupilsize', 'pupilvelocity', 'distance', 'saccadedistance',
+            'saccadeduration', 'saccadespeed' and 'fixationsaccadetimeratio' (one value per "Segment")
         completion_time: An integer indicating total duration of the Segment in milliseconds
             minimum is 16 ms (length of one sample with 60Hz sampling rate (ms))
         start: An integer indicating the Segment's start time in milliseconds
@@ -52,13 +228,15 @@ class Segment():
         fixation_end: timestamp of the last entry from list of "Fixation"s for this Segment
         aoi_data: A list of AOI_Stat objects for relevant "AOI"s for this Segment
         has_aois: A boolean indicating if this Segment has AOI features calculated for it
+        feature_families: the set of feature families computed for this Segment (see plan_features), None if all of them
     """
-    def __init__(self, segid, all_data, fixation_data, saccade_data = None, event_data = None, aois = None, prune_length = None, rest_pupil_size = 0, export_pupilinfo = False):
+    def __init__(self, segid, all_data, fixation_data, saccade_data = None, event_data = None, aois = None, prune_length = None, rest_pupil_size = 0, export_pupilinfo = False,
+                 feature_families = None, blinks = None):
         """
         Args:
             segid: A string containing the id of the Segment.
 
-            all_data: a list of "Datapoint"s which make up this Segment.
+            all_data: a DatapointArray holding the samples which make up this Segment.
 
             fixation_data: a list of "Fixation"s which make up this Segment.
 
@@ -77,81 +255,120 @@ class Segment():
 
             export_pupilinfo: True to export raw pupil data in EMDAT output (False by default).
 
+            feature_families: If not None, a set of feature families as returned by plan_features. Only the features
+                of these families are calculated, along with the validity, length and count features.
+
+            blinks: If not None, the blinks of this Segment as returned by get_blinks, e.g. computed with
+                get_segment_blinks for all the "Segment"s of a Recording at once (not used if prune_length is not None)
+
         Yields:
             a Segment object
         """
         self.segid = segid
+        self.feature_families = feature_families
         #self.all_data = all_data
         #self.fixation_data = fixation_data
         #self.saccade_data = saccade_data
         #self.event_data = event_data
         self.features = {}
+        self.stats = {}
 
         """ If prune_length specified, keep only data from start to start + prune_length
             of the segment
         """
         if prune_length:
-            all_data = filter(lambda x: x.timestamp <= self.start + prune_length, all_data)
-            fixation_data = filter(lambda x: x.timestamp <= self.start + prune_length, fixation_data)
+            prune_end = int(all_data.timestamp[0]) + prune_length
+            all_data = all_data[all_data.timestamp <= prune_end]
+            fixation_data = filter(lambda x: x.timestamp <= prune_end, fixation_data)
             if event_data != None:
-                event_data = filter(lambda x: x.timestamp <= self.start + prune_length, event_data)
+                event_data = filter(lambda x: x.timestamp <= prune_end, event_data)
             if saccade_data != None:
-                saccade_data = filter(lambda x: x.timestamp <= self.start + prune_length, saccade_data)
+                saccade_data = filter(lambda x: x.timestamp <= prune_end, saccade_data)
                 
-        self.completion_time = all_data[-1].timestamp - all_data[0].timestamp
+        self.completion_time = int(all_data.timestamp[-1] - all_data.timestamp[0])
         if self.completion_time == 0:
             raise Exception("Zero length segment")
 
         self.features['completion_time'] = self.completion_time
-        self.start = all_data[0].timestamp
+        self.start = int(all_data.timestamp[0])
         self.numfixations = len(fixation_data)
 
         """ Validity-related features, determining if the segment is valid """
         self.time_gaps = []
         self.all_invalid_gaps = []
-        self.largest_data_gap = self.calc_largest_validity_gap(all_data)
-        self.proportion_valid = self.calc_validity_proportion(all_data)
-        self.proportion_valid_fix = self.calc_validity_fixation(all_data)
+        scan = SampleValidityScan(all_data)
+        self.largest_data_gap = self.calc_largest_validity_gap(all_data, scan)
+        self.proportion_valid = self.calc_validity_proportion(all_data, scan)
+        self.proportion_valid_fix = self.calc_validity_fixation(all_data, scan)
         self.validity1 = self.calc_validity1()
         self.validity2 = self.calc_validity2()
         self.validity3 = self.calc_validity3()
         self.is_valid = self.get_validity()
         self.length_invalid = self.get_length_invalid()
 
-        self.end = all_data[-1].timestamp
+        self.end = int(all_data.timestamp[-1])
         self.length = self.end - self.start
         self.features['length'] = self.end - self.start
         self.features['length_invalid'] = self.length_invalid
-        self.numsamples = self.calc_num_samples(all_data)
+        self.numsamples = self.calc_num_samples(all_data, scan)
         self.features['numsamples'] = self.numsamples
         self.numfixations = len(fixation_data)
         self.features['numfixations'] = self.numfixations
         self.features['fixationrate'] = float(self.numfixations) / (self.length - self.length_invalid)
+        if self.numfixations > 0:
+            self.fixation_start = fixation_data[0].timestamp
+            self.fixation_end = fixation_data[-1].timestamp
+        else:
+            self.fixation_start = -1
+            self.fixation_end = -1
 
         """ calculate blink features (no rest pupil size adjustments yet)"""
-        self.calc_blink_features(all_data)
+        if self.needs_features('blink'):
+            self.calc_blink_features(all_data, scan, None if prune_length else blinks)
 
         """ calculate pupil dilation features (no rest pupil size adjustments yet)"""
-        self.calc_pupil_features(all_data, export_pupilinfo, rest_pupil_size)
+        if self.needs_features('pupil'):
+            self.calc_pupil_features(all_data, export_pupilinfo, rest_pupil_size)
 
         """ calculate distance from screen features"""
-        self.calc_distance_features(all_data)
+        if self.needs_features('distance'):
+            self.calc_distance_features(all_data)
 
         """ calculate fixations, angles and path features"""
-        self.calc_fix_ang_path_features(fixation_data)
+        if self.needs_features('fixation'):
+            self.calc_fix_ang_path_features(fixation_data)
 
         """ calculate saccades features if available """
-        self.calc_saccade_features(saccade_data)
+        if self.needs_features('saccade'):
+            self.calc_saccade_features(saccade_data)
 
         """ calculate event features if available """
-        self.calc_event_features(event_data)
+        if self.needs_features('event'):
+            self.calc_event_features(event_data)
 
         """ calculate AOIs features """
         self.has_aois = False
-        if aois:
-            self.set_aois(aois, all_data, fixation_data, event_data, rest_pupil_size, export_pupilinfo)
-            self.features['aoisequence'] = self.generate_aoi_sequence(fixation_data, aois)
+        if aois and (self.needs_aoi_features() or self.needs_features('aoisequence')):
+            # each fixation is tested against the AOIs only once for all the AOI features
+            fixation_labels = FixationAOILabels(fixation_data, aois)
+            if self.needs_aoi_features():
+                self.set_aois(aois, all_data, fixation_data, event_data, rest_pupil_size, export_pupilinfo, fixation_labels)
+            if self.needs_features('aoisequence'):
+                self.features['aoisequence'] = self.generate_aoi_sequence(fixation_data, aois, fixation_labels)
+
 
+    def needs_features(self, family):
+        """Returns True if the features of the given family are calculated for this Segment
+
+        Args:
+            family: a key of FEATURE_FAMILIES or AOI_FEATURE_FAMILIES
+        """
+        return needs_feature_family(self.feature_families, family)
+
+    def needs_aoi_features(self):
+        """Returns True if any AOI feature is calculated for this Segment
+        """
+        return any(map(self.needs_features, AOI_FEATURE_FAMILIES.keys()))
 
     def set_indices(self,sample_st,sample_end,fix_st,fix_end,sac_st=None,sac_end=None,event_st=None,event_end=None):
         """Sets the index features
@@ -197,24 +414,28 @@ class Segment():
         raise Exception ('The indices values are accessed before setting the initial value in segement:'+self.segid+'!')
 
 
-    def set_aois(self, aois, all_data, fixation_data, event_data = None, rest_pupil_size = 0, export_pupilinfo = False):
+    def set_aois(self, aois, all_data, fixation_data, event_data = None, rest_pupil_size = 0, export_pupilinfo = False, fixation_labels = None):
         """Sets the relevant "AOI"s for this Segment
 
         Args:
-            all_data: a list of "Datapoint"s which make up this Segment
+            all_data: a DatapointArray holding the samples which make up this Segment
             fixation_data: The list of "Fixation"s which make up this Segment
             aois: a list of "AOI"s relevant to this Segment
             rest_pupil_size:
+            fixation_labels: If not None, the FixationAOILabels of fixation_data for aois
         """
 
         if len(aois) == 0:
             warn("No AOIs passed to segment:"+self.segid)
+        if fixation_labels is None:
+            fixation_labels = FixationAOILabels(fixation_data, aois)
         active_aois=[]
         self.aoi_data = {}
         for aoi in aois:
             #print "checking:",aoi.aid
             print("Generating features for %s AOI in segment %s" % (aoi.aid, self.segid))
-            aoistat = AOI_Stat(aoi, all_data, fixation_data, self.start, self.end, self.length_invalid, aois, event_data, rest_pupil_size, export_pupilinfo)
+            aoistat = AOI_Stat(aoi, all_data, fixation_data, self.start, self.end, self.length_invalid, aois, event_data, rest_pupil_size, export_pupilinfo,
+                               seg_fixation_labels=fixation_labels, feature_families=self.feature_families)
             self.aoi_data[aoi.aid] = aoistat
 
             act, _ = aoi.is_active_partition(self.fixation_start, self.fixation_end)
@@ -226,7 +447,7 @@ class Segment():
             msg = "No active AOIs passed to segment:%s start:%d end:%d" %(self.segid,self.start,self.end)
             warn(msg)
 
-    def calc_blink_features(self, all_data):
+    def calc_blink_features(self, all_data, scan = None, blinks = None):
         """ Calculates blink features such as
                 blink_num:                 number of blinks on the in the segment
                 blink_duration_total:       sum of the blink durations for this segment
@@ -240,11 +461,10 @@ class Segment():
                 blink_time_distance_min:    minimal time difference between consequtive blinks
                 blink_time_distance_max:    maximal time difference between consequtive blinks
             Args:
-                all_data: The list of "Datapoint"s which make up this Segment
+                all_data: The DatapointArray holding the samples which make up this Segment
+                scan: If not None, the SampleValidityScan of all_data
+                blinks: If not None, the tuple (durations, intervals) of the blinks in all_data as returned by get_blinks
         """
-        blink_durations = []
-        blink_intervals = []
-        last_blink_detected = -1
         self.features['blinknum']               = 0
         self.features['blinkdurationtotal']     = 0
         self.features['blinkdurationmean']      = 0
@@ -256,44 +476,28 @@ class Segment():
         self.features['blinktimedistancestd']   = -1
         self.features['blinktimedistancemin']   = -1
         self.features['blinktimedistancemax']   = -1
-        lower_bound, upper_bould = params.blink_threshold
-        ### File operations are for testing
-        #file = open('outputfolder/blinks/blinks_%s.txt' % all_data[0].participant_name, 'w
-        blinks_validity_gaps = self.calc_blink_validity_gaps(all_data)
-        if params.EYETRACKERTYPE == "SMI":
-            for i in range(len(blinks_validity_gaps)):
-                blink_length = blinks_validity_gaps[i][1] - blinks_validity_gaps[i][0]
-                blink_durations.append(blink_length)
-                #file.write('Blink start, end: %d %d\n' % (self.time_gaps[i][0], self.time_gaps[i][1]))
-                if last_blink_detected != -1:
-                    # Calculate time difference between start of current blink and end of previous blink
-                    blink_intervals.append(blinks_validity_gaps[i][0] - blinks_validity_gaps[last_blink_detected][1])
-                last_blink_detected = i
-        else:
-            for i in range(len(blinks_validity_gaps)):
-                blink_length = blinks_validity_gaps[i][1] - blinks_validity_gaps[i][0]
-                if blink_length <= upper_bould and blink_length >= lower_bound:
-                    blink_durations.append(blink_length)
-                    #file.write('Blink start, end: %d %d\n' % (self.time_gaps[i][0], self.time_gaps[i][1]))
-                    if last_blink_detected != -1:
-                        # Calculate time difference between start of current blink and end of previous blink
-                        blink_intervals.append(blinks_validity_gaps[i][0] - blinks_validity_gaps[last_blink_detected][1])
-                    last_blink_detected = i
-
-        #file.close()
-        if len(blink_durations) > 0:
-            self.features['blinknum']               = len(blink_durations)
-            self.features['blinkdurationtotal']     = sum(blink_durations)
-            self.features['blinkdurationmean']      = mean(blink_durations)
-            self.features['blinkdurationstd']       = stddev(blink_durations)
-            self.features['blinkdurationmin']       = min(blink_durations)
-            self.features['blinkdurationmax']       = max(blink_durations)
+        if blinks is None:
+            if scan is None:
+                scan = SampleValidityScan(all_data)
+            blinks = get_blinks(scan.blink_gap_starts, scan.blink_gap_ends, get_blink_threshold())
+        blink_durations, blink_intervals = blinks
+        durations = RunningStats(blink_durations.tolist())
+        intervals = RunningStats(blink_intervals.tolist())
+        self.stats['blinkduration'] = durations
+        self.stats['blinktimedistance'] = intervals
+        if durations.count > 0:
+            self.features['blinknum']               = durations.count
+            self.features['blinkdurationtotal']     = durations.total
+            self.features['blinkdurationmean']      = durations.mean
+            self.features['blinkdurationstd']       = durations.stddev()
+            self.features['blinkdurationmin']       = durations.min
+            self.features['blinkdurationmax']       = durations.max
             self.features['blinkrate']              = float(self.features['blinknum']) / (self.length - self.length_invalid)
-        if len(blink_intervals) > 0:
-            self.features['blinktimedistancemean']  = mean(blink_intervals)
-            self.features['blinktimedistancestd']   = stddev(blink_intervals)
-            self.features['blinktimedistancemin']   = min(blink_intervals)
-            self.features['blinktimedistancemax']   = max(blink_intervals)
+        if intervals.count > 0:
+            self.features['blinktimedistancemean']  = intervals.mean
+            self.features['blinktimedistancestd']   = intervals.stddev()
+            self.features['blinktimedistancemin']   = intervals.min
+            self.features['blinktimedistancemax']   = intervals.max
 
 
     def calc_pupil_features(self, all_data, export_pupilinfo, rest_pupil_size):
@@ -308,22 +512,23 @@ class Segment():
                 max_pupil_velocity:         largest pupil velocity in this segment
 
             Args:
-                all_data: The list of "Datapoint"s which make up this Segment
+                all_data: The DatapointArray holding the samples which make up this Segment
         """
         # check if pupil sizes are available for all missing points
-        pupil_invalid_data = filter(lambda x: x.pupilsize == -1 and x.gazepointx > 0, all_data)
-        if len(pupil_invalid_data) > 0:
+        num_pupil_invalid = np.count_nonzero((all_data.pupilsize == -1) & (all_data.gazepointx > 0))
+        if num_pupil_invalid > 0:
             if params.DEBUG:
                 raise Exception("Pupil size is unavailable for a valid data sample. \
-                        Number of missing points: " + str(len(pupil_invalid_data)))
+                        Number of missing points: " + str(num_pupil_invalid))
             else:
-                warn("Pupil size is unavailable for a valid data sample. Number of missing points: " + str(len(pupil_invalid_data)) )
+                warn("Pupil size is unavailable for a valid data sample. Number of missing points: " + str(num_pupil_invalid) )
 
 		#get all pupil sizes (valid + invalid)
-        #pupilsizes = map(lambda x: x.pupilsize, all_data)
+        #pupilsizes = all_data.pupilsize
         #get all datapoints where pupil size is available
-        valid_pupil_data = filter(lambda x: x.pupilsize > 0, all_data)
-        valid_pupil_velocity = filter(lambda x: x.pupilvelocity != -1, all_data)
+        valid_pupil = all_data.pupilsize > 0
+        validpupilsizes = all_data.pupilsize[valid_pupil].tolist()
+        valid_pupil_velocity = all_data.pupilvelocity[all_data.pupilvelocity != -1].tolist()
 
         #number of valid pupil sizes
         self.features['meanpupilsize']       = -1
@@ -336,33 +541,37 @@ class Segment():
         self.features['stddevpupilvelocity'] = -1
         self.features['maxpupilvelocity']    = -1
         self.features['minpupilvelocity']    = -1
-        self.numpupilsizes                   = len(valid_pupil_data)
+        self.numpupilsizes                   = len(validpupilsizes)
         self.numpupilvelocity                = len(valid_pupil_velocity)
+        self.stats['pupilsize']              = RunningStats()
+        self.stats['pupilvelocity']          = RunningStats()
 
         if self.numpupilsizes > 0: #check if the current segment has pupil data available
             if params.PUPIL_ADJUSTMENT == "rpscenter":
-                adjvalidpupilsizes = map(lambda x: x.pupilsize - rest_pupil_size, valid_pupil_data)
+                adjvalidpupilsizes = map(lambda x: x - rest_pupil_size, validpupilsizes)
             elif params.PUPIL_ADJUSTMENT == "PCPS":
-                adjvalidpupilsizes = map(lambda x: (x.pupilsize - rest_pupil_size) / (1.0 * rest_pupil_size), valid_pupil_data)
+                adjvalidpupilsizes = map(lambda x: (x - rest_pupil_size) / (1.0 * rest_pupil_size), validpupilsizes)
             else:
-                adjvalidpupilsizes = map(lambda x: x.pupilsize, valid_pupil_data)#valid_pupil_data
-
-            valid_pupil_velocity = map(lambda x: x.pupilvelocity, valid_pupil_velocity)#valid_pupil_data
+                adjvalidpupilsizes = validpupilsizes
 
             if export_pupilinfo:
-                self.pupilinfo_for_export = map(lambda x: [x.timestamp, x.pupilsize, rest_pupil_size], valid_pupil_data)
-            self.features['meanpupilsize']           = mean(adjvalidpupilsizes)
-            self.features['stddevpupilsize']         = stddev(adjvalidpupilsizes)
-            self.features['maxpupilsize']            = max(adjvalidpupilsizes)
-            self.features['minpupilsize']            = min(adjvalidpupilsizes)
-            self.features['startpupilsize']          = adjvalidpupilsizes[0]
-            self.features['endpupilsize']            = adjvalidpupilsizes[-1]
-
-            if len(valid_pupil_velocity) > 0:
-                self.features['meanpupilvelocity']   = mean(valid_pupil_velocity)
-                self.features['stddevpupilvelocity'] = stddev(valid_pupil_velocity)
-                self.features['maxpupilvelocity']    = max(valid_pupil_velocity)
-                self.features['minpupilvelocity']    = min(valid_pupil_velocity)
+                self.pupilinfo_for_export = map(lambda t, x: [t, x, rest_pupil_size], all_data.timestamp[valid_pupil].tolist(), validpupilsizes)
+            sizes = RunningStats(adjvalidpupilsizes)
+            self.stats['pupilsize']                  = sizes
+            self.features['meanpupilsize']           = sizes.mean
+            self.features['stddevpupilsize']         = sizes.stddev()
+            self.features['maxpupilsize']            = sizes.max
+            self.features['minpupilsize']            = sizes.min
+            self.features['startpupilsize']          = sizes.first
+            self.features['endpupilsize']            = sizes.last
+
+            velocities = RunningStats(valid_pupil_velocity)
+            self.stats['pupilvelocity']              = velocities
+            if velocities.count > 0:
+                self.features['meanpupilvelocity']   = velocities.mean
+                self.features['stddevpupilvelocity'] = velocities.stddev()
+                self.features['maxpupilvelocity']    = velocities.max
+                self.features['minpupilvelocity']    = velocities.min
 
     def calc_distance_features(self, all_data):
         """ Calculates distance features such as
@@ -374,27 +583,28 @@ class Segment():
                 end_distance:             distance from the screen in the end of this segment
 
             Args:
-                all_data: The list of "Datapoint"s which make up this Segment
+                all_data: The DatapointArray holding the samples which make up this Segment
         """
         # check if distances are available for all missing points
-        invalid_distance_data = filter(lambda x: x.distance <= 0 and x.gazepointx >= 0, all_data)
-        if len(invalid_distance_data) > 0:
+        num_invalid_distance = np.count_nonzero((all_data.distance <= 0) & (all_data.gazepointx >= 0))
+        if num_invalid_distance > 0:
             warn("Distance from screen is unavailable for a valid data sample. \
-                        Number of missing points: " + str(len(invalid_distance_data)))
+                        Number of missing points: " + str(num_invalid_distance))
 
-        #get all datapoints where distance is available
-        valid_distance_data = filter(lambda x: x.distance > 0, all_data)
+        #get all distances where distance is available
+        distances_from_screen = all_data.distance[all_data.distance > 0].tolist()
 
         #number of valid distance datapoints
-        self.numdistancedata = len(valid_distance_data)
+        self.numdistancedata = len(distances_from_screen)
+        distances = RunningStats(distances_from_screen)
+        self.stats['distance'] = distances
         if self.numdistancedata > 0: #check if the current segment has pupil data available
-            distances_from_screen               = map(lambda x: x.distance, valid_distance_data)
-            self.features['meandistance']       = mean(distances_from_screen)
-            self.features['stddevdistance']     = stddev(distances_from_screen)
-            self.features['maxdistance']        = max(distances_from_screen)
-            self.features['mindistance']        = min(distances_from_screen)
-            self.features['startdistance']      = distances_from_screen[0]
-            self.features['enddistance']        = distances_from_screen[-1]
+            self.features['meandistance']       = distances.mean
+            self.features['stddevdistance']     = distances.stddev()
+            self.features['maxdistance']        = distances.max
+            self.features['mindistance']        = distances.min
+            self.features['startdistance']      = distances.first
+            self.features['enddistance']        = distances.last
         else:
             self.features['meandistance']       = -1
             self.features['stddevdistance']     = -1
@@ -424,22 +634,32 @@ class Segment():
                 saccade_data: The list of saccade datapoints for this Segment
         """
         if saccade_data != None and len(saccade_data) > 0:
+            distances = RunningStats(map(lambda x: float(x.saccadedistance), saccade_data))
+            durations = RunningStats(map(lambda x: float(x.saccadeduration), saccade_data))
+            speeds = RunningStats(map(lambda x: float(x.saccadespeed), saccade_data))
+            self.stats['saccadedistance'] = distances
+            self.stats['saccadeduration'] = durations
+            self.stats['saccadespeed'] = speeds
             self.numsaccades = len(saccade_data)
             self.features['numsaccades'] = self.numsaccades
-            self.features['sumsaccadedistance'] = sum(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['meansaccadedistance'] = mean(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['stddevsaccadedistance'] = stddev(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['longestsaccadedistance'] = max(map(lambda x: float(x.saccadedistance), saccade_data))
-            self.features['sumsaccadeduration'] = sum(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['meansaccadeduration'] = mean(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['stddevsaccadeduration'] = stddev(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['longestsaccadeduration'] = max(map(lambda x: float(x.saccadeduration), saccade_data))
-            self.features['meansaccadespeed'] = mean(map(lambda x: float(x.saccadespeed), saccade_data))
-            self.features['stddevsaccadespeed'] = stddev(map(lambda x: float(x.saccadespeed), saccade_data))
-            self.features['maxsaccadespeed'] = max(map(lambda x: float(x.saccadespeed), saccade_data))
-            self.features['minsaccadespeed'] = min(map(lambda x: float(x.saccadespeed), saccade_data))
+            self.features['sumsaccadedistance'] = distances.total
+            self.features['meansaccadedistance'] = distances.mean
+            self.features['stddevsaccadedistance'] = distances.stddev()
+            self.features['longestsaccadedistance'] = distances.max
+            self.features['sumsaccadeduration'] = durations.total
+            self.features['meansaccadeduration'] = durations.mean
+            self.features['stddevsaccadeduration'] = durations.stddev()
+            self.features['longestsaccadeduration'] = durations.max
+            self.features['meansaccadespeed'] = speeds.mean
+            self.features['stddevsaccadespeed'] = speeds.stddev()
+            self.features['maxsaccadespeed'] = speeds.max
+            self.features['minsaccadespeed'] = speeds.min
             self.features['fixationsaccadetimeratio'] = float(self.features['sumfixationduration']) / self.features['sumsaccadeduration']
+            self.stats['fixationsaccadetimeratio'] = RunningStats([self.features['fixationsaccadetimeratio']])
         else:
+            self.stats['saccadedistance'] = RunningStats()
+            self.stats['saccadeduration'] = RunningStats()
+            self.stats['saccadespeed'] = RunningStats()
             self.numsaccades = 0
             self.features['numsaccades'] = 0
             self.features['sumsaccadedistance'] = -1
@@ -455,6 +675,7 @@ class Segment():
             self.features['maxsaccadespeed'] = -1
             self.features['minsaccadespeed'] = -1
             self.features['fixationsaccadetimeratio'] = -1
+            self.stats['fixationsaccadetimeratio'] = RunningStats([-1])
 
 
     def calc_fix_ang_path_features(self, fixation_data):
@@ -476,18 +697,16 @@ class Segment():
                 saccade_data: The list of saccade datapoints for this Segment
         """
         if self.numfixations > 0:
-            self.fixation_start = fixation_data[0].timestamp
-            self.fixation_end = fixation_data[-1].timestamp
-            self.features['meanfixationduration'] = mean(map(lambda x: float(x.fixationduration), fixation_data))
-            self.features['stddevfixationduration'] = stddev(map(lambda x: float(x.fixationduration), fixation_data))
-            self.features['sumfixationduration'] = sum(map(lambda x: x.fixationduration, fixation_data))
+            durations = RunningStats(map(lambda x: x.fixationduration, fixation_data))
+            self.stats['fixationduration'] = durations
+            self.features['meanfixationduration'] = durations.mean
+            self.features['stddevfixationduration'] = durations.stddev()
+            self.features['sumfixationduration'] = durations.total
             self.features['fixationrate'] = float(self.numfixations) / (self.length - self.length_invalid)
-            distances = self.calc_distances(fixation_data)
-            abs_angles = self.calc_abs_angles(fixation_data)
-            rel_angles = self.calc_rel_angles(fixation_data)
+            (distances, abs_angles, rel_angles) = self.calc_path_measures(fixation_data)
         else:
-            self.fixation_start = -1
-            self.fixation_end = -1
+            self.stats['fixationduration'] = RunningStats()
+            (distances, abs_angles, rel_angles) = ([], [], [])
             self.features['meanfixationduration'] = -1
             self.features['stddevfixationduration'] = -1
             self.features['sumfixationduration'] = -1
@@ -496,19 +715,25 @@ class Segment():
         self.numfixdistances = len(distances)
         self.numabsangles = len(abs_angles)
         self.numrelangles = len(rel_angles)
-        if len(distances) > 0:
-            self.features['meanpathdistance'] = mean(distances)
-            self.features['sumpathdistance'] = sum(distances)
-            self.features['stddevpathdistance'] = stddev(distances)
+        distances = RunningStats(distances)
+        abs_angles = RunningStats(abs_angles)
+        rel_angles = RunningStats(rel_angles)
+        self.stats['pathdistance'] = distances
+        self.stats['abspathangles'] = abs_angles
+        self.stats['relpathangles'] = rel_angles
+        if distances.count > 0:
+            self.features['meanpathdistance'] = distances.mean
+            self.features['sumpathdistance'] = distances.total
+            self.features['stddevpathdistance'] = distances.stddev()
             self.features['eyemovementvelocity'] = self.features['sumpathdistance']/(self.length - self.length_invalid)
-            self.features['sumabspathangles'] = sum(abs_angles)
-            self.features['abspathanglesrate'] = sum(abs_angles)/(self.length - self.length_invalid)
-            self.features['meanabspathangles'] = mean(abs_angles)
-            self.features['stddevabspathangles'] = stddev(abs_angles)
-            self.features['sumrelpathangles'] = sum(rel_angles)
-            self.features['relpathanglesrate'] = sum(rel_angles)/(self.length - self.length_invalid)
-            self.features['meanrelpathangles'] = mean(rel_angles)
-            self.features['stddevrelpathangles'] = stddev(rel_angles)
+            self.features['sumabspathangles'] = abs_angles.total
+            self.features['abspathanglesrate'] = abs_angles.total/(self.length - self.length_invalid)
+            self.features['meanabspathangles'] = abs_angles.mean
+            self.features['stddevabspathangles'] = abs_angles.stddev()
+            self.features['sumrelpathangles'] = rel_angles.total
+            self.features['relpathanglesrate'] = rel_angles.total/(self.length - self.length_invalid)
+            self.features['meanrelpathangles'] = rel_angles.mean
+            self.features['stddevrelpathangles'] = rel_angles.stddev()
         else:
             self.features['meanpathdistance'] = -1
             self.features['sumpathdistance'] = -1
@@ -575,93 +800,42 @@ class Segment():
             self.features['timetofirstkeypressed'] = -1
 
 
-    def calc_validity_proportion(self, all_data):
+    def calc_validity_proportion(self, all_data, scan = None):
         """Calculates the proportion of "Datapoint"s which are valid.
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segment
+            all_data: The DatapointArray holding the samples which make up this Segment
+            scan: If not None, the SampleValidityScan of all_data
 
         Returns:
             A float indicating the proportion of valid samples over all the samples in this Segment
         """
-        num_valid = float(0)
-        num = 0
-
-        for d in all_data:
-            #if d.stimuliname == 'ScreenRec':
-            #if d.stimuliname == 'Screen Recordings (1)'
-            if d.stimuliname != '':
-                num += 1
-                if d.is_valid:
-                    num_valid += 1
-#            else:
-#                print "###",d.event, d.data1
-        if num == 0:
+        if scan is None:
+            scan = SampleValidityScan(all_data)
+        if scan.numsamples == 0:
             return 0.0
         else:
-            return num_valid / num
+            return float(scan.numvalid) / scan.numsamples
 
 
-    def calc_largest_validity_gap(self, all_data):
+    def calc_largest_validity_gap(self, all_data, scan = None):
         """Calculates the largest gap of invalid samples in the "Datapoint"s for this Segment.
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segement
+            all_data: The DatapointArray holding the samples which make up this Segement
+            scan: If not None, the SampleValidityScan of all_data
 
         Returns:
             An integer indicating the length of largest invalid gap for this Segment in milliseconds
         """
         if self.numfixations == 0:
-            return all_data[-1].timestamp - all_data[0].timestamp
-        self.time_gaps = []
+            return int(all_data.timestamp[-1] - all_data.timestamp[0])
+        if scan is None:
+            scan = SampleValidityScan(all_data)
         self.all_invalid_gaps = []
-        max_size = 0
-        dindex = 0
-        datalen = len(all_data)
-        while dindex < datalen:
-            d = all_data[dindex]
-            while d.is_valid and (dindex < datalen - 1):
-                dindex += 1
-                d = all_data[dindex]
-            if not (d.is_valid):
-                gap_start = d.timestamp
-                while not (d.is_valid) and (dindex < datalen - 1):
-                    dindex += 1
-                    d = all_data[dindex]
-                if d.timestamp - gap_start > max_size:
-                    max_size = d.timestamp - gap_start
-                if d.timestamp - gap_start > params.MAX_SEG_TIMEGAP:
-                    self.time_gaps.append((gap_start, d.timestamp))
-            dindex += 1
-        return max_size
-
-
-    def calc_blink_validity_gaps(self, all_data):
-        """Calculates the blink validity gaps for this segment
+        self.time_gaps = filter(lambda (gap_start, gap_end): gap_end - gap_start > params.MAX_SEG_TIMEGAP, scan.invalid_gaps)
+        return max([0] + map(lambda (gap_start, gap_end): gap_end - gap_start, scan.invalid_gaps))
 
-        Args:
-            all_data: The list of "Datapoint"s which make up this Segement
-
-        Returns:
-            An array for tuples (int, int) indicating beginning and end timestamps for each contiguous invalid group of rows
-        """
-
-        blinks_validity_gaps = []
-        dindex = 0
-        datalen = len(all_data)
-        while dindex < datalen:
-            d = all_data[dindex]
-            while d.is_valid_blink and (dindex < datalen - 1):
-                dindex += 1
-                d = all_data[dindex]
-            if not (d.is_valid_blink):
-                gap_start = d.timestamp
-                while not (d.is_valid_blink) and (dindex < datalen - 1):
-                    dindex += 1
-                    d = all_data[dindex]
-                blinks_validity_gaps.append((gap_start, d.timestamp))
-            dindex += 1
-        return blinks_validity_gaps
 
     def getgaps(self):
         """Returns the list of invalid gaps > params.MAX_SEG_TIMEGAP for this Segment
@@ -690,7 +864,7 @@ class Segment():
             length += gap[1] - gap[0]
         return length
 
-    def calc_validity_fixation(self, all_data):
+    def calc_validity_fixation(self, all_data, scan = None):
         """Calculates the proportion of (valid + restored) "Datapoint"s over all "Datapoint"s of the Segment.
 
         Restored samples are the samples which are not valid but they are part of a Fixation.
@@ -699,61 +873,34 @@ class Segment():
         was looking at that same point during that period.
 
         Args:
-            all_data: The list of "Datapoint"s which make up this Segement
+            all_data: The DatapointArray holding the samples which make up this Segement
+            scan: If not None, the SampleValidityScan of all_data
 
         Returns:
             A float indicating the proportion of (valid + restored) samples over all the samples in this Segment
         """
         if self.numfixations == 0:
             return 0.0
-        num_valid = float(0)
-        num = 0
-
-        for d in all_data:
-            #if d.stimuliname == 'ScreenRec':
-            if d.stimuliname != '':
-                num += 1
-                if d.is_valid or d.fixationindex!=None:
-                    num_valid += 1.0
-#            else:
-#                print "###",d.event, d.data1
-        if num == 0:
+        if scan is None:
+            scan = SampleValidityScan(all_data)
+        if scan.numsamples == 0:
             return 0.0
         else:
-            return num_valid / num
+            return float(scan.numvalid_fix) / scan.numsamples
 
-    def calc_validity1(self, threshold = params.VALID_PROP_THRESH):
-        """Returns a boolean indicating whether this Segment is valid using proportion of valid samples threshold
+    def calc_path_measures(self, fixdata):
+        """returns the path distances, absolute angles and relative angles of a sequence of "Fixation"s
 
         Args:
-            threshold: the minimum proportion of valid samples for a Segment or Scene to be
-                considered valid. By default set to value VALID_PROP_THRESH from module params.py
-        """
-        return self.proportion_valid > threshold
-
-    def calc_validity2(self, threshold = params.VALID_TIME_THRESH):
-        """Returns a boolean indicating whether this Segment is valid using largest acceptable gap threshold
-        """
-        return self.largest_data_gap <= threshold
-
-
-    def calc_validity3(self, threshold = params.VALID_PROP_THRESH):
-        """Returns a boolean indicating whether this Segment is valid using proportion of (valid + restored) samples threshold
-        """
-        return self.proportion_valid_fix > threshold
-
-    def get_validity(self):
-        """Determines if this Segment is valid with the given validity method set in params.VALIDITY_METHOD
+            fixdata: a list of "Fixation"s
 
         Returns:
-            A boolean indicating whether this Segment is valid
+            a tuple of lists (distances, absolute angles, relative angles) as returned by calc_distances,
+            calc_abs_angles and calc_rel_angles
         """
-        if params.VALIDITY_METHOD == 1:
-            return self.validity1
-        elif params.VALIDITY_METHOD == 2:
-            return self.validity2
-        elif params.VALIDITY_METHOD == 3:
-            return self.validity3
+        (distances, abs_angles, rel_angles) = geometry.scan_path_measures(
+            map(lambda x: x.mappedfixationpointx, fixdata), map(lambda x: x.mappedfixationpointy, fixdata))
+        return distances.tolist(), abs_angles.tolist(), rel_angles.tolist()
 
     def calc_distances(self, fixdata):
         """returns the Euclidean distances between a sequence of "Fixation"s
@@ -761,19 +908,7 @@ class Segment():
         Args:
             fixdata: a list of "Fixation"s
         """
-        distances = []
-        lastx = fixdata[0].mappedfixationpointx
-        lasty = fixdata[0].mappedfixationpointy
-
-        for i in xrange(1, len(fixdata)):
-            x = fixdata[i].mappedfixationpointx
-            y = fixdata[i].mappedfixationpointy
-            dist = math.sqrt((x - lastx)**2 + (y - lasty)**2)
-            distances.append(dist)
-            lastx = x
-            lasty = y
-
-        return distances
+        return self.calc_path_measures(fixdata)[0]
 
     def calc_abs_angles(self, fixdata):
         """returns the absolute angles between a sequence of "Fixation"s that build a scan path.
@@ -786,19 +921,7 @@ class Segment():
         Returns:
             a list of absolute angles for the saccades formed by the given sequence of "Fixation"s in Radiant
         """
-        abs_angles = []
-        lastx = fixdata[0].mappedfixationpointx
-        lasty = fixdata[0].mappedfixationpointy
-
-        for i in xrange(1,len(fixdata)):
-            x = fixdata[i].mappedfixationpointx
-            y = fixdata[i].mappedfixationpointy
-            (dist, theta) = geometry.vector_difference((lastx,lasty), (x, y))
-            abs_angles.append(abs(theta))
-            lastx=x
-            lasty=y
-
-        return abs_angles
+        return self.calc_path_measures(fixdata)[1]
 
     def calc_rel_angles(self, fixdata):
         """returns the relative angles between a sequence of "Fixation"s that build a scan path in Radiant
@@ -813,65 +936,41 @@ class Segment():
         Returns:
             a list of relative angles for the saccades formed by the given sequence of "Fixation"s in Radiant
         """
-        rel_angles = []
-        lastx = fixdata[0].mappedfixationpointx
-        lasty = fixdata[0].mappedfixationpointy
-
-        for i in xrange(1, len(fixdata) - 1):
-            x = fixdata[i].mappedfixationpointx
-            y = fixdata[i].mappedfixationpointy
-            nextx = fixdata[i + 1].mappedfixationpointx
-            nexty = fixdata[i + 1].mappedfixationpointy
-            v1 = (lastx - x, lasty - y)
-            v2 = (nextx - x, nexty - y)
-
-            if v1 != (0.0, 0.0) and v2 != (0.0, 0.0):
-                v1_dot = math.sqrt(geometry.simpledotproduct(v1, v1))
-                v2_dot = math.sqrt(geometry.simpledotproduct(v2, v2))
-                normv1 = ((lastx - x) / v1_dot, (lasty - y) / v1_dot)
-                normv2 = ((nextx - x) / v2_dot, (nexty - y) / v2_dot)
-                dotproduct = geometry.simpledotproduct(normv1, normv2)
-                if dotproduct < -1:
-                    dotproduct = -1.0
-                if dotproduct > 1:
-                    dotproduct = 1.0
-                theta = math.acos(dotproduct)
-                rel_angles.append(theta)
-            else:
-                rel_angles.append(0.0)
-            lastx = x
-            lasty = y
-
-        return rel_angles
+        return self.calc_path_measures(fixdata)[2]
 
-    def calc_num_samples(self, all_data):
+    def calc_num_samples(self, all_data, scan = None):
         """Returns the number of samples in the Segment
 
         Args:
-            all_data: a list of "Datapoint"s which make up this Segment.
+            all_data: a DatapointArray holding the samples which make up this Segment.
+            scan: If not None, the SampleValidityScan of all_data
 
         Returns:
             An integer determining the number of samples in the Segment
 
         """
-        num = 0
-        for d in all_data:
-            if d.stimuliname != '':
-                num += 1
-        return num
+        if scan is None:
+            scan = SampleValidityScan(all_data)
+        return scan.numsamples
 
-    def generate_aoi_sequence(self, fixdata, aois):
+    def generate_aoi_sequence(self, fixdata, aois, fixation_labels = None):
         """returns the sequence of AOI's where "Fixation"s occurred
         Args:
             fixdata: a list of "Fixation"s
+            aois: a list of "AOI"s
+            fixation_labels: If not None, the FixationAOILabels of fixdata for aois
         Returns:
             a list of AOI names that correspond to the sequence of "Fixation" locations
         """
+        if fixation_labels is None:
+            fixation_labels = FixationAOILabels(fixdata, aois)
         sequence = []
-        for fix in fixdata:
-            for aoi in aois:
-                if _fixation_inside_aoi(fix, aoi.polyin, aoi.polyout) and aoi.is_active(fix.timestamp, fix.timestamp) :
-                    sequence.append(aoi.aid)
+        # (fixation, AOI) pairs in the order of the fixations, then of the AOIs
+        for i, j in zip(*np.nonzero(fixation_labels.inside)):
+            fix = fixdata[i]
+            aoi = fixation_labels.aois[j]
+            if aoi.is_active(fix.timestamp, fix.timestamp) :
+                sequence.append(aoi.aid)
         return sequence
 
     def getid(self):
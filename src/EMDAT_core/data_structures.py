@@ -7,9 +7,50 @@ Authors: Nicholas FitzGerald (creator), Oliver Schmid, Samad Kardan, Sebastien L
 Institution: The University of British Columbia.
 """
 from warnings import warn
+import itertools
+import numpy as np
 
 
-class Datapoint:
+class Record(object):
+    """
+    Base class of the records of a recording (Datapoint, Fixation, Saccade and Event)
+
+    The attributes of a record are stored in slots rather than in a dictionary per object, which makes
+    the records smaller and faster to create. Subclasses list their attributes in __slots__.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__ if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for (name, value) in state.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_columns(cls, columns, media_offset=(0, 0)):
+        """Returns a list of records (Fixation, Saccade or Event) from columns of values, without the dictionary
+        per record given to the constructor
+
+        Args:
+            columns: a dictionary mapping the keys of the data given to the constructor (see keys) to sequences
+                of values of the same length, the missing keys being None for all the records
+            media_offset: see the constructor
+
+        Returns:
+            a list of records of this class
+        """
+        length = len(next(columns.itervalues())) if columns else 0
+        values = map(lambda key: columns[key] if key in columns else itertools.repeat(None, length), cls.keys)
+        records = []
+        for row in itertools.izip(*values):
+            record = cls.__new__(cls)
+            record.set_values(media_offset, *row)
+            records.append(record)
+        return records
+
+
+class Datapoint(Record):
     """
     A class that holds the information for one eye gaze data sample (one line of data logs)
 
@@ -19,6 +60,8 @@ class Datapoint:
 
         Please refer to the Tobii manual for the description of the rest of the attributes
     """
+    __slots__ = ["timestamp", "pupilsize", "pupilvelocity", "distance", "is_valid", "is_valid_blink", "stimuliname",
+                 "fixationindex", "gazepointx", "gazepointy", "segid"]
 
     def __init__(self, data):
         """
@@ -47,13 +90,276 @@ class Datapoint:
     def get_string(self, sep='\t'):
         return str(self.timestamp)+sep+str(self.pupilsize)+sep+str(self.pupilvelocity)+sep+str(self.distance)+sep+str(self.is_valid)+sep+str(self.stimuliname)+sep+str(self.fixationindex)#+sep+str(self.gazepointxleft)
 
-class Fixation:
+class CategoricalArray(object):
+    """
+    A column of strings (or other values) in which each distinct value is stored only once
+
+    Each element is stored as the small integer code of its value in the list of the distinct values of the
+    column (the categories), so comparing the column with a value compares integers. Slicing a CategoricalArray
+    returns a CategoricalArray whose codes are a view on the codes of the sliced one.
+
+    Attributes:
+        codes: an array of integers, the index in categories of the value of each element
+        categories: the sorted list of the distinct values
+    """
+
+    def __init__(self, codes, categories):
+        """Initializes a CategoricalArray from the codes of its elements
+
+        Args:
+            codes: an array of integers (see get_code_type)
+            categories: the list of values indexed by the codes
+        """
+        self.codes = codes
+        self.categories = categories
+
+    @staticmethod
+    def from_values(values):
+        """Returns a CategoricalArray holding the given values (values itself if it is a CategoricalArray)
+
+        Args:
+            values: a sequence of hashable values
+        """
+        if isinstance(values, CategoricalArray):
+            return values
+        values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+        categories = sorted(set(values))
+        code_type = get_code_type(len(categories))
+        if len(categories) == 1:
+            codes = np.zeros(len(values), dtype=code_type)
+        else:
+            lookup = dict(zip(categories, xrange(len(categories))))
+            codes = np.fromiter(itertools.imap(lookup.__getitem__, values), dtype=code_type, count=len(values))
+        return CategoricalArray(codes, categories)
+
+    @staticmethod
+    def concatenate(arrays):
+        """Returns a CategoricalArray holding the elements of several CategoricalArrays (in the given order)
+        """
+        if all(map(lambda a: a.categories == arrays[0].categories, arrays)):
+            return CategoricalArray(np.concatenate(map(lambda a: a.codes, arrays)), arrays[0].categories)
+        categories = sorted(set().union(*map(lambda a: a.categories, arrays)))
+        lookup = dict(zip(categories, xrange(len(categories))))
+        code_type = get_code_type(len(categories))
+        codes = map(lambda a: np.array(map(lookup.__getitem__, a.categories), dtype=code_type)[a.codes], arrays)
+        return CategoricalArray(np.concatenate(codes).astype(code_type), categories)
+
+    def get_code(self, value):
+        """Returns the code of a value, -1 if the value is not in the categories
+        """
+        return self.categories.index(value) if value in self.categories else -1
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return self.categories[self.codes[key]]
+        return CategoricalArray(self.codes[key], self.categories)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __eq__(self, value):
+        """Returns an array of booleans, True for the elements equal to value (a single value, or an array
+        of the same length compared element by element)
+        """
+        if isinstance(value, (CategoricalArray, np.ndarray, list)):
+            return np.asarray(self) == np.asarray(value)
+        return self.codes == self.get_code(value)
+
+    def __ne__(self, value):
+        return ~(self == value)
+
+    def __array__(self, dtype=None):
+        categories = np.empty(len(self.categories), dtype=np.object_)
+        categories[:] = self.categories
+        return categories[self.codes] if dtype is None else categories[self.codes].astype(dtype)
+
+    def tolist(self):
+        return np.asarray(self).tolist()
+
+
+def get_code_type(count):
+    """Returns the type of the codes of a CategoricalArray with count categories
+    """
+    return np.int16 if count <= np.iinfo(np.int16).max else np.int32
+
+
+class DatapointArray:
+    """
+    A class that holds the eye gaze data samples of a recording (or of a part of it) in columns
+
+    Rather than one Datapoint object per sample, each attribute of the samples is stored in a typed NumPy array
+    (the i-th sample being described by the i-th element of every array). Slicing a DatapointArray returns a
+    DatapointArray whose arrays are views on the arrays of the sliced one, so no data is copied when splitting
+    a recording into Segments. Indexing it with an integer (or iterating over it) returns "Datapoint"s.
+
+    Values that are None in a Datapoint (gaze coordinates and fixation index not available) are stored as -1.
+    The stimuli names are stored in a CategoricalArray.
+
+    Attributes:
+        timestamp, pupilsize, pupilvelocity, distance, is_valid, is_valid_blink, stimuliname, fixationindex,
+        gazepointx, gazepointy: arrays holding the attribute of the same name of every sample (see Datapoint)
+    """
+
+    fields = [("timestamp", np.int64),
+              ("pupilsize", np.float64),
+              ("pupilvelocity", np.float64),
+              ("distance", np.float64),
+              ("is_valid", np.bool_),
+              ("is_valid_blink", np.bool_),
+              ("stimuliname", CategoricalArray),
+              ("fixationindex", np.int64),
+              ("gazepointx", np.float64),
+              ("gazepointy", np.float64)]
+
+    # attributes that are None in a Datapoint when the value is not available
+    optional_fields = ["fixationindex", "gazepointx", "gazepointy"]
+
+    def __init__(self, data):
+        """Initializes a DatapointArray from the columns of data
+
+        Args:
+            data: a dictionary mapping each attribute name (see DatapointArray.fields) to a list
+                or an array of values, one per sample
+
+        Yields:
+            a DatapointArray object
+        """
+        for (name, dtype) in DatapointArray.fields:
+            if dtype is CategoricalArray:
+                setattr(self, name, CategoricalArray.from_values(data[name]))
+            else:
+                setattr(self, name, np.asarray(data[name], dtype=dtype))
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, long, np.integer)):
+            return self.get_datapoint(key)
+        return DatapointArray(dict((name, getattr(self, name)[key]) for (name, _) in DatapointArray.fields))
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.get_datapoint(i)
+
+    def get_datapoint(self, index):
+        """Returns one sample of this DatapointArray
+
+        Args:
+            index: an integer indicating the index of the sample
+
+        Returns:
+            a Datapoint object
+        """
+        data = {}
+        for (name, _) in DatapointArray.fields:
+            value = getattr(self, name)[index]
+            data[name] = value.item() if isinstance(value, np.generic) else value
+        for name in DatapointArray.optional_fields:
+            if data[name] == -1:
+                data[name] = None
+        return Datapoint(data)
+
+
+def datapoints_to_array(datapoints):
+    """Returns a DatapointArray holding the samples from a list of "Datapoint"s
+
+    Args:
+        datapoints: a list of "Datapoint"s
+
+    Returns:
+        a DatapointArray
+    """
+    data = {}
+    for (name, _) in DatapointArray.fields:
+        data[name] = map(lambda d: getattr(d, name), datapoints)
+    for name in DatapointArray.optional_fields:
+        data[name] = map(lambda v: -1 if v is None else v, data[name])
+    return DatapointArray(data)
+
+
+class DatapointArrayBuilder:
+    """
+    A class that accumulates eye gaze data samples column by column to build "DatapointArray"s,
+    without creating a Datapoint object per sample
+    """
+
+    def __init__(self):
+        """Inits DatapointArrayBuilder class
+
+        Yields:
+            an empty DatapointArrayBuilder object
+        """
+        self.clear()
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+    def clear(self):
+        """Removes all the samples from this DatapointArrayBuilder
+        """
+        self.columns = dict((name, []) for (name, _) in DatapointArray.fields)
+
+    def add(self, data):
+        """Adds a sample
+
+        Args:
+            data: a dictionary with the attributes of the sample, as given to the constructor of Datapoint
+        """
+        for (name, _) in DatapointArray.fields:
+            self.columns[name].append(data.get(name, None))
+        for name in DatapointArray.optional_fields:
+            if self.columns[name][-1] is None:
+                self.columns[name][-1] = -1
+
+    def pop_data(self):
+        """Returns a DatapointArray with the samples added since the last call, and removes them from this builder
+
+        Returns:
+            a DatapointArray
+        """
+        data = DatapointArray(self.columns)
+        self.clear()
+        return data
+
+
+def concatenate_datapoint_arrays(arrays):
+    """Returns a DatapointArray holding the samples of several "DatapointArray"s (in the given order)
+
+    Args:
+        arrays: a list of "DatapointArray"s
+
+    Returns:
+        a DatapointArray
+    """
+    if len(arrays) == 1:
+        return arrays[0]
+    data = {}
+    for (name, dtype) in DatapointArray.fields:
+        columns = map(lambda a: getattr(a, name), arrays)
+        if not arrays:
+            data[name] = []
+        elif dtype is CategoricalArray:
+            data[name] = CategoricalArray.concatenate(columns)
+        else:
+            data[name] = np.concatenate(columns)
+    return DatapointArray(data)
+
+class Fixation(Record):
     """
     A class that holds the information for one Fixation
 
     Attributes:
         segid: a string indicating the Segment to which this Fixation belongs
     """
+    __slots__ = ["fixationindex", "timestamp", "fixationduration", "mappedfixationpointx", "mappedfixationpointy",
+                 "segid"]
+
+    # the keys of the data given to the constructor, in the order of the arguments of set_values
+    keys = ["fixationindex", "timestamp", "fixationduration", "fixationpointx", "fixationpointy"]
 
     def __init__(self, data, media_offset = (0, 0)):
         """Initializes a Fixation with attributes
@@ -67,12 +373,16 @@ class Fixation:
         Yields:
             a Fixation object
         """
+        self.set_values(media_offset, *map(data.get, Fixation.keys))
 
-        self.fixationindex = data.get("fixationindex", None)
-        self.timestamp = data.get("timestamp", None)
-        self.fixationduration = data.get("fixationduration", None)
-        self.mappedfixationpointx = data.get("fixationpointx", None)
-        self.mappedfixationpointy = data.get("fixationpointy", None)
+    def set_values(self, media_offset, fixationindex, timestamp, fixationduration, fixationpointx, fixationpointy):
+        """Sets the attributes of this Fixation (see the constructor and Fixation.keys)
+        """
+        self.fixationindex = fixationindex
+        self.timestamp = timestamp
+        self.fixationduration = fixationduration
+        self.mappedfixationpointx = fixationpointx
+        self.mappedfixationpointy = fixationpointy
         self.segid = None
 
         if self.fixationduration == 0:
@@ -109,13 +419,20 @@ class Fixation:
     def get_string(self, sep='\t'):
         return str(self.fixationindex)+sep+str(self.timestamp)+sep+str(self.fixationduration)+sep+str(self.mappedfixationpointx)+sep+str(self.mappedfixationpointy)
 
-class Saccade:
+class Saccade(Record):
     """
     A class that holds the information for one Saccade
 
     Attributes:
         segid: a string indicating the Segment to which this Saccade belongs
     """
+    __slots__ = ["saccadeindex", "timestamp", "saccadeduration", "saccadedistance", "saccadespeed", "saccadeacceleration",
+                 "saccadestartpointx", "saccadestartpointy", "saccadeendpointx", "saccadeendpointy", "saccadequality",
+                 "segid"]
+
+    # the keys of the data given to the constructor, in the order of the arguments of set_values
+    keys = ["saccadeindex", "timestamp", "saccadeduration", "saccadedistance", "saccadespeed", "saccadeacceleration",
+            "saccadestartpointx", "saccadestartpointy", "saccadeendpointx", "saccadeendpointy", "saccadequality"]
 
     def __init__(self, data, media_offset = (0, 0)):
         """Initializes a Saccade with attributes
@@ -129,18 +446,24 @@ class Saccade:
         Yields:
             a Sacade object
         """
+        self.set_values(media_offset, *map(data.get, Saccade.keys))
 
-        self.saccadeindex = data.get("saccadeindex", None)
-        self.timestamp = data.get("timestamp", None)
-        self.saccadeduration = data.get("saccadeduration", None)
-        self.saccadedistance = data.get("saccadedistance", None)
-        self.saccadespeed = data.get("saccadespeed", None)
-        self.saccadeacceleration = data.get("saccadeacceleration", None)
-        self.saccadestartpointx = data.get("saccadestartpointx", None)
-        self.saccadestartpointy = data.get("saccadestartpointy", None)
-        self.saccadeendpointx = data.get("saccadeendpointx", None)
-        self.saccadeendpointy = data.get("saccadeendpointy", None)
-        self.saccadequality = data.get("saccadequality", None)
+    def set_values(self, media_offset, saccadeindex, timestamp, saccadeduration, saccadedistance, saccadespeed,
+                   saccadeacceleration, saccadestartpointx, saccadestartpointy, saccadeendpointx, saccadeendpointy,
+                   saccadequality):
+        """Sets the attributes of this Saccade (see the constructor and Saccade.keys)
+        """
+        self.saccadeindex = saccadeindex
+        self.timestamp = timestamp
+        self.saccadeduration = saccadeduration
+        self.saccadedistance = saccadedistance
+        self.saccadespeed = saccadespeed
+        self.saccadeacceleration = saccadeacceleration
+        self.saccadestartpointx = saccadestartpointx
+        self.saccadestartpointy = saccadestartpointy
+        self.saccadeendpointx = saccadeendpointx
+        self.saccadeendpointy = saccadeendpointy
+        self.saccadequality = saccadequality
         self.segid = None
 
         if self.saccadeduration == 0:
@@ -180,10 +503,29 @@ class Saccade:
         return str(self.saccadeindex)+sep+str(self.timestamp)+sep+str(self.saccadeduration)+sep+str(self.saccadedistance)+sep+str(self.saccadespeed)+sep+str(self.saccadeacceleration)+sep+str(
               self.saccadestartpointx)+sep+str(self.saccadestartpointy)+sep+str(self.saccadeendpointx)+sep+str(self.saccadeendpointy)+sep+str(self.saccadequality)
 
-class Event:
+# the types of the events classified by EMDAT (see Event.eventtype)
+EVENT_TYPES = ["LeftMouseClick", "RightMouseClick", "KeyPress"]
+LEFT_MOUSE_CLICK, RIGHT_MOUSE_CLICK, KEY_PRESS = range(len(EVENT_TYPES))
+OTHER_EVENT = -1
+EVENT_TYPE_CODES = dict(zip(EVENT_TYPES, range(len(EVENT_TYPES))))
+
+
+class Event(Record):
     """
     A class that holds the information for one Event
+
+    Attributes:
+        eventtype: the code of the type of the event (e.g. LEFT_MOUSE_CLICK, see EVENT_TYPES), OTHER_EVENT
+            for the other events
+        data1, data2: the coordinates of a mouse click (data2 is not set for other events), or the key code of
+            a key press (not set for other events)
     """
+    __slots__ = ["timestamp", "event", "eventKey", "x_coord", "y_coord", "key_code", "key_name", "description",
+                 "segid", "eventtype", "data1", "data2"]
+
+    # the keys of the data given to the constructor, in the order of the arguments of set_values
+    keys = ["timestamp", "event", "event_key", "x_coord", "y_coord", "key_code", "key_name", "description"]
+
     def __init__(self, data, media_offset=(0, 0)):
         """Initializes an Event with attributes
 
@@ -193,24 +535,30 @@ class Event:
         Yields:
             an Event object
         """
+        self.set_values(media_offset, *map(data.get, Event.keys))
 
-        self.timestamp = data.get("timestamp", None)
-        self.event = data.get("event", None)
-        self.eventKey = data.get("event_key", None)
-        self.x_coord = data.get("x_coord", None)
-        self.y_coord = data.get("y_coord", None)
-        self.key_code = data.get("key_code", None)
-        self.key_name = data.get("key_name", None)
-        self.description = data.get("description", None)
+    def set_values(self, media_offset, timestamp, event, event_key, x_coord, y_coord, key_code, key_name, description):
+        """Sets the attributes of this Event (see the constructor and Event.keys)
+        """
+        self.timestamp = timestamp
+        # the names of the events are shared by all the events of the same type
+        self.event = intern(event) if type(event) is str else event
+        self.eventtype = EVENT_TYPE_CODES.get(event, OTHER_EVENT)
+        self.eventKey = event_key
+        self.x_coord = x_coord
+        self.y_coord = y_coord
+        self.key_code = key_code
+        self.key_name = key_name
+        self.description = description
         self.segid = None
 
-        if self.event == "LeftMouseClick" or self.event == "RightMouseClick":
+        if self.eventtype == LEFT_MOUSE_CLICK or self.eventtype == RIGHT_MOUSE_CLICK:
             (media_offset_x, media_offset_y) = media_offset
             self.x_coord -= media_offset_x
             self.y_coord -= media_offset_y
             self.data1 = self.x_coord
             self.data2 = self.y_coord
-        elif self.event == "KeyPress":
+        elif self.eventtype == KEY_PRESS:
             self.data1 = self.key_code
 
     def set_segid(self, segid):
@@ -8,6 +8,7 @@ Institution: The University of British Columbia.
 """
 
 import os, sys, math, random
+import numpy as np
 
 
 def euclidean_distance(point1, point2):
@@ -85,3 +86,46 @@ def simpledotproduct(pt1, pt2):
     y2 = float(pt2[1])
 
     return x1*x2 + y1*y2
+
+def scan_path_measures(x, y):
+    """Returns the distances, absolute angles and relative angles of a scan path in one pass over its points
+
+    The values are the same as those computed pair by pair with euclidean_distance, vector_difference and
+    simpledotproduct (see Segment.calc_distances, calc_abs_angles and calc_rel_angles): the absolute angle of a
+    horizontal saccade is 0 in both directions, and the relative angle at a point is 0 if it is the same
+    as the previous or the next point.
+
+    The path of a whole recording can be computed once and sliced: the values of the fixations [start, end)
+    are distances[start:end-1], abs_angles[start:end-1] and rel_angles[start:end-2].
+
+    Args:
+        x, y: the coordinates of the points of the path (e.g. the mapped fixation points)
+
+    Returns:
+        a tuple of arrays (distances, abs_angles, rel_angles), of length n-1, n-1 and n-2 for n points (in Radiant)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    dx = x[1:] - x[:-1]
+    dy = y[1:] - y[:-1]
+    distances = np.sqrt(dx * dx + dy * dy)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theta = np.arctan(np.abs(dy) / np.abs(dx))
+    theta[dx == 0] = math.pi / 2
+    abs_angles = np.where(dx > 0, theta, math.pi - theta)
+    abs_angles[dy == 0] = 0.0
+
+    # vectors from each inner point to the previous and the next point
+    v1x = x[:-2] - x[1:-1]
+    v1y = y[:-2] - y[1:-1]
+    v2x = x[2:] - x[1:-1]
+    v2y = y[2:] - y[1:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm1 = np.sqrt(v1x * v1x + v1y * v1y)
+        norm2 = np.sqrt(v2x * v2x + v2y * v2y)
+        dotproduct = (v1x / norm1) * (v2x / norm2) + (v1y / norm1) * (v2y / norm2)
+        rel_angles = np.arccos(np.clip(dotproduct, -1.0, 1.0))
+    rel_angles[(norm1 == 0) | (norm2 == 0)] = 0.0
+
+    return distances, abs_angles, rel_angles
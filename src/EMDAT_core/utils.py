@@ -8,9 +8,26 @@ Authors: Samad Kardan (creator), Sebastien Lalle.
 Institution: The University of British Columbia.
 """
 
-from EMDAT_core.data_structures import Fixation
+from EMDAT_core.data_structures import Fixation, DatapointArray, LEFT_MOUSE_CLICK, RIGHT_MOUSE_CLICK, KEY_PRESS
 import params
 import math
+import csv
+import itertools
+import warnings
+import os
+import zlib
+import bz2
+import threading
+import Queue
+import subprocess
+import numpy as np
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 
 def point_inside_polygon(x,y,poly):
@@ -45,10 +62,53 @@ def point_inside_polygon(x,y,poly):
 
     return inside
 
+def points_inside_polygon(x, y, poly):
+    """Determines which points of a batch are inside a given polygon or not
+
+        Vectorized version of point_inside_polygon (same "Ray Casting Method"), each
+        edge of the polygon is tested against all the points at once.
+
+    Args:
+        x: an array (or list) with the x coordinates of the points
+        y: an array (or list) with the y coordinates of the points
+        poly: is a list of (x,y) pairs defining the polgon
+
+    Returns:
+        an array of booleans, True for the points inside the polygon.
+        Points with a NaN coordinate are never inside.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    inside = np.zeros(x.shape, dtype=bool)
+    n = len(poly)
+
+    with np.errstate(invalid='ignore'):
+        for i in range(n):
+            p1x,p1y = poly[i-1]
+            p2x,p2y = poly[i]
+            if p1y == p2y: # a horizontal edge is never crossed
+                continue
+            crossing = (y > min(p1y,p2y)) & (y <= max(p1y,p2y)) & (x <= max(p1x,p2x))
+            if p1x != p2x:
+                numerator = (y-p1y)*(p2x-p1x)
+                denominator = p2y-p1y
+                if numerator.dtype.kind in 'iu' and not isinstance(denominator, float):
+                    xinters = numerator // denominator + p1x # same integer division as point_inside_polygon
+                else:
+                    xinters = numerator / float(denominator) + p1x
+                crossing &= x <= xinters
+            inside ^= crossing
+
+    return inside
+
 def get_chunk(data, ind, start, end):
     """Returns index of first and last records in data that fall within a time interval (start-end)
+
+    When several chunks are looked up in the same data, a TimestampIndex built once for the data
+    should be used instead (see TimestampIndex.get_chunk).
+
     Args:
-        data: a list of subsequent Fixations or Datapoints
+        data: a list of subsequent Fixations, Saccades or Events, or a DatapointArray
         ind: an integer indicating the starting index in data for search, if not known
             should be set to zero.
         start: an integer indicating the start of interval in milliseconds
@@ -63,6 +123,13 @@ def get_chunk(data, ind, start, end):
         end_ind: an integer indicating the index of last record in the list that falls within
             the given time interval
     """
+    if isinstance(data, DatapointArray): # the timestamps of the samples are already in an array
+        return TimestampIndex(data).get_chunk(ind, start, end)
+    return _get_chunk_linear(data, ind, start, end)
+
+def _get_chunk_linear(data, ind, start, end):
+    """Linear search version of get_chunk, used when the timestamps of data are not sorted
+    """
     datalen = len(data)
     curr_ind = ind
     if curr_ind < datalen:
@@ -71,7 +138,7 @@ def get_chunk(data, ind, start, end):
                 while curr_ind < datalen and data[curr_ind].timestamp < start:
                     curr_ind += 1
 
-                if data[curr_ind-1].fixationduration!= None: # if the last fixation before, is mostly in this segment
+                if curr_ind > 0 and data[curr_ind-1].fixationduration!= None: # if the last fixation before, is mostly in this segment
                     if (data[curr_ind-1].timestamp + (data[curr_ind-1].fixationduration)/2.0) > start:
                         curr_ind -=1
                 start_ind = curr_ind
@@ -122,6 +189,221 @@ def get_chunk(data, ind, start, end):
 
     return curr_ind, start_ind, end_ind
 
+class TimestampIndex:
+    """Index of the timestamps of some eye tracking data, used to find the records that fall within
+    a time interval by binary search instead of a linear scan (see get_chunk)
+
+    The index is meant to be built once per Recording and reused for every Segment.
+
+    Attributes:
+        data: a list of subsequent Fixations, Saccades or Events, or a DatapointArray
+        timestamps: an array with the timestamp of each record in data
+        endtimes: an array with the end time (timestamp + duration) of each record, for Fixations only
+        is_fixation: True if data is a list of Fixations
+        is_sorted: True if the timestamps (and end times) are sorted, otherwise the index falls back to a linear search
+    """
+
+    def __init__(self, data):
+        """Inits TimestampIndex class
+
+        Args:
+            data: a list of subsequent Fixations, Saccades or Events, or a DatapointArray
+        """
+        self.data = data
+        self.is_fixation = len(data) > 0 and isinstance(data[0], Fixation)
+        self.endtimes = None
+        if isinstance(data, DatapointArray):
+            self.timestamps = data.timestamp
+        else:
+            self.timestamps = np.array(map(lambda x: x.timestamp, data), dtype=np.float64)
+        self.is_sorted = _is_sorted(self.timestamps)
+        if self.is_fixation:
+            self.endtimes = np.array(map(lambda x: x.timestamp + x.fixationduration if x.fixationduration is not None else np.nan, data), dtype=np.float64)
+            self.is_sorted = self.is_sorted and _is_sorted(self.endtimes)
+
+    def get_chunk(self, ind, start, end):
+        """Returns index of first and last records in data that fall within a time interval (start-end)
+
+        This is equivalent to get_chunk(self.data, ind, start, end) but takes O(log n) time.
+
+        Args:
+            ind: an integer indicating the starting index in data for search, if not known
+                should be set to zero.
+            start: an integer indicating the start of interval in milliseconds
+            end: an integer indicating the end of interval in milliseconds
+
+        Returns:
+            curr_ind, start_ind, end_ind: see get_chunk
+        """
+        data = self.data
+        datalen = len(data)
+        if not self.is_sorted:
+            return _get_chunk_linear(data, ind, start, end)
+        if ind >= datalen:
+            return datalen, datalen, datalen
+
+        curr_ind = max(ind, int(self.timestamps.searchsorted(start, 'left')))
+        if not self.is_fixation: # if this is not a Fixation we do not have to worry about half fixations
+            start_ind = curr_ind
+            curr_ind = max(start_ind, int(self.timestamps.searchsorted(end, 'right')))
+            return curr_ind, start_ind, curr_ind
+
+        if params.INCLUDE_HALF_FIXATIONS:
+            if curr_ind > 0 and data[curr_ind-1].fixationduration!= None: # if the last fixation before, is mostly in this segment
+                if (data[curr_ind-1].timestamp + (data[curr_ind-1].fixationduration)/2.0) > start:
+                    curr_ind -=1
+        start_ind = curr_ind
+        curr_ind = max(start_ind, int(self.endtimes.searchsorted(end, 'right')))
+
+        if curr_ind == start_ind:   # an empty chunk!
+            end_ind = curr_ind -1
+        elif data[curr_ind-1].fixationduration!= None: # if the last fixation is mostly outside this segment
+            if (data[curr_ind-1].timestamp + (data[curr_ind-1].fixationduration)/2.0) > end:
+                end_ind = curr_ind - 2
+            else:
+                end_ind = curr_ind -1
+        else:
+            end_ind = curr_ind -1
+
+        return curr_ind, start_ind, end_ind + 1 #because the last index is not inclusive in Python!
+
+
+def build_timestamp_indices(all_data, fixation_data, saccade_data=None, event_data=None):
+    """Returns the TimestampIndex of each kind of data of a Recording
+
+    Args:
+        all_data: a DatapointArray
+        fixation_data: a list of "Fixation"s
+        saccade_data: If not None, a list of "Saccade"s
+        event_data: If not None, a list of "Event"s
+
+    Returns:
+        a tuple with the TimestampIndex of all_data, fixation_data, saccade_data (None if no saccades)
+        and event_data (None if no events)
+    """
+    return (TimestampIndex(all_data), TimestampIndex(fixation_data),
+            TimestampIndex(saccade_data) if saccade_data is not None else None,
+            TimestampIndex(event_data) if event_data is not None else None)
+
+
+def get_validity_gaps(is_valid, timestamps):
+    """Returns the gaps of invalid samples, found from the changes of validity between consecutive samples
+
+    A gap starts at the timestamp of its first invalid sample and ends at the timestamp of the first valid
+    sample after it, or of the last sample if the samples are invalid up to the end.
+
+    Args:
+        is_valid: an array of booleans, the validity of each sample
+        timestamps: an array with the timestamp of each sample
+
+    Returns:
+        a list of (start, end) tuples
+    """
+    [(starts, ends)] = get_gap_bounds(is_valid, timestamps)
+    return zip(starts.tolist(), ends.tolist())
+
+
+def get_gap_bounds(is_valid, timestamps, ranges=None):
+    """Returns the start and end timestamps of the gaps of invalid samples (see get_validity_gaps) within each
+    of a list of ranges of samples, the samples being run-length encoded only once for all the ranges
+
+    The gaps of a range are the same as the gaps of its samples alone: a gap overlapping the start of the range
+    starts at its first sample, a gap overlapping its end ends at its last sample.
+
+    Args:
+        is_valid: an array of booleans, the validity of each sample
+        timestamps: an array with the timestamp of each sample
+        ranges: a list of (start, end) indices of the first and after the last sample of each range (e.g., the
+            indices of the samples of each Segment in the samples of a Recording), None for all the samples
+
+    Returns:
+        for each range, a tuple of arrays (the start timestamps of the gaps, their end timestamps)
+    """
+    invalid = ~np.asarray(is_valid, dtype=bool)
+    if ranges is None:
+        ranges = [(0, len(invalid))]
+    # runs of invalid samples: index of the first sample, index after the last one
+    changes = np.flatnonzero(invalid[1:] != invalid[:-1]) + 1
+    run_starts = changes[invalid[changes]]
+    run_ends = changes[~invalid[changes]]
+    if len(invalid) > 0 and invalid[0]:
+        run_starts = np.concatenate(([0], run_starts))
+    if len(invalid) > 0 and invalid[-1]:
+        run_ends = np.append(run_ends, len(invalid))
+
+    bounds = []
+    for (start, end) in ranges:
+        first = np.searchsorted(run_ends, start, 'right')
+        last = np.searchsorted(run_starts, end, 'left')
+        if end <= start or last <= first:
+            bounds.append((timestamps[:0], timestamps[:0]))
+            continue
+        gap_starts = np.maximum(run_starts[first:last], start)
+        gap_ends = np.minimum(run_ends[first:last], end - 1)
+        bounds.append((timestamps[gap_starts], timestamps[gap_ends]))
+    return bounds
+
+
+def get_blink_threshold():
+    """Returns the threshold on the duration of the blinks for get_blinks: every gap is a blink for SMI,
+    otherwise only the gaps within params.blink_threshold
+    """
+    return params.blink_threshold if params.EYETRACKERTYPE != "SMI" else None
+
+
+def get_blinks(gap_starts, gap_ends, threshold=None):
+    """Returns the blinks among the gaps of samples invalid for blinks
+
+    Args:
+        gap_starts, gap_ends: arrays with the start and end timestamps of the gaps (see get_gap_bounds)
+        threshold: a tuple (lower bound, upper bound) on the duration of a gap to be a blink (both included),
+            None if all the gaps are blinks
+
+    Returns:
+        durations: an array with the duration of each blink
+        intervals: an array with the time between the end of each blink and the start of the next one
+    """
+    durations = gap_ends - gap_starts
+    if threshold is not None:
+        lower_bound, upper_bound = threshold
+        is_blink = (durations >= lower_bound) & (durations <= upper_bound)
+        gap_starts, gap_ends, durations = gap_starts[is_blink], gap_ends[is_blink], durations[is_blink]
+    return durations, gap_starts[1:] - gap_ends[:-1]
+
+
+def get_segment_blinks(all_data, ranges, threshold=None):
+    """Returns the blinks of each of a list of ranges of samples, e.g. of all the "Segment"s of a Recording at once
+
+    Args:
+        all_data: a DatapointArray
+        ranges: a list of (start, end) indices of the first and after the last sample of each range
+        threshold: see get_blinks
+
+    Returns:
+        for each range, a tuple of arrays (durations, intervals) as returned by get_blinks
+    """
+    return map(lambda (gap_starts, gap_ends): get_blinks(gap_starts, gap_ends, threshold),
+               get_gap_bounds(all_data.is_valid_blink, all_data.timestamp, ranges))
+
+
+def _is_sorted(values):
+    """Returns True if an array of numbers is sorted in increasing order and has no NaN
+    """
+    return not np.isnan(values).any() and bool(np.all(values[1:] >= values[:-1]))
+
+def needs_feature_family(feature_families, family):
+    """Returns True if the features of a family have to be computed
+
+    Args:
+        feature_families: a set of feature family names as returned by plan_features,
+            or None if all the features are computed
+        family: the name of a feature family
+
+    Returns:
+        True or False.
+    """
+    return feature_families is None or family in feature_families
+
 def stddev(data):
     """Returns the standard deviation of a list of numbers
 
@@ -150,6 +432,100 @@ def mean(data):
         return 0
     return sum(data) / float(len(data))
 
+
+class RunningStats():
+    """Summary statistics of a series of numbers which can be merged with those of another series
+
+    The statistics of two series are merged in constant time (Chan et al.), so that the statistics of a Scene
+    are computed from those of its "Segment"s without their values. The standard deviation is computed from
+    the sum of squared differences from the mean (M2), which stays accurate when the series are merged.
+
+    Attributes:
+        count: the number of values
+        total: the sum of the values
+        mean: the mean of the values (0 if there is no value)
+        m2: the sum of squared differences from the mean
+        min, max: the smallest and largest values (None if there is no value)
+        first, last: the first and last values (None if there is no value)
+    """
+
+    def __init__(self, values = None):
+        """
+        Args:
+            values: If not None, a list of numbers. The mean and standard deviation are then the same as
+                mean(values) and stddev(values).
+        """
+        self.count = 0
+        self.total = 0
+        self.mean = 0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.first = None
+        self.last = None
+        if values:
+            m = mean(values)
+            self.count = len(values)
+            self.total = sum(values)
+            self.mean = m
+            self.m2 = sum(map(lambda x: (x-m)**2, values))
+            self.min = min(values)
+            self.max = max(values)
+            self.first = values[0]
+            self.last = values[-1]
+
+    def add(self, value):
+        """Adds a value after the current ones, by merging the statistics of this single value
+        """
+        self.merge(RunningStats([value]))
+
+    def merge(self, other):
+        """Adds the values of another RunningStats after the current ones
+
+        Args:
+            other: a RunningStats
+
+        Returns:
+            this RunningStats
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.__dict__.update(other.__dict__)
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / float(count)
+        self.m2 += other.m2 + delta * delta * self.count * other.count / float(count)
+        self.count = count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.last = other.last
+        return self
+
+    def stddev(self, undefined = float('nan')):
+        """Returns the standard deviation of the values, or undefined if there are less than 2 values
+        """
+        if self.count < 2:
+            return undefined
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+def merge_stats(stats_list):
+    """Returns a RunningStats with the values of a list of "RunningStats", in order
+
+    Args:
+        stats_list: a list of "RunningStats"
+
+    Returns:
+        a new RunningStats
+    """
+    merged = RunningStats()
+    for stats in stats_list:
+        merged.merge(stats)
+    return merged
+
 def generate_event_lists(event_data):
     """Returns separate list per type of events. Format:
     Args:
@@ -166,9 +542,9 @@ def generate_event_lists(event_data):
     x_prev_clic = -10000
     y_prev_clic = -10000
     for e in event_data:
-        if e.event == "KeyPress":
+        if e.eventtype == KEY_PRESS:
             keyp.append(e)
-        elif e.event == "LeftMouseClick":
+        elif e.eventtype == LEFT_MOUSE_CLICK:
             if double_clic_current and (e.timestamp - time_prev_clic) <= 700 and (e.data1-x_prev_clic)<=10 and (e.data2-y_prev_clic)<=10: #We define here a a double clic as two clics in no more than 700ms in a same area
                 doublec.append(e)
                 double_clic_current = False
@@ -179,7 +555,7 @@ def generate_event_lists(event_data):
                 time_prev_clic = e.timestamp
                 x_prev_clic = e.data1
                 y_prev_clic = e.data2
-        elif e.event == "RightMouseClick":
+        elif e.eventtype == RIGHT_MOUSE_CLICK:
             rightc.append(e)
 
     return (leftc, rightc, doublec, keyp)
@@ -220,6 +596,393 @@ def cast_int(string, invalid_value=None):
         return None
     return string_as_int
 
+
+def cast_float_column(strings, invalid_value=None):
+    """Converts a column of strings to floats at once, same as calling cast_float on each string
+
+    Args:
+        strings: a sequence of strings
+        invalid_value: if not None, a value that is converted to NaN (see cast_float)
+
+    Returns:
+        an array of floats, NaN where cast_float returns None (or NaN)
+    """
+    values = None
+    text = '\t' + '\t'.join(strings) + '\t' if None not in strings else None
+    if text is not None and not text.translate(None, '0123456789.+-eEnNaAiIfF\t'):
+        # a single call to the parser of numpy (which takes any whitespace as a separator), the empty
+        # strings being replaced by 'nan'. The parser stops without error at the first string which is
+        # not a number, after reading the number it starts with if any (e.g. 3 for '3,5'), so a last
+        # number is added: it is read only if all the strings are numbers.
+        while '\t\t' in text:
+            text = text.replace('\t\t', '\tnan\t')
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            values = np.fromstring(text[1:] + '0', dtype=np.float64, sep='\t')
+        if len(values) != len(strings) + 1: # some strings are not numbers
+            values = None
+        else:
+            values = values[:-1]
+    if values is None:
+        values = np.array(map(lambda v: np.nan if v is None else cast_float(v), strings), dtype=np.float64)
+    if invalid_value is not None:
+        values[values == invalid_value] = np.nan
+    return values
+
+
+def cast_int_column(strings, invalid_value=None):
+    """Converts a column of strings to integers at once, same as calling cast_int on each string
+
+    Args:
+        strings: a sequence of strings
+        invalid_value: if not None, a value that is considered as not valid (see cast_int)
+
+    Returns:
+        values: an array of integers, 0 where cast_int returns None
+        is_valid: an array of booleans, False where cast_int returns None
+    """
+    values = None
+    text = '\t' + '\t'.join(strings) if None not in strings else None
+    # each string is empty or matches -?[0-9]+ (its only minus sign, if any, is its first character)
+    if text is not None and not text.translate(None, '0123456789-\t') and '-' not in text.replace('\t-', '\t'):
+        values = cast_float_column(strings)
+        is_valid = ~np.isnan(values)
+        values = np.where(is_valid, values, 0)
+        if np.abs(values).max() < 2 ** 53 if len(values) else True: # the integers are exactly represented as floats
+            values = values.astype(np.int64)
+        else:
+            values = None
+    if values is None:
+        values = map(lambda v: cast_int(v) if v is not None else None, strings)
+        is_valid = np.array(map(lambda v: v is not None, values), dtype=np.bool_)
+        values = np.array(map(lambda v: v if v is not None else 0, values), dtype=np.int64)
+    if invalid_value is not None:
+        is_valid &= values != invalid_value
+    return values, is_valid
+
+
+def iter_column_blocks(f, delimiter='\t', block_size=None):
+    """Reads a delimiter separated file with a header line by blocks of rows, each block being split in columns
+
+    The values are the same as with csv.DictReader: empty lines are skipped and the missing values of short
+    rows are None. When all the rows have the same number of values and nothing is quoted, the whole block is
+    split at once instead of row by row.
+
+    Args:
+        f: a file object positioned on the header line
+        delimiter: the separator of the values in a row
+        block_size: if not None, the maximum number of lines in a block, otherwise all the lines are in one block
+
+    Yields:
+        header: the list of column names
+        columns: a dictionary mapping each column name in the header to the list of its values in the block
+    """
+    header = next(csv.reader([next(f)], delimiter=delimiter))
+    numcolumns = len(header)
+    while True:
+        lines = list(itertools.islice(f, block_size))
+        if not lines:
+            return
+        text = ''.join(lines)
+        if '"' not in text and '\r' not in text and \
+                map(str.count, lines, itertools.repeat(delimiter, len(lines))).count(numcolumns - 1) == len(lines):
+            values = (text[:-1] if text.endswith('\n') else text).replace('\n', delimiter).split(delimiter)
+            columns = map(lambda i: values[i::numcolumns], xrange(numcolumns))
+        else:
+            rows = filter(None, csv.reader(lines, delimiter=delimiter))
+            if not rows:
+                continue
+            columns = map(list, itertools.izip_longest(*rows))[:numcolumns]
+            columns += [[None] * len(rows)] * (numcolumns - len(columns))
+        yield header, dict(zip(header, columns))
+
+# (extension, first bytes) of the compressed files read by open_data_file
+COMPRESSION_FORMATS = [("gz", "\x1f\x8b"), ("bz2", "BZh"), ("xz", "\xfd7zXZ\x00")]
+
+
+def open_data_file(filename):
+    """Opens a data file for reading, the file being decompressed on the fly if it is compressed
+
+    The compression (gzip, bzip2 or xz) is recognized from the first bytes of the file, whatever its name.
+
+    Args:
+        filename: path to the file
+
+    Returns:
+        a file object, or a DecompressedFile for a compressed file
+    """
+    with open(filename, 'rb') as f:
+        start = f.read(6)
+    for (extension, signature) in COMPRESSION_FORMATS:
+        if start.startswith(signature):
+            return DecompressedFile(filename, extension)
+    return open(filename, 'r')
+
+
+def find_data_file(filename):
+    """Returns the name of a data file, or of its compressed version if only the compressed file exists
+
+    Args:
+        filename: path to the uncompressed file, or None
+
+    Returns:
+        filename if it exists, otherwise the first existing file among filename + ".gz", ".bz2" and ".xz",
+        otherwise filename
+    """
+    if filename is None or os.path.exists(filename):
+        return filename
+    for (extension, _) in COMPRESSION_FORMATS:
+        if os.path.exists(filename + "." + extension):
+            return filename + "." + extension
+    return filename
+
+
+# the number of bytes read at the beginning of a data file to find its layout (see sniff_data_file)
+SNIFF_SIZE = 1 << 16
+
+# the separators of values tried by sniff_data_file, in order
+SNIFF_DELIMITERS = "\t,;"
+
+
+def sniff_data_file(filename, required_columns, media_column=None, size=SNIFF_SIZE):
+    """Returns the layout of a delimiter separated data file, found from its first bytes only
+
+    The header is the first line containing all the required columns once split with one of SNIFF_DELIMITERS,
+    so the files can have any number of lines before it.
+
+    Args:
+        filename: path to the file (possibly compressed, see open_data_file)
+        required_columns: the names of the columns that the header must contain
+        media_column: the name of the column containing the media names, or None
+        size: the number of bytes to read, the last line read being completed
+
+    Returns:
+        a DataFileLayout
+
+    Raises:
+        Exception if no header with all the required columns is found in the bytes read
+    """
+    lines = []
+    read_size = 0
+    complete = True
+    with open_data_file(filename) as f:
+        for line in f:
+            lines.append(line)
+            read_size += len(line)
+            if read_size >= size:
+                complete = False
+                break
+
+    required_columns = set(required_columns)
+    best_index, best_header = None, []
+    for index, line in enumerate(lines):
+        for delimiter in SNIFF_DELIMITERS:
+            if delimiter not in line:
+                continue
+            header = next(csv.reader([line], delimiter=delimiter))
+            if required_columns.issubset(header):
+                layout = DataFileLayout(filename, delimiter, index, header, complete)
+                if media_column is not None:
+                    layout.add_media_names(lines[index + 1:], media_column)
+                return layout
+            if len(required_columns.intersection(header)) > len(required_columns.intersection(best_header)):
+                best_index, best_header = index, header
+
+    if best_index is None:
+        raise Exception("No header line with the columns %s in the first %d lines of %s"
+                        % (", ".join(sorted(required_columns)), len(lines), filename))
+    raise Exception("Missing columns %s in the header line %d of %s"
+                    % (", ".join(sorted(required_columns.difference(best_header))), best_index + 1, filename))
+
+
+class DataFileLayout():
+    """The layout of a delimiter separated data file, as found by sniff_data_file
+
+    Attributes:
+        filename: path to the file
+        delimiter: the separator of the values in a row
+        header_index: the index of the header line in the file (0 for the first line)
+        header: the list of column names
+        complete: True if the whole file was read to find the layout
+        media_names: the distinct values of the media column in the rows read, in order of appearance
+    """
+
+    def __init__(self, filename, delimiter, header_index, header, complete):
+        self.filename = filename
+        self.delimiter = delimiter
+        self.header_index = header_index
+        self.header = header
+        self.complete = complete
+        self.media_names = []
+
+    def add_media_names(self, lines, media_column):
+        """Adds the media names of the given data lines to media_names
+        """
+        column = self.header.index(media_column)
+        if not self.complete:
+            lines = lines[:-1]  # possibly the first part of a row split by a quoted line break
+        for row in csv.reader(lines, delimiter=self.delimiter):
+            if len(row) > column and row[column] not in self.media_names:
+                self.media_names.append(row[column])
+
+    def check_media_name(self, media_name):
+        """Checks that the rows read to find the layout contain the given media name
+
+        Raises:
+            Exception if the whole file was read and no row has that media name (only a warning if the media
+            name may be in the rows that were not read)
+        """
+        if media_name in self.media_names:
+            return
+        message = "No row with the media name '%s' in %s%s" % (media_name, "" if self.complete else "the first rows of ",
+                                                               self.filename)
+        if self.media_names:
+            message += " (media names: %s)" % ", ".join(self.media_names)
+        if self.complete:
+            raise Exception(message)
+        warnings.warn(message)
+
+    def skip_to_header(self, f):
+        """Skips the lines before the header in a file open at its beginning (the position in the file is
+        the position of the header, as with readline)
+        """
+        for _ in xrange(self.header_index):
+            f.readline()
+
+
+class DecompressedFile():
+    """A compressed file read line by line, as with a file object opened in 'r' mode
+
+    The file is decompressed in a background thread while the lines are read, by chunks of chunk_size
+    compressed bytes. At most max_chunks decompressed chunks are waiting to be read, so the whole
+    decompressed file is never in memory.
+
+    Attributes:
+        name: path to the file
+    """
+
+    def __init__(self, filename, compression, chunk_size=1 << 20, max_chunks=4):
+        """
+        Args:
+            filename: path to the file
+            compression: "gz", "bz2" or "xz"
+            chunk_size: the number of compressed bytes decompressed at once
+            max_chunks: the maximum number of decompressed chunks waiting to be read
+        """
+        if compression == "gz":
+            new_decompressor = lambda: zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif compression == "bz2":
+            new_decompressor = bz2.BZ2Decompressor
+        elif compression == "xz":
+            # without the lzma module (backports.lzma with Python 2), the file is decompressed by the xz program
+            new_decompressor = lzma.LZMADecompressor if lzma is not None else None
+        else:
+            raise Exception("Unknown compression: " + str(compression))
+        self.name = filename
+        self.closed = False
+        self.chunks = Queue.Queue(max_chunks)
+        self.thread = threading.Thread(target=self._decompress, args=(new_decompressor, chunk_size))
+        self.thread.daemon = True
+        self.thread.start()
+        self.lines = self._iter_lines()
+
+    def _decompress(self, new_decompressor, chunk_size):
+        """Puts the decompressed chunks of the file in the queue, then None (or the exception raised)
+        """
+        try:
+            if new_decompressor is None:
+                self._read_xz_output(chunk_size)
+                return
+            with open(self.name, 'rb') as f:
+                decompressor = new_decompressor()
+                for data in iter(lambda: f.read(chunk_size), ""):
+                    while data:
+                        try:
+                            chunk = decompressor.decompress(data)
+                        except EOFError:
+                            # the previous stream ended exactly at the end of the previous chunk (bz2 and xz)
+                            decompressor = new_decompressor()
+                            continue
+                        # the data after the end of a stream is a concatenated stream (e.g. with pigz or pbzip2)
+                        data = decompressor.unused_data
+                        if data:
+                            decompressor = new_decompressor()
+                        if chunk and not self._put(chunk):
+                            return
+                if hasattr(decompressor, "flush") and not self._put(decompressor.flush()):
+                    return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def _read_xz_output(self, chunk_size):
+        """Puts the chunks of the file decompressed by the xz program in the queue, then None
+        """
+        try:
+            process = subprocess.Popen(["xz", "--decompress", "--stdout", self.name], stdout=subprocess.PIPE)
+        except OSError:
+            raise Exception("Reading xz files requires the lzma module or the xz program: " + self.name)
+        try:
+            for chunk in iter(lambda: process.stdout.read(chunk_size), ""):
+                if not self._put(chunk):
+                    return
+        finally:
+            process.stdout.close()
+            if self.closed:
+                process.kill()
+            if process.wait() > 0:
+                raise Exception("xz could not decompress " + self.name)
+        self._put(None)
+
+    def _put(self, item):
+        """Puts an item in the queue, returns False if the file was closed meanwhile
+        """
+        while not self.closed:
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _iter_lines(self):
+        rest = ""
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            lines = (rest + chunk).split("\n")
+            rest = lines.pop()
+            for line in lines:
+                yield line + "\n"
+        if rest:
+            yield rest
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.lines)
+
+    def readline(self):
+        return next(self.lines, "")
+
+    def readlines(self):
+        return list(self)
+
+    def close(self):
+        self.closed = True
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 def list_to_string(list, separator = "\t"):
     """
     Converts a list of values to a string using SEPARATOR for joints
@@ -9,23 +9,29 @@ Institution: The University of British Columbia.
 """
 
 from EMDAT_core.Recording import Recording
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
+from EMDAT_core.data_structures import Fixation, Saccade, Event, concatenate_datapoint_arrays
 import EMDAT_core.utils
 import csv
 import params
 
+# the columns read from each file, used to find the header line of its table (see EMDAT_core.utils.sniff_data_file)
+RAW_DATA_COLUMNS = ["Time", "L Event Info", "R Event Info", "L Pupil Diameter [mm]", "R Pupil Diameter [mm]", "L EPOS Z",
+                    "R EPOS Z", "L POR X [px]", "L POR Y [px]", "R POR X [px]", "R POR Y [px]"]
+FIXATION_COLUMNS = ["Event Type", "Number", "Start", "Duration", "Location X", "Location Y"]
+SACCADE_COLUMNS = ["Event Type", "Number", "Start", "Duration", "Start Loc.X", "Start Loc.Y", "End Loc.X", "End Loc.Y",
+                   "Average Speed", "Average Accel."]
+USER_EVENT_COLUMNS = ["Event Type", "Start", "Description"]
+
 
 class SMIRecording(Recording):
     def read_all_data(self, all_file):
-        all_data = []
-        with open(all_file, 'r') as f:
-            for i in xrange(params.RAW_HEADER_LINE):
-                if i is (params.RAW_HEADER_LINE - 1):  # read the row of the table header for fixations
-                    data_header = next(f).strip().split(',')
-                else:
-                    next(f)
+        return concatenate_datapoint_arrays(list(self.read_sample_blocks(all_file)))
 
-            reader = csv.DictReader(f, fieldnames=data_header)
+    def iter_samples(self, all_file):
+        layout = EMDAT_core.utils.sniff_data_file(all_file, RAW_DATA_COLUMNS)
+        with EMDAT_core.utils.open_data_file(all_file) as f:
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             last_pupil_left = -1
             last_pupil_right = -1
             last_time = -1
@@ -49,22 +55,18 @@ class SMIRecording(Recording):
                         "fixationindex": EMDAT_core.utils.cast_int(row["Time"]),
                         "gazepointxleft": EMDAT_core.utils.cast_float(row["L POR X [px]"]),
                         "gazepointxlright": EMDAT_core.utils.cast_float(row["R POR X [px]"])}
-                all_data.append(Datapoint(data))
+                yield data
                 last_pupil_left = pupil_left
                 last_pupil_right = pupil_right
                 last_time = timestamp
 
-        return all_data
-
     def read_fixation_data(self, fixation_file):
         all_fixation = []
-        with open(fixation_file, 'r') as f:
-            for i in xrange(params.EVENTS_FIRST_DATA_LINE - 1):
-                if i is (params.FIXATION_HEADER_LINE - 1):  # read the row of the table header for fixations
-                    fixation_headers = next(f).strip().split(',')
-                else:
-                    next(f)
-            reader = csv.DictReader(f, fieldnames=fixation_headers)
+        layout = EMDAT_core.utils.sniff_data_file(fixation_file, FIXATION_COLUMNS)
+        with EMDAT_core.utils.open_data_file(fixation_file) as f:
+            # the rows of the other tables, including their headers, are ignored by their "Event Type"
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             for row in reader:
                 if not row["Event Type"].startswith("Fixation "+params.MONOCULAR_EYE):
                     continue
@@ -79,13 +81,10 @@ class SMIRecording(Recording):
 
     def read_saccade_data(self, saccade_file):
         all_saccades = []
-        with open(saccade_file, 'r') as f:
-            for i in xrange(params.EVENTS_FIRST_DATA_LINE - 1):
-                if i is (params.SACCADE_HEADER_LINE - 1):  # read the row of the table header for saccades
-                    saccade_headers = next(f).strip().split(',')
-                else:
-                    next(f)
-            reader = csv.DictReader(f, fieldnames=saccade_headers)
+        layout = EMDAT_core.utils.sniff_data_file(saccade_file, SACCADE_COLUMNS)
+        with EMDAT_core.utils.open_data_file(saccade_file) as f:
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             for row in reader:
                 if not row["Event Type"].startswith("Saccade "+params.MONOCULAR_EYE):
                     continue
@@ -106,13 +105,10 @@ class SMIRecording(Recording):
 
     def read_event_data(self, event_file):
         all_event = []
-        with open(event_file, 'r') as f:
-            for i in xrange(params.EVENTS_FIRST_DATA_LINE - 1):
-                if i is (params.USER_EVENT_HEADER_LINE - 1):  # read the row of the table header for user events
-                    event_headers = next(f).strip().split(',')
-                else:
-                    next(f)
-            reader = csv.DictReader(f, fieldnames=event_headers)
+        layout = EMDAT_core.utils.sniff_data_file(event_file, USER_EVENT_COLUMNS)
+        with EMDAT_core.utils.open_data_file(event_file) as f:
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             for row in reader:
                 if row["Event Type"] != "UserEvent":
                     continue
@@ -9,7 +9,7 @@ Institution: The University of British Columbia.
 """
 
 from EMDAT_core.Recording import Recording
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
+from EMDAT_core.data_structures import Fixation, Saccade, Event, concatenate_datapoint_arrays
 import EMDAT_core.utils
 import csv
 import params
@@ -17,31 +17,72 @@ import numpy as np
 
 
 class Tobii4CRecording(Recording):
+    def read_data(self, all_file, fixation_file, saccade_file=None, event_file=None):
+        """ See Recording.read_data. The timestamps and gaze points read with the samples are also used to read the saccades.
+        """
+        try:
+            Recording.read_data(self, all_file, fixation_file, saccade_file, event_file)
+        finally:
+            self.samples = None
+
+    def read_samples(self, all_file):
+        """Returns the timestamp, gaze point and validity of every row of a data file.
+
+        They are recorded while the samples are read (see iter_samples), the file is read again only if its samples
+        were not read (until read_data returns).
+
+        Args:
+            all_file: A string containing the name of the data file output by the Tobii software.
+
+        Returns:
+            a tuple (array of timestamps, list of (x, y) gaze points, list of validities) with one entry per row.
+            The gaze point is (None, None) for the rows with no validity information.
+        """
+        if getattr(self, "samples", None) is None or self.samples[0] != all_file:
+            for _ in self.iter_samples(all_file):
+                pass
+        return self.samples[1:]
+
     def read_all_data(self, all_file):
-        """Returns a list of "Datapoint"s read from an data file.
+        """Returns the "Datapoint"s read from an data file.
 
         Args:
             all_file:A string containing the name of the data file output by the Tobii software.
 
         Returns:
-            a list of "Datapoint"s
+            a DatapointArray
+        """
+        return concatenate_datapoint_arrays(list(self.read_sample_blocks(all_file)))
+
+    def iter_samples(self, all_file):
+        """Yields the samples read from an data file one by one.
+
+        The timestamp, gaze point and validity of every row are also recorded for read_saccade_data (see read_samples).
+
+        Args:
+            all_file:A string containing the name of the data file output by the Tobii software.
+
+        Yields:
+            a dictionary with the attributes of each Datapoint
         """
-        all_data = []
-        with open(all_file, 'r') as f:
+        timestamps = []
+        gaze_points = []
+        validities = []
+        with EMDAT_core.utils.open_data_file(all_file) as f:
             reader = csv.DictReader(f, delimiter=";")
             last_pupil_left = -1
             last_pupil_right = -1
             last_time = -1
             currentfix = 0
             for row in reader:
-                if not row["left_gaze_origin_validity"] or not row["right_gaze_origin_validity"]: #ignore data point with no validity information
+                timestamps.append(EMDAT_core.utils.cast_float(row["system_time_stamp"]))
+                if not has_validity(row): #ignore data point with no validity information
+                    gaze_points.append((None, None))
+                    validities.append(False)
                     continue
-                right_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                      row["right_gaze_point_on_display_area"].strip("()").split(",")))
-                left_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                     row["left_gaze_point_on_display_area"].strip("()").split(",")))
-                gaze_point_x = EMDAT_core.utils.cast_float((left_gaze[0] + right_gaze[0])/2, -1)
-                gaze_point_y = EMDAT_core.utils.cast_float((left_gaze[1] + right_gaze[1])/2, -1)
+                gaze_point_x, gaze_point_y = get_gaze_point(row)
+                gaze_points.append((gaze_point_x, gaze_point_y))
+                validities.append(is_valid_sample(row))
                 pupil_left = EMDAT_core.utils.cast_float(row["left_pupil_diameter"], -1)
                 pupil_right = EMDAT_core.utils.cast_float(row["right_pupil_diameter"], -1)
                 timestamp = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["system_time_stamp"]))
@@ -49,18 +90,18 @@ class Tobii4CRecording(Recording):
                         "pupilsize": EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right),
                         "pupilvelocity": EMDAT_core.Recording.get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) ),
                         "distance": -1,
-                        "is_valid": EMDAT_core.utils.cast_int(row["right_gaze_origin_validity"]) == 1 or EMDAT_core.utils.cast_int(row["left_gaze_origin_validity"]) == 1,
+                        "is_valid": validities[-1],
                         "is_valid_blink": EMDAT_core.utils.cast_int(row["right_gaze_origin_validity"]) == 1 and EMDAT_core.utils.cast_int(row["left_gaze_origin_validity"]) == 1,
                         "fixationindex": currentfix,
                         "gazepointx": gaze_point_x,
                         "gazepointy": gaze_point_y}
-                all_data.append(Datapoint(data))
+                yield data
                 last_pupil_left = pupil_left
                 last_pupil_right = pupil_right
                 last_time = timestamp
                 currentfix += 1
 
-        return all_data
+        self.samples = (all_file, np.array(timestamps, dtype=np.float64), gaze_points, validities)
 
     def read_fixation_data(self, fixation_file):
         """Returns a list of "Fixation"s read from the data file file.
@@ -73,7 +114,7 @@ class Tobii4CRecording(Recording):
         """
 
         all_fixation = []
-        with open(fixation_file, 'r') as f:
+        with EMDAT_core.utils.open_data_file(fixation_file) as f:
             currentfix = 0
             reader = csv.DictReader(f, delimiter=',')
             for row in reader:
@@ -89,72 +130,96 @@ class Tobii4CRecording(Recording):
 
         return all_fixation
 
-    def read_saccade_data(self, saccade_file, all_file):
+    def read_saccade_data(self, saccade_file, all_file=None):
         """Returns a list of "Saccade"s read from the data file file.
 
         Args:
             saccade_file: A string containing the name of the data file output by the Tobii software.
+            all_file: A string containing the name of the data file with the gaze samples. If None, the file
+                given to read_all_data.
 
         Returns:
             a list of "Saccade"s
         """
+        if all_file is None:
+            if getattr(self, "samples", None) is None:
+                raise Exception("The samples of the saccades in '" + saccade_file + "' were not read")
+            all_file = self.samples[0]
+        timestamps, gaze_points, validities = self.read_samples(all_file)
+
+        with EMDAT_core.utils.open_data_file(saccade_file) as f:
+            saccade_rows = filter(lambda row: row["label"] == "saccade", csv.DictReader(f, delimiter=','))
+        starts = map(lambda row: EMDAT_core.utils.cast_float(row["start"]), saccade_rows)
+        ends = map(lambda row: EMDAT_core.utils.cast_float(row["end"]), saccade_rows)
+        # the samples of each saccade are the ones between its start and end (included)
+        first_samples = np.searchsorted(timestamps, np.array(starts, dtype=np.float64), side='left').tolist()
+        last_samples = np.searchsorted(timestamps, np.array(ends, dtype=np.float64), side='right').tolist()
 
         all_saccade = []
-        with open(all_file, 'r') as all_data:
-            all_reader = list(csv.DictReader(all_data, delimiter=';'))
-
-            with open(saccade_file, 'r') as f:
-                reader = list(csv.DictReader(f, delimiter=','))
-                current_index = 0
-
-                for row in reader:
-                    if row["label"] == "saccade":
-                        start = EMDAT_core.utils.cast_float(row["start"])
-                        end = EMDAT_core.utils.cast_float(row["end"])
-                        # search for start
-                        saccade_vect = []
-                        is_valid_sample = 0
-
-                        # iterate through all_reader with loop
-                        i = np.searchsorted(list(map(lambda all_data_row: EMDAT_core.utils.cast_float(all_data_row["system_time_stamp"]), all_reader)), start)
-                        i_start = i
-                        while EMDAT_core.utils.cast_float(all_reader[i]["system_time_stamp"]) <= end:
-                            right_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                                  all_reader[i]["right_gaze_point_on_display_area"].strip("()").split(",")))
-                            left_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
-                                                 all_reader[i]["left_gaze_point_on_display_area"].strip("()").split(",")))
-                            gaze_point_x = EMDAT_core.utils.cast_float((left_gaze[0] + right_gaze[0])/2, -1)
-                            gaze_point_y = EMDAT_core.utils.cast_float((left_gaze[1] + right_gaze[1])/2, -1)
-                            saccade_vect.append([EMDAT_core.utils.cast_float(all_reader[i]["system_time_stamp"]),
-                                                 gaze_point_x, gaze_point_y])
-
-                            if EMDAT_core.utils.cast_int(all_reader[i]["right_gaze_origin_validity"]) == 1 or \
-                                    EMDAT_core.utils.cast_int(all_reader[i]["left_gaze_origin_validity"]) == 1:
-                                is_valid_sample += 1
-                            i += 1
-
-                        rate_valid_sample = is_valid_sample/(i - i_start)
-                        saccade_duration = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["duration"]))
-                        dist = EMDAT_core.Recording.get_saccade_distance(saccade_vect)
-                        accel = -1#Recording.get_saccade_acceleration(saccade_vect)
-                        speed = float(dist) / EMDAT_core.utils.cast_int(saccade_duration)
-                        data = {"saccadeindex": EMDAT_core.utils.cast_int(current_index),
-                                "timestamp": start,
-                                "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
-                                "saccadestartpointx": saccade_vect[0][1],
-                                "saccadestartpointy": saccade_vect[0][2],
-                                "saccadeendpointx": saccade_vect[-1][1],
-                                "saccadeendpointy": saccade_vect[-1][2],
-                                "saccadedistance": dist,
-                                "saccadespeed": speed,
-                                "saccadeacceleration": accel,
-                                "saccadequality": rate_valid_sample
-                                }
-                        all_saccade.append(Saccade(data, self.media_offset))
-                        current_index += 1
+        for current_index, (row, start, i_start, i_end) in enumerate(zip(saccade_rows, starts, first_samples, last_samples)):
+            saccade_vect = map(lambda i: [timestamps[i].item(), gaze_points[i][0], gaze_points[i][1]], xrange(i_start, i_end))
+            valid_samples = validities[i_start:i_end].count(True)
+
+            rate_valid_sample = valid_samples/(i_end - i_start)
+            saccade_duration = EMDAT_core.utils.cast_int(EMDAT_core.utils.cast_float(row["duration"]))
+            dist = EMDAT_core.Recording.get_saccade_distance(saccade_vect)
+            accel = -1#Recording.get_saccade_acceleration(saccade_vect)
+            speed = float(dist) / EMDAT_core.utils.cast_int(saccade_duration)
+            data = {"saccadeindex": EMDAT_core.utils.cast_int(current_index),
+                    "timestamp": start,
+                    "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
+                    "saccadestartpointx": saccade_vect[0][1],
+                    "saccadestartpointy": saccade_vect[0][2],
+                    "saccadeendpointx": saccade_vect[-1][1],
+                    "saccadeendpointy": saccade_vect[-1][2],
+                    "saccadedistance": dist,
+                    "saccadespeed": speed,
+                    "saccadeacceleration": accel,
+                    "saccadequality": rate_valid_sample
+                    }
+            all_saccade.append(Saccade(data, self.media_offset))
 
         return all_saccade
 
+    def read_event_data(self, event_file):
+        """Returns an empty list: the Tobii 4C data has no events.
+
+        Args:
+            event_file: A string containing the name of the data file output by the Tobii software.
+        """
+        return []
+
+
+def get_gaze_point(row):
+    """Returns the gaze point of a row of a Tobii 4C data file: the average of the gaze points of both eyes.
+
+    Args:
+        row: a dictionary with the values of the row
+
+    Returns:
+        a tuple (x, y)
+    """
+    right_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
+                          row["right_gaze_point_on_display_area"].strip("()").split(",")))
+    left_gaze = list(map(lambda point: EMDAT_core.utils.cast_float(point, -1),
+                         row["left_gaze_point_on_display_area"].strip("()").split(",")))
+    gaze_point_x = EMDAT_core.utils.cast_float((left_gaze[0] + right_gaze[0])/2, -1)
+    gaze_point_y = EMDAT_core.utils.cast_float((left_gaze[1] + right_gaze[1])/2, -1)
+    return gaze_point_x, gaze_point_y
+
+
+def has_validity(row):
+    """Returns True if a row of a Tobii 4C data file has the validity information of both eyes
+    """
+    return bool(row["left_gaze_origin_validity"]) and bool(row["right_gaze_origin_validity"])
+
+
+def is_valid_sample(row):
+    """Returns True if the gaze origin of at least one eye is valid in a row of a Tobii 4C data file
+    """
+    return EMDAT_core.utils.cast_int(row["right_gaze_origin_validity"]) == 1 or \
+        EMDAT_core.utils.cast_int(row["left_gaze_origin_validity"]) == 1
+
 
 # for testing purposes:
 if __name__ == "__main__":
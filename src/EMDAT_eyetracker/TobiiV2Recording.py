@@ -14,22 +14,38 @@ from EMDAT_core.utils import *
 import csv
 import params
 
+# the columns read from each file, used to find its header line (see EMDAT_core.utils.sniff_data_file)
+ALL_DATA_COLUMNS = ["Number", "Timestamp", "PupilLeft", "PupilRight", "DistanceLeft", "DistanceRight", "ValidityLeft",
+                    "ValidityRight", "StimuliName", "FixationIndex", "GazePointXLeft"]
+FIXATION_DATA_COLUMNS = ["FixationIndex", "Timestamp", "FixationDuration", "MappedFixationPointX", "MappedFixationPointY"]
+EVENT_DATA_COLUMNS = ["Timestamp", "Event", "EventKey", "Data1", "Data2", "Descriptor"]
+
 
 class TobiiV2Recording(Recording):
     def read_all_data(self, all_file):
-        """Returns a list of "Datapoint"s read from an "All-Data" file.
+        """Returns the "Datapoint"s read from an "All-Data" file.
 
         Args:
             all_file:A string containing the name of the 'All-Data.tsv' file output by the Tobii software.
 
         Returns:
-            a list of "Datapoint"s
+            a DatapointArray
+        """
+        return concatenate_datapoint_arrays(list(self.read_sample_blocks(all_file)))
+
+    def iter_samples(self, all_file):
+        """Yields the samples read from an "All-Data" file one by one.
+
+        Args:
+            all_file:A string containing the name of the 'All-Data.tsv' file output by the Tobii software.
+
+        Yields:
+            a dictionary with the attributes of each Datapoint
         """
-        all_data = []
-        with open(all_file, 'r') as f:
-            for _ in xrange(params.ALLDATAHEADERLINES + params.NUMBEROFEXTRAHEADERLINES - 1):
-                next(f)
-            reader = csv.DictReader(f, delimiter="\t")
+        layout = sniff_data_file(all_file, ALL_DATA_COLUMNS)
+        with open_data_file(all_file) as f:
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             last_pupil_left = -1
             last_pupil_right = -1
             last_time = -1
@@ -51,13 +67,11 @@ class TobiiV2Recording(Recording):
                         "stimuliname": row["StimuliName"],
                         "fixationindex": cast_int(row["FixationIndex"]),
                         "gazepointxleft": cast_float(row["GazePointXLeft"])}
-                all_data.append(Datapoint(data))
+                yield data
                 last_pupil_left = pupil_left
                 last_pupil_right = pupil_right
                 last_time = timestamp
 
-        return all_data
-
     def read_fixation_data(self, fixation_file):
         """Returns a list of "Fixation"s read from an "Fixation-Data" file.
 
@@ -69,10 +83,10 @@ class TobiiV2Recording(Recording):
         """
 
         all_fixation = []
-        with open(fixation_file, 'r') as f:
-            for _ in xrange(params.FIXATIONHEADERLINES - 1):
-                next(f)
-            reader = csv.DictReader(f, delimiter='\t')
+        layout = sniff_data_file(fixation_file, FIXATION_DATA_COLUMNS)
+        with open_data_file(fixation_file) as f:
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             for row in reader:
                 data = {"fixationindex": cast_int(row["FixationIndex"]),
                         "timestamp": cast_int(row["Timestamp"]),
@@ -94,10 +108,10 @@ class TobiiV2Recording(Recording):
         """
 
         all_event = []
-        with open(event_file, 'r') as f:
-            for _ in xrange(params.EVENTSHEADERLINES - 1):
-                next(f)
-            reader = csv.DictReader(f, delimiter='\t')
+        layout = sniff_data_file(event_file, EVENT_DATA_COLUMNS)
+        with open_data_file(event_file) as f:
+            layout.skip_to_header(f)
+            reader = csv.DictReader(f, delimiter=layout.delimiter)
             for row in reader:
                 data = {"timestamp": cast_int(row["Timestamp"]),
                         "event": row["Event"],
@@ -4,64 +4,64 @@ Created on 2015-08-15
 
 Class to read Tobii data (exported with Tobii Studio V3 and higher). See sample data in the "sampledata" folder.
 
+Tobii Studio V3 exports gaze samples, fixations, saccades and events in the same "Data_Export.tsv" file.
+Each kind of data is built by its own row builder (see below) so that the file can either be read once per
+kind of data, or read only once with every row being passed to all the builders (see read_combined_data).
+The gaze samples are converted column by column for blocks of rows (see SampleBuilder.add_columns).
+A large file can also be split in byte ranges parsed in parallel, the state of the builders being carried
+from one range to the next (see read_builders).
+The header line, delimiter and media names of a data file are found from its first bytes before it is
+parsed, so that a file without the columns used or the media of the recording (params.RECORDING_MEDIA_NAME)
+is rejected without being read (see get_layout).
+
 Authors: Mike Wu (creator), Sebastien Lalle.
 Institution: The University of British Columbia.
 """
 
 from EMDAT_core.Recording import Recording
-from EMDAT_core.data_structures import Datapoint, Fixation, Saccade, Event
+from EMDAT_core.data_structures import DatapointArray, CategoricalArray, Fixation, Saccade, Event, concatenate_datapoint_arrays
 import EMDAT_core.utils
-import csv
+import itertools
+import multiprocessing
+import os
+import cStringIO
 import params
+import numpy as np
+
+# the minimum size in bytes of the byte ranges of a data file parsed in parallel (see read_builders)
+MIN_BYTE_RANGE_SIZE = 1 << 24
 
 
 class TobiiV3Recording(Recording):
     def read_all_data(self, all_file):
-        """Returns a list of "Datapoint"s read from an data file.
+        """Returns the "Datapoint"s read from an data file.
 
         Args:
             all_file:A string containing the name of the data file output by the Tobii software.
 
         Returns:
-            a list of "Datapoint"s
-        """
-        all_data = []
-        with open(all_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter="\t")
-            last_pupil_left = -1
-            last_pupil_right = -1
-            last_time = -1
-
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec':
-#                if row["MediaName"] != 'Screen Recordings (1)':  # ignore non-recording data point
-                    continue
-                if not row["ValidityLeft"] or not row["ValidityRight"]: #ignore data point with no validity information
-                    continue
-                gaze_point_x = EMDAT_core.utils.cast_float(row["GazePointX (MCSpx)"], -1)
-                gaze_point_y = EMDAT_core.utils.cast_float(row["GazePointY (MCSpx)"], -1)
-                pupil_left = EMDAT_core.utils.cast_float(row["PupilLeft"], -1)
-                pupil_right = EMDAT_core.utils.cast_float(row["PupilRight"], -1)
-                distance_left = EMDAT_core.utils.cast_float(row["DistanceLeft"], -1)
-                distance_right = EMDAT_core.utils.cast_float(row["DistanceRight"], -1)
-                timestamp = EMDAT_core.utils.cast_int(row["RecordingTimestamp"])
-                data = {'participant_name': row["ParticipantName"],
-                        "timestamp": timestamp,
-                        "pupilsize": EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right),
-                        "pupilvelocity": EMDAT_core.Recording.get_pupil_velocity(last_pupil_left, last_pupil_right, pupil_left, pupil_right, (timestamp-last_time) ),
-                        "distance": EMDAT_core.Recording.get_distance(distance_left, distance_right),
-                        "is_valid": EMDAT_core.utils.cast_int(row["ValidityRight"]) < 2 or EMDAT_core.utils.cast_int(row["ValidityLeft"]) < 2,
-                        "is_valid_blink": EMDAT_core.utils.cast_int(row["ValidityRight"]) < 2 and EMDAT_core.utils.cast_int(row["ValidityLeft"]) < 2,
-                        "stimuliname": row["MediaName"],
-                        "fixationindex": EMDAT_core.utils.cast_int(row["FixationIndex"]),
-                        "gazepointx": gaze_point_x,
-                        "gazepointy": gaze_point_y}
-                all_data.append(Datapoint(data))
-                last_pupil_left = pupil_left
-                last_pupil_right = pupil_right
-                last_time = timestamp
-
-        return all_data
+            a DatapointArray
+        """
+        samples = SampleBuilder()
+        self.read_builders(all_file, [samples])
+        return samples.get_data()
+
+    def read_sample_blocks(self, all_file, block_size=None):
+        """Yields the "Datapoint"s read from an data file, in blocks of at most block_size samples.
+
+        Args:
+            all_file:A string containing the name of the data file output by the Tobii software.
+            block_size: the maximum number of samples in a block, params.SAMPLE_BLOCK_SIZE if None
+
+        Yields:
+            a DatapointArray for each block of samples
+        """
+        samples = SampleBuilder()
+        layout = self.get_layout(all_file, [samples])
+        for _, columns, is_recording in self.read_export_columns(all_file, layout, block_size):
+            samples.add_columns(columns, is_recording)
+            if len(samples) > 0:
+                yield samples.pop_data()
 
     def read_fixation_data(self, fixation_file):
         """Returns a list of "Fixation"s read from the data file file.
@@ -72,28 +72,9 @@ class TobiiV3Recording(Recording):
         Returns:
             a list of "Fixation"s
         """
-
-        all_fixation = []
-        with open(fixation_file, 'r') as f:
-            currentfix = 0
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec':
-#                if row["MediaName"] != 'Screen Recordings (1)':  # ignore non-recording data point
-                    continue
-                if not row["ValidityLeft"] or not row["ValidityRight"] or not row["FixationPointX (MCSpx)"] or not row["FixationPointY (MCSpx)"]: #ignore data point with no information
-                    continue
-                if row["GazeEventType"] != "Fixation" or currentfix == row["FixationIndex"]: #if not a fixation or the current fixation
-                    continue
-                data = {"fixationindex": EMDAT_core.utils.cast_int(row["FixationIndex"]),
-                        "timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
-                        "fixationduration": EMDAT_core.utils.cast_int(row["GazeEventDuration"]),
-                        "fixationpointx": EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]),
-                        "fixationpointy": EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"])}
-                all_fixation.append(Fixation(data, self.media_offset))
-                currentfix = row["FixationIndex"]
-
-        return all_fixation
+        fixations = FixationBuilder(self.media_offset)
+        self.read_builders(fixation_file, [fixations])
+        return fixations.all_fixation
 
     def read_saccade_data(self, saccade_file):
         """Returns a list of "Saccade"s read from the data file file.
@@ -104,107 +85,9 @@ class TobiiV3Recording(Recording):
         Returns:
             a list of "Saccade"s
         """
-
-        all_saccade = []
-        with open(saccade_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            in_saccade = False
-            in_fixation = False
-            last_gaze_coord = (0, 0, 0) #timestamp X Y
-            saccade_vect = []
-            saccade_duration = 0
-            current_index = 0
-
-            nb_invalid_temp = 0
-            nb_valid_sample = 0
-            nb_sample = 0
-
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec' or not row["EyeTrackerTimestamp"]:
-#                if row["MediaName"] != 'Screen Recordings (1)' or not row["EyeTrackerTimestamp"]:  # ignore non-recording data point
-                    continue
-
-                if in_fixation:
-                    if row["GazeEventType"] == "Fixation":
-                        nb_invalid_temp = 0
-                    elif row["GazeEventType"] == "Saccade": #new saccade
-                        in_fixation = False
-                        in_saccade = True
-                        current_index = row["SaccadeIndex"]
-                        saccade_vect = [last_gaze_coord]
-                        nb_valid_sample = 0
-
-                        #add current sample
-                        if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #ignore data point with no valid data
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
-                            nb_valid_sample += 1
-
-                        if last_valid:
-                            nb_valid_sample += 1
-
-                        nb_sample = 2 + nb_invalid_temp #current gaze sample + last gaze sample of the previous fixation + eventually all unclasified gaze samples in between
-                        nb_invalid_temp = 0
-                    else: #unclassified gaze samples
-                        nb_invalid_temp += 1
-
-                elif in_saccade:
-                    if row["GazeEventType"] == "Fixation":
-                        in_fixation = True
-                        in_saccade = False
-
-                        #end of last saccade
-                        if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #valid last datapoint
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
-                            nb_valid_sample += 1
-                        elif (row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]): #if gaze sample not valid, try to use fixation data instead
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]), EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"])] )
-                            nb_valid_sample += 1
-                        nb_sample += 1
-
-                        rate_valid_sample = float(nb_valid_sample) / nb_sample
-                        if rate_valid_sample >= params.VALID_SAMPLES_PROP_SACCADE: #if saccade quality is above the threshold
-                            saccade_duration = EMDAT_core.utils.cast_int(row["RecordingTimestamp"]) - saccade_vect[0][0]
-                            dist = EMDAT_core.Recording.get_saccade_distance(saccade_vect)
-                            accel = -1#Recording.get_saccade_acceleration(saccade_vect)
-                            speed = float(dist) / EMDAT_core.utils.cast_int(saccade_duration)
-                            data = {"saccadeindex": EMDAT_core.utils.cast_int(current_index),
-                                    "timestamp": saccade_vect[0][0],
-                                    "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
-                                    "saccadestartpointx": saccade_vect[0][1],
-                                    "saccadestartpointy": saccade_vect[0][2],
-                                    "saccadeendpointx": saccade_vect[-1][1],
-                                    "saccadeendpointy": saccade_vect[-1][2],
-                                    "saccadedistance": dist,
-                                    "saccadespeed": speed,
-                                    "saccadeacceleration": accel,
-									"saccadequality": rate_valid_sample
-                                    }
-                            all_saccade.append(Saccade(data, self.media_offset))
-                            nb_valid_sample = 0
-                            nb_sample = 0
-
-                    elif row["GazeEventType"] == "Saccade":
-                        if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #ignore data point with no valid data
-                            saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
-                            nb_valid_sample += 1
-                        nb_sample += 1
-                    else: #unclassified gaze samples
-                        nb_sample += 1
-                    nb_invalid_temp = 0
-
-                else: #wait for the first fixation
-                    if row["GazeEventType"] == "Fixation":
-                        in_fixation = True
-
-                if row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]:
-                    last_gaze_coord = (EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"]))
-                    last_valid = (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2)
-                elif row["GazeEventType"] == "Fixation" and row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]: #if last sample not valid, at least check if valid data about the fixation
-                    last_gaze_coord = (EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]), EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"]))
-                    last_valid = True
-
-        return all_saccade
-
+        saccades = SaccadeBuilder(self.media_offset)
+        self.read_builders(saccade_file, [saccades])
+        return saccades.all_saccade
 
     def read_event_data(self, event_file):
         """Returns a list of "Event"s read from an data file.
@@ -215,26 +98,605 @@ class TobiiV3Recording(Recording):
         Returns:
             a list of "Event"s
         """
+        events = EventBuilder(self.media_offset)
+        self.read_builders(event_file, [events])
+        return events.all_event
+
+    def read_combined_data(self, data_file, read_saccades=True, read_events=True):
+        """Returns the "Datapoint"s, "Fixation"s, "Saccade"s and "Event"s read in a single pass
+        over a data file containing all of them.
+
+        Args:
+            data_file: A string containing the name of the data file output by the Tobii software.
+            read_saccades: True if the saccades should be read from data_file.
+            read_events: True if the events should be read from data_file.
+
+        Returns:
+            a DatapointArray, a list of "Fixation"s, a list of "Saccade"s (None if read_saccades is False)
+            and a list of "Event"s (None if read_events is False)
+        """
+        samples = SampleBuilder()
+        fixations = FixationBuilder(self.media_offset)
+        builders = [samples, fixations]
+        saccades = events = None
+        if read_saccades:
+            saccades = SaccadeBuilder(self.media_offset)
+            builders.append(saccades)
+        if read_events:
+            events = EventBuilder(self.media_offset)
+            builders.append(events)
+
+        self.read_builders(data_file, builders)
+        return samples.get_data(), fixations.all_fixation, \
+            saccades.all_saccade if saccades is not None else None, \
+            events.all_event if events is not None else None
+
+    def get_layout(self, data_file, builders):
+        """Returns the layout of a data file, checking that it has the columns used by the given builders and
+        rows of the recording.
+
+        Args:
+            data_file: A string containing the name of the data file output by the Tobii software.
+            builders: a list of builders (SampleBuilder, FixationBuilder, SaccadeBuilder or EventBuilder).
+
+        Returns:
+            a DataFileLayout (see EMDAT_core.utils.sniff_data_file)
+        """
+        columns = set(["MediaName"])
+        for builder in builders:
+            columns.update(builder.columns_used)
+        layout = EMDAT_core.utils.sniff_data_file(data_file, columns, media_column="MediaName")
+        layout.check_media_name(params.RECORDING_MEDIA_NAME)
+        return layout
+
+    def read_builders(self, data_file, builders):
+        """Adds all the rows of a data file that belong to the recording to the given builders.
+
+        If params.PARSER_PROCESSES is more than 1, a large uncompressed file is split at line boundaries in byte
+        ranges parsed in a pool of processes. Each range is parsed with new builders, and its results are
+        appended to the given builders once their state matches: the rows of a range up to the first one after
+        which the state of a builder no longer depends on the previous rows (see resets_state) are added again
+        to the given builder, then the results of the range that follow are appended (see merge).
+
+        Args:
+            data_file: A string containing the name of the data file output by the Tobii software.
+            builders: a list of builders (SampleBuilder, FixationBuilder, SaccadeBuilder or EventBuilder).
+        """
+        layout = self.get_layout(data_file, builders)
+        processes = params.PARSER_PROCESSES if not multiprocessing.current_process().daemon else 1
+        header_line, ranges = get_byte_ranges(data_file, layout, processes)
+        if len(ranges) <= 1:
+            for header, columns, is_recording in self.read_export_columns(data_file, layout):
+                add_block(builders, header, columns, is_recording)
+            return
+
+        tasks = map(lambda (i, (start, end)): (data_file, layout, header_line, start, end, builders, i == 0),
+                    enumerate(ranges))
+        pool = multiprocessing.Pool(len(ranges))
+        try:
+            results = pool.map(_read_byte_range, tasks)
+        finally:
+            pool.close()
+            pool.join()
+        for result in results:
+            for (builder, (range_builder, prefix, start, reset)) in zip(builders, result):
+                for row in prefix:
+                    builder.add_row(row)
+                if reset:
+                    builder.merge(range_builder, start)
+
+    def read_export_columns(self, data_file, layout, block_size=None):
+        """Yields the rows of a data file by blocks, each block being also split in columns.
+
+        Args:
+            data_file: A string containing the name of the data file output by the Tobii software.
+            layout: the DataFileLayout of the data file (see get_layout)
+            block_size: the maximum number of rows in a block, params.SAMPLE_BLOCK_SIZE if None
+
+        Yields:
+            header, columns: see EMDAT_core.utils.iter_column_blocks
+            is_recording: an array of booleans, True for the rows of the block that belong to the recording
+        """
+        with EMDAT_core.utils.open_data_file(data_file) as f:
+            layout.skip_to_header(f)
+            for block in iter_export_columns(f, layout, block_size):
+                yield block
+
+
+def iter_export_columns(f, layout, block_size=None):
+    """Yields the rows of an open data file by blocks (see TobiiV3Recording.read_export_columns)
+
+    Args:
+        f: a file object positioned on the header line
+        layout: the DataFileLayout of the data file
+        block_size: the maximum number of rows in a block, params.SAMPLE_BLOCK_SIZE if None
+    """
+    if block_size is None:
+        block_size = params.SAMPLE_BLOCK_SIZE
+    for header, columns in EMDAT_core.utils.iter_column_blocks(f, layout.delimiter, block_size):
+        # only the rows of the recording media belong to the recording, the media names being compared as codes
+        is_recording = CategoricalArray.from_values(columns["MediaName"]) == params.RECORDING_MEDIA_NAME
+        yield header, columns, is_recording
+
+
+def add_block(builders, header, columns, is_recording):
+    """Adds the rows of a block that belong to the recording to the given builders
+
+    The samples are converted by columns, the other builders get the rows one by one.
+
+    Args:
+        builders: a list of builders
+        header, columns, is_recording: a block of rows, see TobiiV3Recording.read_export_columns
+    """
+    row_builders = []
+    for builder in builders:
+        if isinstance(builder, SampleBuilder):
+            builder.add_columns(columns, is_recording)
+        else:
+            row_builders.append(builder)
+    if not row_builders:
+        return
+    rows = itertools.izip(*map(columns.__getitem__, header))
+    for values in itertools.compress(rows, is_recording.tolist()):
+        row = dict(itertools.izip(header, values))
+        for builder in row_builders:
+            builder.add_row(row)
+
+
+def get_byte_ranges(data_file, layout, processes):
+    """Splits a data file at line boundaries in byte ranges to be parsed in parallel
+
+    Args:
+        data_file: A string containing the name of the data file output by the Tobii software.
+        layout: the DataFileLayout of the data file
+        processes: the maximum number of ranges
+
+    Returns:
+        the header line of the file, and a list of (start, end) byte offsets of the ranges of at least
+        MIN_BYTE_RANGE_SIZE bytes ([] if the file is compressed or too small to be split)
+    """
+    if processes <= 1:
+        return None, []
+    with EMDAT_core.utils.open_data_file(data_file) as f:
+        if not isinstance(f, file): # compressed files are read from the start only
+            return None, []
+        layout.skip_to_header(f)
+        header_line = f.readline()
+        start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        count = min(processes, (size - start) // MIN_BYTE_RANGE_SIZE)
+        offsets = [start]
+        for i in xrange(1, count):
+            f.seek(start + (size - start) * i // count)
+            f.readline()
+            if f.tell() > offsets[-1] and f.tell() < size:
+                offsets.append(f.tell())
+        offsets.append(size)
+    return header_line, zip(offsets[:-1], offsets[1:])
+
+
+def _read_byte_range(task):
+    """Parses a byte range of a data file in a worker process of TobiiV3Recording.read_builders
+
+    Args:
+        task: a tuple (data file, DataFileLayout of the file, header line, start offset, end offset, list of new
+            builders, True for the first range of the file)
+
+    Returns:
+        for each builder, a tuple (the builder after the range, the rows of the range to add again to the builder
+        of the file, index of the first result of the builder to append to the results of the builder of the file,
+        True if the state of the builder after the range is the state of the builder of the file)
+    """
+    data_file, layout, header_line, start, end, builders, first_range = task
+    with open(data_file, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start)
+    # the rows of each builder up to the first one resetting its state, and the number of results at that row
+    prefixes = map(lambda _: [], builders)
+    starts = [0] * len(builders)
+    resets = [first_range] * len(builders)
+    for header, columns, is_recording in iter_export_columns(cStringIO.StringIO(header_line + text), layout):
+        if all(resets):
+            add_block(builders, header, columns, is_recording)
+            continue
+        for i, builder in enumerate(builders):
+            block_is_recording = is_recording
+            if not resets[i]:
+                block_is_recording = is_recording.copy()
+                for index in np.flatnonzero(is_recording):
+                    row = dict((name, columns[name][index]) for name in header)
+                    builder.add_row(row)
+                    prefixes[i].append(row)
+                    block_is_recording[index] = False
+                    if builder.resets_state(row):
+                        resets[i] = True
+                        starts[i] = len(builder)
+                        break
+            add_block([builder], header, columns, block_is_recording)
+    return zip(builders, prefixes, starts, resets)
+
+
+class SampleBuilder:
+    """Builds the "DatapointArray" of gaze samples from the rows of a Tobii V3 data file.
+
+    The samples are accumulated column by column, no Datapoint object is created. Blocks of rows can be added
+    at once with add_columns, which converts each column with a few array operations instead of row by row.
+    """
+
+    # the columns read by add_row
+    columns_used = ["MediaName", "RecordingTimestamp", "FixationIndex", "GazePointX (MCSpx)", "GazePointY (MCSpx)",
+                    "PupilLeft", "PupilRight", "DistanceLeft", "DistanceRight", "ValidityLeft", "ValidityRight"]
+
+    def __init__(self):
+        self.columns = dict((name, []) for (name, _) in DatapointArray.fields)
+        self.blocks = []
+        self.last_pupil_left = -1
+        self.last_pupil_right = -1
+        self.last_time = -1
+
+    def add_row(self, row):
+        if not row["ValidityLeft"] or not row["ValidityRight"]: #ignore data point with no validity information
+            return
+        gaze_point_x = EMDAT_core.utils.cast_float(row["GazePointX (MCSpx)"], -1)
+        gaze_point_y = EMDAT_core.utils.cast_float(row["GazePointY (MCSpx)"], -1)
+        pupil_left = EMDAT_core.utils.cast_float(row["PupilLeft"], -1)
+        pupil_right = EMDAT_core.utils.cast_float(row["PupilRight"], -1)
+        distance_left = EMDAT_core.utils.cast_float(row["DistanceLeft"], -1)
+        distance_right = EMDAT_core.utils.cast_float(row["DistanceRight"], -1)
+        timestamp = EMDAT_core.utils.cast_int(row["RecordingTimestamp"])
+        fixation_index = EMDAT_core.utils.cast_int(row["FixationIndex"])
+        columns = self.columns
+        columns["timestamp"].append(timestamp)
+        columns["pupilsize"].append(EMDAT_core.Recording.get_pupil_size(pupil_left, pupil_right))
+        columns["pupilvelocity"].append(EMDAT_core.Recording.get_pupil_velocity(self.last_pupil_left, self.last_pupil_right, pupil_left, pupil_right, (timestamp-self.last_time) ))
+        columns["distance"].append(EMDAT_core.Recording.get_distance(distance_left, distance_right))
+        columns["is_valid"].append(EMDAT_core.utils.cast_int(row["ValidityRight"]) < 2 or EMDAT_core.utils.cast_int(row["ValidityLeft"]) < 2)
+        columns["is_valid_blink"].append(EMDAT_core.utils.cast_int(row["ValidityRight"]) < 2 and EMDAT_core.utils.cast_int(row["ValidityLeft"]) < 2)
+        columns["stimuliname"].append(row["MediaName"])
+        columns["fixationindex"].append(fixation_index if fixation_index is not None else -1)
+        columns["gazepointx"].append(gaze_point_x if gaze_point_x is not None else -1)
+        columns["gazepointy"].append(gaze_point_y if gaze_point_y is not None else -1)
+        self.last_pupil_left = pupil_left
+        self.last_pupil_right = pupil_right
+        self.last_time = timestamp
+
+    def add_columns(self, columns, is_recording):
+        """Adds the samples of a block of rows, same as calling add_row on each row of the recording
+
+        Args:
+            columns: a dictionary mapping each column name to the tuple of its values in the block
+            is_recording: an array of booleans, True for the rows that belong to the recording
+        """
+        has_validity = np.array(map(bool, columns["ValidityLeft"])) & np.array(map(bool, columns["ValidityRight"]))
+        selected = is_recording & has_validity
+        if not selected.any():
+            return
+        block = self.get_block(columns, selected)
+        if block is None:
+            # some values cannot be converted by columns with the same result (e.g., missing timestamps): row by row
+            for i in np.flatnonzero(is_recording):
+                self.add_row(dict((name, columns[name][i]) for name in SampleBuilder.columns_used))
+            return
+        self.flush_rows()
+        self.blocks.append(block)
+
+    def get_block(self, columns, selected):
+        """Returns a DatapointArray with the samples of the selected rows of a block, None if they have to be
+        read row by row
+
+        Args:
+            columns: a dictionary mapping each column name to the tuple of its values in the block
+            selected: an array of booleans, True for the rows that are samples
+        """
+        # the whole columns are converted, then the samples are selected
+        cast_float = lambda name: EMDAT_core.utils.cast_float_column(columns[name], -1)[selected]
+        cast_int = lambda name: map(lambda values: values[selected], EMDAT_core.utils.cast_int_column(columns[name]))
+        timestamp, valid_timestamp = cast_int("RecordingTimestamp")
+        if not valid_timestamp.all():
+            return None
+        pupil_left = cast_float("PupilLeft")
+        pupil_right = cast_float("PupilRight")
+        last_pupil_left = np.append(self.last_pupil_left if self.last_pupil_left is not None else np.nan, pupil_left[:-1])
+        last_pupil_right = np.append(self.last_pupil_right if self.last_pupil_right is not None else np.nan, pupil_right[:-1])
+        time = timestamp - np.append(self.last_time, timestamp[:-1])
+        # see get_pupil_velocity
+        left = ~np.isnan(last_pupil_left) & ~np.isnan(pupil_left)
+        right = ~np.isnan(last_pupil_right) & ~np.isnan(pupil_right)
+        if (time[left | right] == 0).any():
+            return None
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pupil_velocity = np.where(left & right, abs((pupil_left + pupil_right) / 2 - (last_pupil_left + last_pupil_right) / 2) / time,
+                                      np.where(left, abs(pupil_left - last_pupil_left) / time,
+                                               np.where(right, abs(pupil_right - last_pupil_right) / time, -1)))
+
+        validity_left, valid_validity_left = cast_int("ValidityLeft")
+        validity_right, valid_validity_right = cast_int("ValidityRight")
+        # None < 2 in Python
+        valid_left = ~valid_validity_left | (validity_left < 2)
+        valid_right = ~valid_validity_right | (validity_right < 2)
+        fixation_index, valid_fixation_index = cast_int("FixationIndex")
+        gaze_point_x = cast_float("GazePointX (MCSpx)")
+        gaze_point_y = cast_float("GazePointY (MCSpx)")
+        stimuli_name = CategoricalArray.from_values(itertools.compress(columns["MediaName"], selected))
+
+        block = DatapointArray({"timestamp": timestamp,
+                                "pupilsize": get_average(pupil_left, pupil_right),
+                                "pupilvelocity": pupil_velocity,
+                                "distance": get_average(cast_float("DistanceLeft"), cast_float("DistanceRight")),
+                                "is_valid": valid_right | valid_left,
+                                "is_valid_blink": valid_right & valid_left,
+                                "stimuliname": stimuli_name,
+                                "fixationindex": np.where(valid_fixation_index, fixation_index, -1),
+                                "gazepointx": np.where(np.isnan(gaze_point_x), -1, gaze_point_x),
+                                "gazepointy": np.where(np.isnan(gaze_point_y), -1, gaze_point_y)})
+        self.last_pupil_left = pupil_left[-1] if not np.isnan(pupil_left[-1]) else None
+        self.last_pupil_right = pupil_right[-1] if not np.isnan(pupil_right[-1]) else None
+        self.last_time = timestamp[-1]
+        return block
+
+    def flush_rows(self):
+        """Moves the samples added row by row to a block
+        """
+        if len(self.columns["timestamp"]) > 0:
+            self.blocks.append(DatapointArray(self.columns))
+            self.columns = dict((name, []) for (name, _) in DatapointArray.fields)
+
+    def __len__(self):
+        return sum(map(len, self.blocks)) + len(self.columns["timestamp"])
+
+    def get_data(self):
+        self.flush_rows()
+        if len(self.blocks) != 1:
+            self.blocks = [concatenate_datapoint_arrays(self.blocks)]
+        return self.blocks[0]
+
+    def pop_data(self):
+        """Returns the samples added since the last call and removes them (the state used to compute the
+        pupil velocity is kept, so that the next samples can be added)
+        """
+        data = self.get_data()
+        self.blocks = []
+        return data
+
+    def resets_state(self, row):
+        """Returns True if the state of the builder after adding row does not depend on the previous rows
+        """
+        return bool(row["ValidityLeft"] and row["ValidityRight"])
+
+    def merge(self, builder, start):
+        """Appends the samples of another builder from index start and takes its state (see
+        TobiiV3Recording.read_builders)
+        """
+        data = builder.get_data()
+        self.flush_rows()
+        if len(data) > start:
+            self.blocks.append(data[start:])
+        self.last_pupil_left = builder.last_pupil_left
+        self.last_pupil_right = builder.last_pupil_right
+        self.last_time = builder.last_time
+
+
+def get_average(left, right):
+    """Returns the average of the values of both eyes, or the value of one eye if the other one is not available
+    (NaN), -1 if none is available (see get_pupil_size and get_distance)
+
+    Args:
+        left, right: arrays of floats
+    """
+    return np.where(np.isnan(left), np.where(np.isnan(right), -1, right),
+                    np.where(np.isnan(right), left, (left + right) / 2.0))
+
+
+class FixationBuilder:
+    """Builds the list of "Fixation"s from the rows of a Tobii V3 data file.
+    """
+
+    # the columns read by add_row
+    columns_used = ["RecordingTimestamp", "FixationIndex", "GazeEventType", "GazeEventDuration", "ValidityLeft",
+                    "ValidityRight", "FixationPointX (MCSpx)", "FixationPointY (MCSpx)"]
+
+    def __init__(self, media_offset=(0, 0)):
+        self.media_offset = media_offset
+        self.all_fixation = []
+        self.currentfix = 0
+
+    def add_row(self, row):
+        if not row["ValidityLeft"] or not row["ValidityRight"] or not row["FixationPointX (MCSpx)"] or not row["FixationPointY (MCSpx)"]: #ignore data point with no information
+            return
+        if row["GazeEventType"] != "Fixation" or self.currentfix == row["FixationIndex"]: #if not a fixation or the current fixation
+            return
+        data = {"fixationindex": EMDAT_core.utils.cast_int(row["FixationIndex"]),
+                "timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
+                "fixationduration": EMDAT_core.utils.cast_int(row["GazeEventDuration"]),
+                "fixationpointx": EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]),
+                "fixationpointy": EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"])}
+        self.all_fixation.append(Fixation(data, self.media_offset))
+        self.currentfix = row["FixationIndex"]
+
+    def resets_state(self, row):
+        """Returns True if the state of the builder after adding row does not depend on the previous rows
+        """
+        return bool(row["ValidityLeft"] and row["ValidityRight"] and row["FixationPointX (MCSpx)"]
+                    and row["FixationPointY (MCSpx)"]) and row["GazeEventType"] == "Fixation"
+
+    def merge(self, builder, start):
+        """Appends the fixations of another builder from index start and takes its state (see
+        TobiiV3Recording.read_builders)
+        """
+        self.all_fixation.extend(builder.all_fixation[start:])
+        self.currentfix = builder.currentfix
+
+    def __len__(self):
+        return len(self.all_fixation)
+
+
+class SaccadeBuilder:
+    """Builds the list of "Saccade"s from the rows of a Tobii V3 data file.
+
+    Saccades are reconstructed from the gaze samples between two fixations, so the builder keeps
+    the state of the fixation/saccade state machine from one row to the next.
+    """
+
+    # the columns read by add_row
+    columns_used = ["EyeTrackerTimestamp", "RecordingTimestamp", "GazeEventType", "SaccadeIndex", "ValidityLeft",
+                    "ValidityRight", "GazePointX (ADCSpx)", "GazePointY (ADCSpx)", "FixationPointX (MCSpx)",
+                    "FixationPointY (MCSpx)"]
+
+    def __init__(self, media_offset=(0, 0)):
+        self.media_offset = media_offset
+        self.all_saccade = []
+        self.in_saccade = False
+        self.in_fixation = False
+        self.last_gaze_coord = (0, 0, 0) #timestamp X Y
+        self.last_valid = False
+        self.saccade_vect = []
+        self.current_index = 0
+
+        self.nb_invalid_temp = 0
+        self.nb_valid_sample = 0
+        self.nb_sample = 0
+
+    def add_row(self, row):
+        if not row["EyeTrackerTimestamp"]: # ignore non-recording data point
+            return
+
+        if self.in_fixation:
+            if row["GazeEventType"] == "Fixation":
+                self.nb_invalid_temp = 0
+            elif row["GazeEventType"] == "Saccade": #new saccade
+                self.in_fixation = False
+                self.in_saccade = True
+                self.current_index = row["SaccadeIndex"]
+                self.saccade_vect = [self.last_gaze_coord]
+                self.nb_valid_sample = 0
+
+                #add current sample
+                if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #ignore data point with no valid data
+                    self.saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
+                    self.nb_valid_sample += 1
+
+                if self.last_valid:
+                    self.nb_valid_sample += 1
+
+                self.nb_sample = 2 + self.nb_invalid_temp #current gaze sample + last gaze sample of the previous fixation + eventually all unclasified gaze samples in between
+                self.nb_invalid_temp = 0
+            else: #unclassified gaze samples
+                self.nb_invalid_temp += 1
+
+        elif self.in_saccade:
+            if row["GazeEventType"] == "Fixation":
+                self.in_fixation = True
+                self.in_saccade = False
+
+                #end of last saccade
+                if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #valid last datapoint
+                    self.saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
+                    self.nb_valid_sample += 1
+                elif (row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]): #if gaze sample not valid, try to use fixation data instead
+                    self.saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]), EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"])] )
+                    self.nb_valid_sample += 1
+                self.nb_sample += 1
+
+                rate_valid_sample = float(self.nb_valid_sample) / self.nb_sample
+                if rate_valid_sample >= params.VALID_SAMPLES_PROP_SACCADE: #if saccade quality is above the threshold
+                    saccade_duration = EMDAT_core.utils.cast_int(row["RecordingTimestamp"]) - self.saccade_vect[0][0]
+                    dist = EMDAT_core.Recording.get_saccade_distance(self.saccade_vect)
+                    accel = -1#Recording.get_saccade_acceleration(saccade_vect)
+                    speed = float(dist) / EMDAT_core.utils.cast_int(saccade_duration)
+                    data = {"saccadeindex": EMDAT_core.utils.cast_int(self.current_index),
+                            "timestamp": self.saccade_vect[0][0],
+                            "saccadeduration": EMDAT_core.utils.cast_int(saccade_duration),
+                            "saccadestartpointx": self.saccade_vect[0][1],
+                            "saccadestartpointy": self.saccade_vect[0][2],
+                            "saccadeendpointx": self.saccade_vect[-1][1],
+                            "saccadeendpointy": self.saccade_vect[-1][2],
+                            "saccadedistance": dist,
+                            "saccadespeed": speed,
+                            "saccadeacceleration": accel,
+                            "saccadequality": rate_valid_sample
+                            }
+                    self.all_saccade.append(Saccade(data, self.media_offset))
+                    self.nb_valid_sample = 0
+                    self.nb_sample = 0
+
+            elif row["GazeEventType"] == "Saccade":
+                if (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2) and row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]: #ignore data point with no valid data
+                    self.saccade_vect.append( [EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"])] )
+                    self.nb_valid_sample += 1
+                self.nb_sample += 1
+            else: #unclassified gaze samples
+                self.nb_sample += 1
+            self.nb_invalid_temp = 0
+
+        else: #wait for the first fixation
+            if row["GazeEventType"] == "Fixation":
+                self.in_fixation = True
+
+        if row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]:
+            self.last_gaze_coord = (EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["GazePointX (ADCSpx)"]), EMDAT_core.utils.cast_int(row["GazePointY (ADCSpx)"]))
+            self.last_valid = (EMDAT_core.utils.cast_int(row["ValidityLeft"])<2 or EMDAT_core.utils.cast_int(row["ValidityRight"])<2)
+        elif row["GazeEventType"] == "Fixation" and row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]: #if last sample not valid, at least check if valid data about the fixation
+            self.last_gaze_coord = (EMDAT_core.utils.cast_int(row["RecordingTimestamp"]), EMDAT_core.utils.cast_int(row["FixationPointX (MCSpx)"]), EMDAT_core.utils.cast_int(row["FixationPointY (MCSpx)"]))
+            self.last_valid = True
+
+    def resets_state(self, row):
+        """Returns True if the state of the builder after adding row does not depend on the previous rows
+
+        After a fixation sample with gaze coordinates, the builder is in a fixation whatever its previous
+        state, and the next saccade starts from that sample.
+        """
+        return bool(row["EyeTrackerTimestamp"]) and row["GazeEventType"] == "Fixation" and \
+            bool((row["GazePointX (ADCSpx)"] and row["GazePointY (ADCSpx)"]) or
+                 (row["FixationPointX (MCSpx)"] and row["FixationPointY (MCSpx)"]))
+
+    def merge(self, builder, start):
+        """Appends the saccades of another builder from index start and takes the state of its state machine
+        (see TobiiV3Recording.read_builders)
+        """
+        all_saccade = self.all_saccade + builder.all_saccade[start:]
+        self.__dict__.update(builder.__dict__)
+        self.all_saccade = all_saccade
+
+    def __len__(self):
+        return len(self.all_saccade)
+
+
+class EventBuilder:
+    """Builds the list of "Event"s from the rows of a Tobii V3 data file.
+    """
+
+    # the columns read by add_row
+    columns_used = ["RecordingTimestamp", "MouseEventIndex", "MouseEvent", "MouseEventX (MCSpx)", "MouseEventY (MCSpx)",
+                    "KeyPressEventIndex", "KeyPressEvent"]
+
+    def __init__(self, media_offset=(0, 0)):
+        self.media_offset = media_offset
+        self.all_event = []
+
+    def add_row(self, row):
+        if row["MouseEventIndex"] : #mouse event
+            data = {"timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
+                "event": row["MouseEvent"]+"MouseClick",
+                "x_coord": EMDAT_core.utils.cast_int(row["MouseEventX (MCSpx)"]),
+                "y_coord": EMDAT_core.utils.cast_int(row["MouseEventY (MCSpx)"])
+                }
+            self.all_event.append(Event(data, self.media_offset))
+        elif row["KeyPressEventIndex"] : #keyboard event
+            data = {"timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
+                "event": "KeyPress",
+                "key_name": row["KeyPressEvent"]
+                }
+            self.all_event.append(Event(data, self.media_offset))
+
+    def resets_state(self, row):
+        """Returns True if the state of the builder after adding row does not depend on the previous rows
+        """
+        return True
+
+    def merge(self, builder, start):
+        """Appends the events of another builder from index start (see TobiiV3Recording.read_builders)
+        """
+        self.all_event.extend(builder.all_event[start:])
 
-        all_event = []
-        with open(event_file, 'r') as f:
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row["MediaName"] != 'ScreenRec':
-                #if row["MediaName"] != 'Screen Recordings (1)':  # ignore non-recording data point
-                    continue
-                if row["MouseEventIndex"] : #mouse event
-                    data = {"timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
-                        "event": row["MouseEvent"]+"MouseClick",
-                        "x_coord": EMDAT_core.utils.cast_int(row["MouseEventX (MCSpx)"]),
-                        "y_coord": EMDAT_core.utils.cast_int(row["MouseEventY (MCSpx)"])
-                        }
-                    all_event.append(Event(data, self.media_offset))
-                elif row["KeyPressEventIndex"] : #keyboard event
-                    data = {"timestamp": EMDAT_core.utils.cast_int(row["RecordingTimestamp"]),
-                        "event": "KeyPress",
-                        "key_name": row["KeyPressEvent"]
-                        }
-                    all_event.append(Event(data, self.media_offset))
-
-        return all_event
+    def __len__(self):
+        return len(self.all_event)
@@ -21,41 +21,46 @@ EXTERNALLOGDATAFOLDER = "./sampledata/external logs"
 EYETRACKERTYPE = "TobiiV3" #Tobii Studio version 3x
 #EYETRACKERTYPE = "SMI" # SMI/BeGaze
 
+# the folder where the parsed recordings are cached (in binary form), so that the files exported from
+# the eye tracker are parsed again only when they change. None to disable the cache
+RECORDING_CACHE_FOLDER = None
+#RECORDING_CACHE_FOLDER = "./cache"
+
+# the number of gaze samples in each block when the files exported from the eye tracker are read block by block
+SAMPLE_BLOCK_SIZE = 65536
+
+# True to read the gaze samples block by block while the segments are created, in timestamp order, instead of keeping
+# all the samples of a recording in memory (see Recording.process_rec). The samples are then not cached
+# (see RECORDING_CACHE_FOLDER) and the data of the recording cannot be exported (see RecordingExport)
+STREAM_SAMPLES = False
+
+# the number of processes parsing a single data file exported from the eye tracker, split in byte ranges
+# (Tobii V3 uncompressed files only). 1 to parse the files in the current process
+PARSER_PROCESSES = 1
+
 
 # ####################### Eye tracker specific parameters ##############################################################
 
+# The header line and the delimiter of the files exported from the eye trackers are found automatically
+# from the first lines of each file.
+
 # number of extra lines at the beginning of the files exported from Tobii
 # this is specific to study and is based on the number of variables defined in Tobii studio for the experiment
+# (only used to read the events of a participant with Participant.read_events)
 NUMBEROFEXTRAHEADERLINES = 8
 
-# number of lines at the beginning of the 'Fixation-Data' files exported from Tobii before the actual data
-FIXATIONHEADERLINES = 19
-
-# number of lines at the beginning of the 'All-Data' files exported from Tobii before the actual data
-ALLDATAHEADERLINES = 26
-
 # number of lines at the beginning of the 'Event-Data' files exported from Tobii before the actual data
+# (only used to read the events of a participant with Participant.read_events)
 EVENTSHEADERLINES = 27
 
 # number of lines at the beginning of the external log files before the actual data
 ACTIONHEADERLINES = 0
 
-# ### SMI-specific parameters
-# the line number of the first data row in Events file
-EVENTS_FIRST_DATA_LINE = 22
-
-# the line number of the row that contains the table header for fixations
-FIXATION_HEADER_LINE = 11
-
-# the line number of the row that contains the table header for fixations
-SACCADE_HEADER_LINE = 14
-
-# the line number of the row that contains the table header for user events
-USER_EVENT_HEADER_LINE = 20
-
-# the line number of the first data row in Raw file
-RAW_HEADER_LINE = 1
+# the name of the media of the gaze samples and events to read from the files exported from Tobii Studio V3,
+# the rows of the other media being ignored (e.g., "Screen Recordings (1)" depending on the export)
+RECORDING_MEDIA_NAME = "ScreenRec"
 
+# ### SMI-specific parameters
 #L or R for using left/right eye event when averaging both eyes measures is not possible
 MONOCULAR_EYE = "L"
 
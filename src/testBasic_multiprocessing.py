@@ -10,7 +10,7 @@ Institution: The University of British Columbia.
 
 from multiprocessing import freeze_support, cpu_count
 from BasicParticipant_multiprocessing import *
-from EMDAT_core.Participant import export_features_all, write_features_tsv
+from EMDAT_core.Participant import export_features_all, write_features_tsv, FeatureTSVWriter
 from EMDAT_core.ValidityProcessing import output_Validity_info_Segments, output_percent_discarded, output_Validity_info_Participants
 
 if __name__ == '__main__':
@@ -26,6 +26,18 @@ if __name__ == '__main__':
     #
     #alogoffset =[ 3,  2, 2]    # the time sifference between the eye tracker logs and the external log
 
+    ###### Only calculate the features exported below (features and AOI sequences)
+    aoi_feat_names = (map(lambda x:x, params.aoigeneralfeat))
+    feature_families = plan_features(params.featurelist + params.aoisequencefeat, aoifeaturelist = aoi_feat_names)
+    # the features are exported by the worker processes, which only send back the feature tables
+    exports = [{'featurelist': params.featurelist, 'aoifeaturelist': aoi_feat_names, 'id_prefix': False},
+               {'featurelist': params.aoisequencefeat, 'aoifeaturelist': aoi_feat_names, 'id_prefix': False}]
+
+    ##### WRITE features and AOI sequences to file as the participants are read
+    print "Exporting features:\n--General:", params.featurelist, "\n--AOI:", aoi_feat_names, "\n--Sequences:", params.aoisequencefeat
+    writers = [FeatureTSVWriter('./outputfolder/sample_features_multiprocessing.tsv', **exports[0]),
+               FeatureTSVWriter('./outputfolder/sample_sequences_multiprocessing.tsv', **exports[1])]
+
     ###### Read participants
     nbprocess = cpu_count()
     ps = read_participants_Basic_multiprocessing(nbprocess, user_list = ul,pids = uids, log_time_offsets = alogoffset, datadir=params.EYELOGDATAFOLDER, 
@@ -33,7 +45,10 @@ if __name__ == '__main__':
                                aoifile = "./sampledata/general.aoi",
     #                           aoifile = "./sampledata/Dynamic_1.aoi",
                                require_valid_segs = False, auto_partition_low_quality_segments = True,
-                               rpsfile = "./sampledata/all_rest_pupil_sizes.tsv")
+                               rpsfile = "./sampledata/all_rest_pupil_sizes.tsv", feature_families = feature_families,
+                               exports = exports, writers = writers)
+    for writer in writers:
+        writer.close()
     print
     ######
 
@@ -45,15 +60,6 @@ if __name__ == '__main__':
         output_Validity_info_Participants(ps, include_restored_samples =True, auto_partition_low_quality_segments_flag = False)
 
 
-    ##### WRITE features to file
-    print
-    aoi_feat_names = (map(lambda x:x, params.aoigeneralfeat))
-    print "Exporting features:\n--General:", params.featurelist, "\n--AOI:", aoi_feat_names, "\n--Sequences:", params.aoisequencefeat
-    write_features_tsv(ps, './outputfolder/sample_features_multiprocessing.tsv',featurelist = params.featurelist, aoifeaturelist=aoi_feat_names, id_prefix = False)
-
-    ##### WRITE AOI sequences to file
-    write_features_tsv(ps, './outputfolder/sample_sequences_multiprocessing.tsv',featurelist = params.aoisequencefeat, aoifeaturelist=aoi_feat_names, id_prefix = False)
-
     #### Export pupil dilations for each scene to a separate file
     #print "--pupil dilation trends" 
     #plot_pupil_dilation_all(ps, './outputfolder/pupilsizes/', "problem1")
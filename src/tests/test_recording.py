@@ -0,0 +1,124 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Tests of the processing of the samples of a recording block by block (EMDAT_core.Recording.split_sample_blocks and
+params.STREAM_SAMPLES). Run from the 'src' folder with:
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import params
+from EMDAT_core.data_structures import DatapointArray
+from EMDAT_core.Recording import split_sample_blocks
+from EMDAT_core.utils import TimestampIndex
+from EMDAT_eyetracker.TobiiV3Recording import TobiiV3Recording
+from tobiiv3_export import write_tobiiv3_export
+
+
+def make_samples(timestamps):
+    """Returns a DatapointArray with the given timestamps, the other columns being the index of each sample
+    """
+    columns = dict(map(lambda (name, dtype): (name, range(len(timestamps))), DatapointArray.fields))
+    columns.update({"timestamp": timestamps, "stimuliname": ["ScreenRec"] * len(timestamps)})
+    return DatapointArray(columns)
+
+
+class SplitSampleBlocksTest(unittest.TestCase):
+    """The samples of each interval are the same as the ones found by get_chunk in all the samples
+    """
+
+    def setUp(self):
+        # a few samples with the same timestamp, in particular across blocks
+        timestamps = range(0, 1000, 10)
+        timestamps[20:26] = [200] * 6
+        self.samples = make_samples(timestamps)
+
+    def assert_split(self, block_size, intervals):
+        blocks = map(lambda i: self.samples[i:i + block_size], range(0, len(self.samples), block_size))
+        index = TimestampIndex(self.samples)
+        chunks = list(split_sample_blocks(iter(blocks), intervals))
+        self.assertEqual(len(chunks), len(intervals))
+        for (start, end), (sample_start, samples) in zip(intervals, chunks):
+            _, all_start, all_end = index.get_chunk(0, start, end)
+            self.assertEqual(sample_start, all_start)
+            self.assertEqual(samples.fixationindex.tolist(), range(all_start, all_end))
+
+    def test_split(self):
+        intervals = [(-50, -10), (-5, 35), (0, 990), (5, 5), (10, 250), (200, 200), (200, 640), (300, 310), (305, 301),
+                     (640, 2000), (989, 991), (995, 3000), (4000, 5000)]
+        for block_size in [1, 7, 10, 64, 100, 1000]:
+            self.assert_split(block_size, intervals)
+            # each interval on its own, no block being read yet
+            for interval in intervals:
+                self.assert_split(block_size, [interval])
+
+    def test_no_samples(self):
+        self.samples = self.samples[:0]
+        self.assert_split(10, [(0, 10), (20, 30)])
+
+    def test_unsorted_blocks(self):
+        blocks = [self.samples[50:60], self.samples[0:10]]
+        self.assertRaises(Exception, list, split_sample_blocks(iter(blocks), [(0, 1000)]))
+
+
+class StreamSamplesTest(unittest.TestCase):
+    """The "Segment"s and "Scene"s created from the blocks of samples are the same as the ones created from all the
+    samples of the recording
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.folder, "P1_Data_Export.tsv")
+        write_tobiiv3_export(self.data_file, 120000, seed=3)
+        self.saved_params = (params.STREAM_SAMPLES, params.SAMPLE_BLOCK_SIZE, params.RECORDING_CACHE_FOLDER,
+                             params.VERBOSE)
+        params.RECORDING_CACHE_FOLDER = None
+        params.VERBOSE = "QUIET"
+        # overlapping segments, not sorted by start time
+        self.scenelist = {"s1": [("s1_a", 60000, 90000), ("s1_b", 1000, 20000)],
+                          "s2": [("s2_a", 15000, 70000)],
+                          "s3": [("s3_a", 95000, 118000), ("s3_b", 30000, 33000), ("s3_c", 130000, 140000)]}
+
+    def tearDown(self):
+        params.STREAM_SAMPLES, params.SAMPLE_BLOCK_SIZE, params.RECORDING_CACHE_FOLDER, params.VERBOSE = \
+            self.saved_params
+        shutil.rmtree(self.folder)
+
+    def process(self, stream_samples, **kwargs):
+        params.STREAM_SAMPLES = stream_samples
+        params.SAMPLE_BLOCK_SIZE = 500
+        recording = TobiiV3Recording(self.data_file, self.data_file, self.data_file, self.data_file)
+        self.assertEqual(recording.all_data is None, stream_samples)
+        segments, scenes = recording.process_rec(scenelist=self.scenelist, aoilist=[], require_valid_segs=False,
+                                                 **kwargs)
+
+        # nan features are compared by their representation
+        return (map(lambda seg: (seg.segid, seg.get_indices(), repr(sorted(seg.features.items()))), segments),
+                map(lambda sc: (sc.scid, repr(sorted(sc.features.items()))), scenes))
+
+    def assert_same_segments(self, **kwargs):
+        segments, scenes = self.process(False, **kwargs)
+        self.assertEqual(len(scenes), 3)
+        self.assertEqual(self.process(True, **kwargs), (segments, scenes))
+        return segments
+
+    def test_stream_samples(self):
+        self.assertEqual(len(self.assert_same_segments()), 5)
+
+    def test_prune_length(self):
+        self.assert_same_segments(prune_length=3000)
+
+    def test_auto_partition(self):
+        params.MAX_SEG_TIMEGAP, saved = 10, params.MAX_SEG_TIMEGAP
+        try:
+            segments = self.assert_same_segments(auto_partition_low_quality_segments=True)
+        finally:
+            params.MAX_SEG_TIMEGAP = saved
+        self.assertTrue(len(segments) > 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Tests of the on-disk cache of parsed recordings (EMDAT_core.RecordingCache). Run from the 'src' folder with:
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import params
+from EMDAT_core import RecordingCache
+from EMDAT_eyetracker.TobiiV3Recording import TobiiV3Recording
+from tobiiv3_export import write_tobiiv3_export, get_recording_values
+
+
+class CountingRecording(TobiiV3Recording):
+    """A TobiiV3Recording counting the times the exported files are parsed
+    """
+    parses = 0
+
+    def read_data(self, *args):
+        CountingRecording.parses += 1
+        TobiiV3Recording.read_data(self, *args)
+
+
+class RecordingCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.data_file = os.path.join(self.folder, "P1_Data_Export.tsv")
+        write_tobiiv3_export(self.data_file, 60000, seed=1)
+        self.saved_params = dict(map(lambda name: (name, getattr(params, name)),
+                                     ["RECORDING_CACHE_FOLDER", "VALID_SAMPLES_PROP_SACCADE"] + RecordingCache.READER_PARAMS))
+        params.RECORDING_CACHE_FOLDER = os.path.join(self.folder, "cache")
+        CountingRecording.parses = 0
+
+    def tearDown(self):
+        for name, value in self.saved_params.items():
+            setattr(params, name, value)
+        shutil.rmtree(self.folder)
+
+    def read(self, cache=True):
+        cache_folder = params.RECORDING_CACHE_FOLDER
+        if not cache:
+            params.RECORDING_CACHE_FOLDER = None
+        try:
+            return CountingRecording(self.data_file, self.data_file, self.data_file, self.data_file)
+        finally:
+            params.RECORDING_CACHE_FOLDER = cache_folder
+
+    def test_warm_cache(self):
+        parsed = get_recording_values(self.read(cache=False))
+        self.assertEqual(get_recording_values(self.read()), parsed)
+        self.assertEqual(CountingRecording.parses, 2)
+        # the second read is served from the cache
+        self.assertEqual(get_recording_values(self.read()), parsed)
+        self.assertEqual(CountingRecording.parses, 2)
+
+    def test_parse_parameter_invalidates_cache(self):
+        params.VALID_SAMPLES_PROP_SACCADE = 1
+        strict = self.read()
+        params.VALID_SAMPLES_PROP_SACCADE = 0.5
+        lenient = self.read()
+        self.assertEqual(CountingRecording.parses, 2)
+        self.assertNotEqual(len(lenient.sac_data), len(strict.sac_data))
+        self.assertEqual(get_recording_values(lenient), get_recording_values(self.read(cache=False)))
+        # each threshold has its own cache entry
+        params.VALID_SAMPLES_PROP_SACCADE = 1
+        self.assertEqual(get_recording_values(self.read()), get_recording_values(strict))
+        self.assertEqual(CountingRecording.parses, 3)
+
+    def test_key_has_reader_params(self):
+        recording = self.read()
+        key = RecordingCache.get_cache_key(recording, self.data_file, self.data_file)
+        for name in RecordingCache.READER_PARAMS:
+            value = getattr(params, name)
+            setattr(params, name, "changed")
+            self.assertNotEqual(RecordingCache.get_cache_key(recording, self.data_file, self.data_file), key, name)
+            setattr(params, name, value)
+        self.assertEqual(RecordingCache.get_cache_key(recording, self.data_file, self.data_file), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Tests of the Tobii V3 reader (EMDAT_eyetracker.TobiiV3Recording). Run from the 'src' folder with:
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import params
+from EMDAT_eyetracker import TobiiV3Recording as TobiiV3
+from tobiiv3_export import write_tobiiv3_export, get_recording_values
+
+
+class ByteRangeTest(unittest.TestCase):
+    """The parallel parse of byte ranges gives the same data as the serial parse, the state of the builders (open
+    fixations and saccades, last pupil sizes and timestamp for the pupil velocity) being carried across the ranges
+    """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.saved_params = (params.PARSER_PROCESSES, params.RECORDING_CACHE_FOLDER, TobiiV3.MIN_BYTE_RANGE_SIZE)
+        params.RECORDING_CACHE_FOLDER = None
+
+    def tearDown(self):
+        params.PARSER_PROCESSES, params.RECORDING_CACHE_FOLDER, TobiiV3.MIN_BYTE_RANGE_SIZE = self.saved_params
+        shutil.rmtree(self.folder)
+
+    def read(self, data_file, processes, min_byte_range_size):
+        params.PARSER_PROCESSES = processes
+        TobiiV3.MIN_BYTE_RANGE_SIZE = min_byte_range_size
+        recording = TobiiV3.TobiiV3Recording(data_file, data_file, data_file, data_file)
+        if processes > 1:
+            layout = recording.get_layout(data_file, [TobiiV3.SampleBuilder()])
+            self.assertTrue(len(TobiiV3.get_byte_ranges(data_file, layout, processes)[1]) > 1)
+        return recording
+
+    def assert_same_parse(self, duration, processes, min_byte_range_size):
+        data_file = os.path.join(self.folder, "P1_Data_Export.tsv")
+        write_tobiiv3_export(data_file, duration, seed=duration)
+        serial = self.read(data_file, 1, min_byte_range_size)
+        parallel = self.read(data_file, processes, min_byte_range_size)
+        self.assertEqual(get_recording_values(parallel), get_recording_values(serial))
+        # each kind of data read on its own
+        parallel.all_data = parallel.read_all_data(data_file)
+        parallel.fix_data = parallel.read_fixation_data(data_file)
+        parallel.sac_data = parallel.read_saccade_data(data_file)
+        parallel.event_data = parallel.read_event_data(data_file)
+        self.assertEqual(get_recording_values(parallel), get_recording_values(serial))
+
+    def test_small_ranges(self):
+        # ranges of about 50 rows, shorter than the longest fixations
+        self.assert_same_parse(10000, 12, 1009)
+
+    def test_ranges(self):
+        for min_byte_range_size in [20011, 5003]:
+            self.assert_same_parse(60000, 8, min_byte_range_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Tests of the helpers of EMDAT_core.utils. Run from the 'src' folder with:
+    python -m unittest discover tests
+"""
+
+import os
+import bz2
+import zlib
+import shutil
+import tempfile
+import unittest
+import random
+import numpy as np
+from EMDAT_core.data_structures import DatapointArray
+from EMDAT_core.utils import cast_float, cast_int, cast_float_column, cast_int_column, DecompressedFile, \
+    RunningStats, merge_stats, mean, stddev, get_validity_gaps, get_gap_bounds, get_blinks, get_segment_blinks
+
+
+class CastColumnTest(unittest.TestCase):
+
+    def assert_float_column(self, strings):
+        expected = map(lambda v: cast_float(v), strings)
+        values = cast_float_column(strings)
+        self.assertEqual(len(values), len(strings))
+        for value, exp in zip(values, expected):
+            if exp is None or np.isnan(exp):
+                self.assertTrue(np.isnan(value))
+            else:
+                self.assertEqual(value, exp)
+
+    def assert_int_column(self, strings):
+        expected = map(lambda v: cast_int(v), strings)
+        values, is_valid = cast_int_column(strings)
+        self.assertEqual(list(is_valid), map(lambda v: v is not None, expected))
+        self.assertEqual(map(int, values[is_valid]), filter(lambda v: v is not None, expected))
+
+    def test_float_column(self):
+        self.assert_float_column(['1.5', '', '-2', '3e2', '.5', 'nan', '-inf'])
+        self.assert_float_column([])
+
+    def test_float_column_malformed(self):
+        # the last value is not a number, but starts with one
+        self.assert_float_column(['1.5', '2', '3,5'])
+        self.assert_float_column(['1', '1e'])
+        self.assert_float_column(['1', '0x10'])
+        self.assert_float_column(['1', '1.5.5', '2'])
+
+    def test_int_column(self):
+        self.assert_int_column(['1', '', '-12', '0'])
+        self.assert_int_column([])
+
+    def test_int_column_malformed(self):
+        self.assert_int_column(['1', '12-'])
+        self.assert_int_column(['1', '1-2', '3'])
+        self.assert_int_column(['1', '--1'])
+        self.assert_int_column(['-', '1'])
+
+
+class DecompressedFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read_concatenated(self, compression, streams, chunk_size):
+        filename = os.path.join(self.folder, "data." + compression)
+        with open(filename, "wb") as f:
+            f.write("".join(streams))
+        with DecompressedFile(filename, compression, chunk_size=chunk_size) as f:
+            return f.readlines()
+
+    def gzip(self, data):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(data) + compressor.flush()
+
+    def test_concatenated_streams(self):
+        lines = map(lambda i: "%d\t%d\n" % (i, i * i), range(1000))
+        first, second = "".join(lines[:400]), "".join(lines[400:])
+        for (compression, compress) in [("gz", self.gzip), ("bz2", bz2.compress)]:
+            streams = [compress(first), compress(second)]
+            # the first stream ends inside a chunk, then exactly at the end of a chunk
+            for chunk_size in [1000, len(streams[0])]:
+                self.assertEqual(self.read_concatenated(compression, streams, chunk_size), lines)
+
+
+class RunningStatsTest(unittest.TestCase):
+
+    values = [3.5, -1.25, 7, 0.5, 12.75, 4, 4, -6.5, 2.25]
+
+    def assert_stats(self, stats, values):
+        self.assertEqual(stats.count, len(values))
+        if len(values) == 0:
+            self.assertEqual((stats.total, stats.mean), (0, 0))
+            self.assertEqual((stats.min, stats.max, stats.first, stats.last), (None, None, None, None))
+            self.assertTrue(np.isnan(stats.stddev()))
+            return
+        self.assertAlmostEqual(stats.total, sum(values))
+        self.assertAlmostEqual(stats.mean, mean(values))
+        if len(values) < 2:
+            self.assertTrue(np.isnan(stats.stddev()))
+            self.assertEqual(stats.stddev(0), 0)
+        else:
+            self.assertAlmostEqual(stats.stddev(), stddev(values))
+        self.assertEqual((stats.min, stats.max), (min(values), max(values)))
+        self.assertEqual((stats.first, stats.last), (values[0], values[-1]))
+
+    def test_values(self):
+        self.assert_stats(RunningStats(self.values), self.values)
+        self.assert_stats(RunningStats([5]), [5])
+        self.assert_stats(RunningStats([]), [])
+
+    def test_merge(self):
+        # every split of the values, including empty and single-value sides
+        for i in range(len(self.values) + 1):
+            left, right = self.values[:i], self.values[i:]
+            self.assert_stats(RunningStats(left).merge(RunningStats(right)), self.values)
+
+    def test_merge_empty(self):
+        self.assert_stats(RunningStats().merge(RunningStats()), [])
+        self.assert_stats(RunningStats([2]).merge(RunningStats()), [2])
+        self.assert_stats(RunningStats().merge(RunningStats([2])), [2])
+
+    def test_merge_stats(self):
+        parts = [self.values[:2], [], self.values[2:3], self.values[3:7], [], self.values[7:]]
+        self.assert_stats(merge_stats(map(RunningStats, parts)), self.values)
+        self.assert_stats(merge_stats([]), [])
+
+    def test_add(self):
+        stats = RunningStats()
+        for (i, value) in enumerate(self.values):
+            stats.add(value)
+            self.assert_stats(stats, self.values[:i+1])
+
+    def test_merge_does_not_change_other(self):
+        other = RunningStats(self.values[3:])
+        RunningStats(self.values[:3]).merge(other)
+        self.assert_stats(other, self.values[3:])
+
+
+def get_gaps_loop(is_valid, timestamps):
+    """Returns the gaps of invalid samples found with a loop over the samples
+    """
+    gaps = []
+    start = None
+    for valid, timestamp in zip(is_valid, timestamps):
+        if not valid and start is None:
+            start = timestamp
+        elif valid and start is not None:
+            gaps.append((start, timestamp))
+            start = None
+    if start is not None:
+        gaps.append((start, timestamps[-1]))
+    return gaps
+
+
+class GapBoundsTest(unittest.TestCase):
+    """The gaps and blinks found from the run-length encoding of the validity of the samples
+    """
+
+    def setUp(self):
+        self.timestamps = np.arange(0, 1600, 16, dtype=np.int64)
+
+    def assert_gaps(self, is_valid, gaps):
+        is_valid = np.asarray(is_valid, dtype=bool)
+        timestamps = self.timestamps[:len(is_valid)]
+        self.assertEqual(get_validity_gaps(is_valid, timestamps), gaps)
+        self.assertEqual(get_gaps_loop(is_valid, timestamps), gaps)
+
+    def test_gaps(self):
+        self.assert_gaps([1, 0, 0, 1, 1, 0, 1], [(16, 48), (80, 96)])
+        # gaps at the start and at the end of the samples
+        self.assert_gaps([0, 0, 1, 1, 0, 1, 0, 0], [(0, 32), (64, 80), (96, 112)])
+        self.assert_gaps([0, 1], [(0, 16)])
+        self.assert_gaps([1, 0], [(16, 16)])
+
+    def test_all_valid_or_invalid(self):
+        self.assert_gaps([1] * 10, [])
+        self.assert_gaps([0] * 10, [(0, 144)])
+        self.assert_gaps([1], [])
+        self.assert_gaps([0], [(0, 0)])
+        self.assert_gaps([], [])
+
+    def test_ranges(self):
+        rnd = random.Random(0)
+        is_valid = np.array(map(lambda i: rnd.random() < 0.7, range(len(self.timestamps))))
+        is_valid[:3] = False
+        is_valid[-2:] = False
+        ranges = [(0, 100), (0, 1), (0, 5), (2, 9), (95, 100), (99, 100), (10, 10), (40, 60), (3, 97)]
+        # ranges starting and ending within gaps, and ranges of only valid or only invalid samples
+        ranges += [(0, 3), (98, 100), (int(np.flatnonzero(is_valid)[0]), int(np.flatnonzero(is_valid)[0]) + 1)]
+        bounds = get_gap_bounds(is_valid, self.timestamps, ranges)
+        self.assertEqual(len(bounds), len(ranges))
+        for (start, end), (gap_starts, gap_ends) in zip(ranges, bounds):
+            self.assertEqual(zip(gap_starts.tolist(), gap_ends.tolist()),
+                             get_gaps_loop(is_valid[start:end], self.timestamps[start:end]))
+
+    def test_segment_blinks(self):
+        rnd = random.Random(1)
+        n = len(self.timestamps)
+        is_valid_blink = [False] * 4
+        while len(is_valid_blink) < n:
+            is_valid_blink += [True] * rnd.randint(1, 8) + [False] * rnd.randint(1, 12)
+        is_valid_blink = is_valid_blink[:n]
+        columns = dict(map(lambda (name, dtype): (name, [0] * n), DatapointArray.fields))
+        columns.update({"timestamp": self.timestamps, "is_valid_blink": is_valid_blink, "stimuliname": ["ScreenRec"] * n})
+        all_data = DatapointArray(columns)
+        ranges = [(0, n), (0, 20), (7, 33), (50, n), (60, 61)]
+        for threshold in [None, (48, 112)]:
+            blinks = get_segment_blinks(all_data, ranges, threshold)
+            for (start, end), (durations, intervals) in zip(ranges, blinks):
+                gaps = get_gaps_loop(is_valid_blink[start:end], self.timestamps[start:end].tolist())
+                if threshold is not None:
+                    gaps = filter(lambda (gap_start, gap_end): threshold[0] <= gap_end - gap_start <= threshold[1], gaps)
+                self.assertEqual(durations.tolist(), map(lambda (gap_start, gap_end): gap_end - gap_start, gaps))
+                self.assertEqual(intervals.tolist(), map(lambda (g1, g2): g2[0] - g1[1], zip(gaps[:-1], gaps[1:])))
+            [(gap_starts, gap_ends)] = get_gap_bounds(all_data.is_valid_blink, all_data.timestamp)
+            durations, intervals = get_blinks(gap_starts, gap_ends, threshold)
+            self.assertTrue(len(durations) > 1)
+            self.assertEqual(blinks[0][0].tolist(), durations.tolist())
+            self.assertEqual(blinks[0][1].tolist(), intervals.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+UBC Eye Movement Data Analysis Toolkit (EMDAT), Version 3
+
+Writes small synthetic Tobii Studio V3 data exports ("Data_Export.tsv") for the tests: rows of another media,
+fixations, saccades with invalid samples, blinks (gaps of invalid samples), mouse clicks and key presses.
+"""
+
+import math
+import random
+import numpy as np
+from EMDAT_core.data_structures import DatapointArray
+from EMDAT_core.RecordingCache import FIXATION_FIELDS, SACCADE_FIELDS, EVENT_FIELDS
+
+COLUMNS = ["ParticipantName", "RecordingTimestamp", "EyeTrackerTimestamp", "MediaName",
+           "MouseEventIndex", "MouseEvent", "MouseEventX (MCSpx)", "MouseEventY (MCSpx)",
+           "KeyPressEventIndex", "KeyPressEvent",
+           "FixationIndex", "SaccadeIndex", "GazeEventType", "GazeEventDuration",
+           "FixationPointX (MCSpx)", "FixationPointY (MCSpx)",
+           "GazePointX (ADCSpx)", "GazePointY (ADCSpx)",
+           "GazePointX (MCSpx)", "GazePointY (MCSpx)",
+           "DistanceLeft", "DistanceRight", "PupilLeft", "PupilRight",
+           "ValidityLeft", "ValidityRight"]
+
+
+def write_tobiiv3_export(filename, duration, seed=0):
+    """Writes a synthetic Tobii V3 data export
+
+    Args:
+        filename: the name of the file to write
+        duration: the duration of the recording in milliseconds
+        seed: the seed of the random generator (the same seed gives the same file)
+    """
+    rnd = random.Random(seed)
+    rows = []
+
+    def new_row(t, media="ScreenRec"):
+        row = dict.fromkeys(COLUMNS, "")
+        row.update({"ParticipantName": "P1", "RecordingTimestamp": str(t), "EyeTrackerTimestamp": str(1000 + t),
+                    "MediaName": media})
+        rows.append(row)
+        return row
+
+    t = 0
+    for i in range(5):
+        new_row(t, media="Other").update({"GazeEventType": "Unclassified", "ValidityLeft": "0", "ValidityRight": "0"})
+        t += 16
+    state, remaining = "fix", 0
+    fixindex = sacindex = mouseindex = keyindex = 0
+    fx = fy = fixduration = 0
+    pupil, distance = 3.0, 550.0
+    while t < duration:
+        if remaining <= 0:
+            if state == "fix":
+                state = rnd.choice(["sac", "sac", "sac", "unc"])
+                remaining = rnd.randint(2, 6)
+                sacindex += state == "sac"
+            else:
+                state = "fix"
+                remaining = rnd.randint(5, 30)
+                fixindex += 1
+                fx, fy = rnd.randint(0, 1280), rnd.randint(0, 1024)
+                fixduration = remaining * 16
+        remaining -= 1
+        if rnd.random() < 0.004:
+            # a blink
+            for k in range(rnd.randint(5, 18)):
+                new_row(t).update({"GazeEventType": "Unclassified", "ValidityLeft": "4", "ValidityRight": "4"})
+                t += 16
+        u = rnd.random()
+        validity = (0, 0) if u < 0.85 else (0, 4) if u < 0.92 else (4, 4)
+        row = new_row(t)
+        row.update({"ValidityLeft": str(validity[0]), "ValidityRight": str(validity[1])})
+        if state == "fix":
+            row.update({"GazeEventType": "Fixation", "FixationIndex": str(fixindex), "GazeEventDuration": str(fixduration),
+                        "FixationPointX (MCSpx)": str(fx), "FixationPointY (MCSpx)": str(fy)})
+            gx, gy = fx + rnd.randint(-10, 10), fy + rnd.randint(-10, 10)
+        else:
+            if state == "sac":
+                row.update({"GazeEventType": "Saccade", "SaccadeIndex": str(sacindex), "GazeEventDuration": "48"})
+            else:
+                row["GazeEventType"] = "Unclassified"
+            gx, gy = rnd.randint(0, 1280), rnd.randint(0, 1024)
+        if min(validity) < 2:
+            row.update({"GazePointX (ADCSpx)": str(gx), "GazePointY (ADCSpx)": str(gy),
+                        "GazePointX (MCSpx)": str(gx), "GazePointY (MCSpx)": str(gy)})
+            pupil += rnd.uniform(-0.05, 0.05)
+            distance += rnd.uniform(-1, 1)
+            if validity[0] < 2:
+                row.update({"PupilLeft": "%.2f" % pupil, "DistanceLeft": "%.2f" % distance})
+            if validity[1] < 2:
+                row.update({"PupilRight": "%.2f" % (pupil + 0.1), "DistanceRight": "%.2f" % (distance + 3)})
+        t += rnd.choice([16, 17, 17])
+        v = rnd.random()
+        if v < 0.01:
+            mouseindex += 1
+            new_row(t).update({"MouseEventIndex": str(mouseindex), "MouseEvent": rnd.choice(["Left", "Left", "Right"]),
+                               "MouseEventX (MCSpx)": str(rnd.randint(0, 1280)),
+                               "MouseEventY (MCSpx)": str(rnd.randint(0, 1024))})
+        elif v < 0.015:
+            keyindex += 1
+            new_row(t).update({"KeyPressEventIndex": str(keyindex), "KeyPressEvent": rnd.choice(["A", "B", "Space"])})
+
+    with open(filename, "w") as f:
+        f.write("\t".join(COLUMNS) + "\n")
+        for row in rows:
+            f.write("\t".join(map(lambda c: row[c], COLUMNS)) + "\n")
+
+
+def get_recording_values(recording):
+    """Returns the values of the samples, fixations, saccades and events of a Recording, to compare recordings
+
+    Args:
+        recording: a Recording
+
+    Returns:
+        a tuple (dict of the sample columns as lists, lists of tuples of the attributes of the "Fixation"s,
+        "Saccade"s and "Event"s), nan being replaced with None so that the values can be compared with ==
+    """
+    def comparable(value):
+        return None if isinstance(value, float) and math.isnan(value) else value
+
+    def get_objects(data, fields):
+        if data is None:
+            return None
+        return map(lambda obj: tuple(map(lambda (_, attr): comparable(getattr(obj, attr)), fields)), data)
+
+    columns = dict(map(lambda (name, _): (name, map(comparable, np.asarray(getattr(recording.all_data, name)).tolist())),
+                       DatapointArray.fields))
+    return (columns, get_objects(recording.fix_data, FIXATION_FIELDS), get_objects(recording.sac_data, SACCADE_FIELDS),
+            get_objects(recording.event_data, EVENT_FIELDS))